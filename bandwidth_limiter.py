@@ -0,0 +1,134 @@
+"""Global bandwidth limit for file downloads, so downloads can run during
+school hours without saturating the campus uplink.
+
+http_downloader calls consume() for every chunk of bytes it receives.
+The limit is enforced with a token bucket shared by all the download threads
+& processes: the bucket fills with tokens at the allowed rate, each byte
+received takes a token, & a thread that finds the bucket empty sleeps until
+enough tokens have accumulated. The bucket holds at most BURST_SECONDS worth
+of tokens, so an idle spell doesn't allow a long burst afterwards.
+
+So that shard processes started on the same exports folder share the budget,
+the bucket is kept in a small file in the exports folder & updated under its
+file lock. See file_lock.py. To save taking the lock for every chunk, each
+process takes RESERVE_SECONDS worth of tokens at a time & hands them out to
+its own threads. Until the exports folder exists, the bucket is kept in memory.
+
+The rate can follow a time-of-day schedule. SCHEDULE is a list of
+(start hour, end hour, bytes per second) tuples in local time. An entry whose
+end hour is earlier than its start hour wraps around midnight. Outside the
+scheduled periods, BYTES_PER_SECOND applies. A rate of None means no limit.
+For example, to allow 2MB/s from 7am to 5pm on weekdays & run unthrottled otherwise:
+
+    BYTES_PER_SECOND = None
+    SCHEDULE = [(7, 17, 2 * 1024 * 1024)]
+    SCHEDULE_WEEKDAYS_ONLY = True
+
+10.19.2026 tps Created.
+10.19.2026 tps Share the bucket between processes, so shard processes share one budget.
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+
+import file_lock
+import path_consts
+
+#################### Constants ####################
+
+BYTES_PER_SECOND = None     # Default download rate limit, or None for no limit.
+SCHEDULE = []               # List of (start hour, end hour, bytes per second) tuples.
+SCHEDULE_WEEKDAYS_ONLY = True   # Only apply the schedule Monday through Friday.
+BURST_SECONDS = 1.0         # Bucket holds this many seconds worth of tokens.
+RESERVE_SECONDS = 0.1       # Each process takes this many seconds worth of tokens from the shared bucket at a time.
+
+#################### Module Variables ####################
+
+lock = threading.Lock()     # Serializes bucket updates from download worker threads.
+tokens = 0.0                # Tokens in the in-memory bucket. Negative when threads have borrowed ahead.
+last_refill_time = None     # When tokens were last added to the in-memory bucket.
+reserved_tokens = 0.0       # Tokens this process has taken from the bucket but not handed out yet.
+
+#################### Helper Functions ####################
+
+def get_current_rate(now=None):
+    """Return the download rate limit in bytes per second for the given time, or None for no limit."""
+    if now is None:
+        now = datetime.datetime.now()
+    if (not SCHEDULE_WEEKDAYS_ONLY) or (now.weekday() < 5):
+        for (start_hour, end_hour, rate) in SCHEDULE:
+            if start_hour <= end_hour:
+                in_period = start_hour <= now.hour < end_hour
+            else:
+                in_period = (now.hour >= start_hour) or (now.hour < end_hour)
+            if in_period:
+                return rate
+    return BYTES_PER_SECOND
+
+def take_tokens(bucket_tokens, bucket_refill_time, token_count, rate):
+    """Top up a bucket for the time since its last refill & take tokens from it,
+    borrowing ahead if there aren't enough. Later callers see the debt, so the
+    total rate stays under the limit.
+    Returns tuple of (tokens left, refill time, seconds to wait for the tokens taken).
+    """
+    now = time.time()
+    if bucket_refill_time is None:
+        bucket_refill_time = now
+    bucket_tokens = min(bucket_tokens + (now - bucket_refill_time) * rate, rate * BURST_SECONDS)
+    bucket_tokens -= token_count
+    wait = -bucket_tokens / rate if bucket_tokens < 0 else 0
+    return (bucket_tokens, now, wait)
+
+def take_shared_tokens(token_count, rate):
+    """Take tokens from the bucket shared by all processes. Call with the module lock held.
+    Returns seconds to wait for the tokens.
+    """
+    global tokens, last_refill_time
+
+    if not os.path.isdir(path_consts.EXPORTS_FOLDER):
+        (tokens, last_refill_time, wait) = take_tokens(tokens, last_refill_time, token_count, rate)
+        return wait
+
+    file_name = path_consts.BANDWIDTH_BUCKET_FILE_NAME
+    with file_lock.locked(file_name):
+        bucket = {}
+        if os.path.isfile(file_name):
+            try:
+                with open(file_name, 'r') as f:
+                    bucket = json.load(f)
+            except ValueError:
+                pass    # Start a new bucket if a process died while writing it.
+        (bucket_tokens, bucket_refill_time, wait) = take_tokens(
+            bucket.get('tokens', 0.0), bucket.get('last_refill_time'), token_count, rate)
+        with open(file_name, 'w') as f:
+            json.dump({'tokens': bucket_tokens, 'last_refill_time': bucket_refill_time}, f)
+    return wait
+
+#################### Limiter Functions ####################
+
+def consume(byte_count):
+    """Take tokens for bytes received from the bucket, sleeping if the
+    download is getting ahead of the rate limit.
+    """
+    global reserved_tokens
+
+    rate = get_current_rate()
+    if rate is None:
+        return
+
+    with lock:
+        # Hand out tokens this process has already taken, if there are enough.
+        if reserved_tokens >= byte_count:
+            reserved_tokens -= byte_count
+            return
+
+        # Otherwise take a new reserve from the shared bucket.
+        token_count = max(byte_count - reserved_tokens, rate * RESERVE_SECONDS)
+        wait = take_shared_tokens(token_count, rate)
+        reserved_tokens += token_count - byte_count
+
+    if wait > 0:
+        time.sleep(wait)
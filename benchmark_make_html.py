@@ -0,0 +1,98 @@
+"""Benchmark student HTML page generation against the number of submissions
+a student has. Writes a synthetic student folder for each submission count
+to a temporary folder, times make_html.make_student_page() on it, & prints
+a table of the results. Nothing in the exports folder is touched.
+
+Usage:
+    python benchmark_make_html.py [submission count ...]
+
+10.19.2026 tps Created.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import export_student_artifacts
+import make_html
+import path_consts
+import script_logging
+
+#################### Constants ####################
+
+SUBMISSION_COUNTS = [10, 50, 100, 500, 1000, 2000]  # Default submission counts to benchmark
+COMMENTS_PER_SUBMISSION = 4
+ATTACHMENTS_PER_SUBMISSION = 2
+RUBRIC_ASSESSMENTS_PER_SUBMISSION = 3
+REPEAT_COUNT = 3    # Page is generated this many times & the fastest time is reported
+
+#################### Helper Functions ####################
+
+def write_student_folder(student_folder_path, submission_count):
+    """Write csv files for a synthetic student with the given number of submissions."""
+    submissions = []
+    comments = []
+    attachments = []
+    rubric_assessments = []
+    for i in range(submission_count):
+        submission_id = unicode(100000 + i)
+        submissions.append((submission_id, u'student', u'Course', u'2019-01-01T00:00:00Z',
+            u'Assignment %s' % i, u'<p>Do <b>thing</b> %s</p>' % i, u'2019-02-01T00:00:00Z',
+            u'online_upload', u'', u'', u'', u'', u'', u'A'))
+        for j in range(COMMENTS_PER_SUBMISSION):
+            comments.append((submission_id, u'2019-02-02T00:00:00Z', u'Comment %s on submission %s' % (j, i), u'mentor'))
+        for j in range(ATTACHMENTS_PER_SUBMISSION):
+            file_id = unicode(i * ATTACHMENTS_PER_SUBMISSION + j)
+            attachments.append((submission_id, u'https://example.com/files/%s' % file_id, u'file%s.docx' % file_id,
+                u'Attachment %s.docx' % file_id, u'https://example.com/thumbnails/%s' % file_id, u'thumb-%s.png' % file_id,
+                file_id, u'1000', u'2019-02-01T00:00:00Z', u'application/msword'))
+        for j in range(RUBRIC_ASSESSMENTS_PER_SUBMISSION):
+            rubric_assessments.append((submission_id, u'Criterion %s' % j, u'3', u'Meets', u'Rubric comment %s' % j))
+
+    os.mkdir(student_folder_path)
+    export_student_artifacts.write_csv_file(os.path.join(student_folder_path, path_consts.SUBMISSIONS_FILE_NAME),
+        export_student_artifacts.SUBMISSION_HEADERS, submissions)
+    export_student_artifacts.write_csv_file(os.path.join(student_folder_path, path_consts.COMMENTS_FILE_NAME),
+        export_student_artifacts.SUBMISSION_COMMENT_HEADERS, comments)
+    export_student_artifacts.write_csv_file(os.path.join(student_folder_path, path_consts.ATTACHMENTS_FILE_NAME),
+        export_student_artifacts.SUBMISSION_ATTACHMENT_HEADERS, attachments)
+    export_student_artifacts.write_csv_file(os.path.join(student_folder_path, path_consts.RUBRIC_ASSESSMENTS_FILE_NAME),
+        export_student_artifacts.SUBMISSION_RUBRIC_ASSESSMENT_HEADERS, rubric_assessments)
+
+def time_student_page(student_folder_path):
+    """Return the fastest of REPEAT_COUNT times, in seconds, to generate a student page."""
+    student_folders_list = [os.path.basename(student_folder_path)]
+    times = []
+    for i in range(REPEAT_COUNT):
+        start_time = time.time()
+        make_html.make_student_page(student_folder_path, 0, student_folders_list)
+        times.append(time.time() - start_time)
+    return min(times)
+
+#################### Benchmark Functions ####################
+
+def benchmark(submission_counts):
+    """Print a table of student page generation times for each submission count."""
+    make_html.time_stamp_string = '<P>Data exported at benchmark time</P>\n'    # No exports folder to read it from.
+    temp_folder_path = tempfile.mkdtemp()
+    try:
+        results = []
+        for submission_count in submission_counts:
+            student_folder_path = os.path.join(temp_folder_path, 'student%s' % submission_count)
+            write_student_folder(student_folder_path, submission_count)
+            results.append((submission_count, time_student_page(student_folder_path)))
+    finally:
+        shutil.rmtree(temp_folder_path)
+
+    print('%12s %12s %16s' % ('submissions', 'seconds', 'ms/submission'))
+    for (submission_count, seconds) in results:
+        print('%12s %12.4f %16.4f' % (submission_count, seconds, seconds * 1000.0 / submission_count))
+
+
+######### Stand-Alone Execution #########
+
+if __name__ == "__main__":
+    script_logging.clear_logs()
+    benchmark([int(arg) for arg in sys.argv[1:]] or SUBMISSION_COUNTS)
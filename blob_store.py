@@ -0,0 +1,103 @@
+"""Content-addressed store for downloaded files, so a file attached to several
+submissions, or copied across courses, is transferred & stored only once.
+
+Each unique file is kept once in a blob folder under the exports folder,
+named after its md5 digest:
+
+/exports/
+  |
+  +---/.blobs/
+        |
+        +---/e0/
+              |
+              +---e00109d3c02544bdff619639455efdfe
+
+Student folders get hard links to the blob files. Where hard links aren't
+possible, e.g. on a file system that doesn't support them, we fall back to
+a symbolic link & then to a plain copy. The download ledger maps each Canvas
+file ID to its digest, which is how we find a file's blob before downloading it.
+
+Since linked files share their contents with the blob, anything that replaces
+a file in a student folder must write a new file & rename it into place rather
+than overwrite the existing file. http_downloader works that way.
+
+10.19.2026 tps Created.
+10.19.2026 tps Serialize storing files, so download worker threads storing the same contents don't collide.
+"""
+
+import errno
+import os
+import shutil
+import threading
+
+import path_consts
+import script_logging
+
+#################### Module Variables ####################
+
+lock = threading.Lock()     # Serializes storing files from download worker threads.
+
+#################### Helper Functions ####################
+
+def get_blob_path(digest):
+    """Return path to the blob file for the given content digest.
+    Blobs are spread across subfolders named after the 1st 2 digits of the digest,
+    to keep folder sizes manageable.
+    """
+    return os.path.join(path_consts.BLOB_STORE_FOLDER, digest[:2], digest)
+
+def has_blob(digest):
+    return (digest is not None) and os.path.isfile(get_blob_path(digest))
+
+def link_file(source_path, target_path):
+    """Make the target path refer to the source file. Try a hard link, then a
+    relative symbolic link, then just copy the file.
+    """
+    if os.path.lexists(target_path):
+        os.remove(target_path)
+
+    if hasattr(os, 'link'):
+        try:
+            os.link(source_path, target_path)
+            return
+        except OSError as e:
+            script_logging.log_status('Hard link failed for %s: %s' % (target_path, e))
+
+    if hasattr(os, 'symlink'):
+        try:
+            os.symlink(os.path.relpath(source_path, os.path.dirname(target_path)), target_path)
+            return
+        except OSError as e:
+            script_logging.log_status('Symbolic link failed for %s: %s' % (target_path, e))
+
+    shutil.copy2(source_path, target_path)
+
+#################### Store Functions ####################
+
+def link_blob(digest, target_path):
+    """Link a student folder file to the blob with the given digest."""
+    script_logging.log_status('Link %s to blob %s' % (target_path, digest))
+    link_file(get_blob_path(digest), target_path)
+
+def store_file(file_path, digest):
+    """Move a freshly downloaded file into the blob store & replace it with
+    a link to the blob. If the store already has a blob with the same contents,
+    the downloaded file is simply replaced with a link to that blob.
+    """
+    blob_path = get_blob_path(digest)
+    with lock:
+        if not os.path.isfile(blob_path):
+            blob_folder = os.path.dirname(blob_path)
+            try:
+                os.makedirs(blob_folder)
+            except OSError as e:
+                if e.errno != errno.EEXIST:     # Another process may have just made it.
+                    raise
+            try:
+                os.rename(file_path, blob_path)
+            except OSError:
+                # On Windows, another process may have just stored the same contents,
+                # so the rename can't replace the blob. Then the blob is all we need.
+                if not os.path.isfile(blob_path):
+                    raise
+        link_blob(digest, file_path)
@@ -22,10 +22,12 @@ Initially hacked from https://github.com/unsupported/canvas/tree/master/api/pull
 11.22.2016 tps Shortened names for some functions.
 11.23.2016 tps Fixed wrong domain in BASE_URL.
 09.14.2018 tps Query for courses list using admin level account, so we get all courses in Canvas.
+10.19.2026 tps Log an event timing each API request.
 """
 
 #import re
 import requests
+import time
 
 import script_logging
 
@@ -73,7 +75,13 @@ def query_endpoint(endpoint, request_params = {}):
     try:
         # Results are paged, so we have to keep requesting until we get all of them.
         while 1:
+            start_time = time.time()
             resp = requests.get(endpoint_url, params=submission_params, headers=REQUEST_HEADERS)
+            script_logging.log_event('api_request',
+                endpoint=endpoint,
+                status=resp.status_code,
+                bytes=len(resp.content),
+                duration=time.time() - start_time)
             # print(resp.url)
 
             # The response might be a list of JSON dictionaries or it may be a single 
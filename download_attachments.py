@@ -1,6 +1,6 @@
 """Download all submission attachments to student folders.
-Finds attachments to download by parsing exports folder, which
-is assumed to have been popualated with student data by export_student_artifacts.py.
+Finds attachments to download in the download queue, which
+is assumed to have been written by export_student_artifacts.py.
 
 11.26.2016 tps
 11.28.2016 tps Use export_student_artifacts.load_csv_file(), which returns
@@ -12,17 +12,40 @@ is assumed to have been popualated with student data by export_student_artifacts
 02.20.2017 tps Add test for missing thumbnail image in download_all_attachments().
 09.03.2017 tps Use http_downloader.py module to perform actual file download.
 05.08.2019 tps Download thumbnail images to our made-up thumbnail file names.
+10.19.2026 tps Skip attachments the download ledger shows haven't changed since they were downloaded.
+10.19.2026 tps Optionally store each unique attachment once in a blob store & link it into student folders.
+10.19.2026 tps Read attachments from the download queue instead of walking the exports folder.
+10.19.2026 tps Accept command line arguments to download just one shard of the queue.
+10.19.2026 tps Record failed downloads in the download failure store.
+10.19.2026 tps Plan downloads for disk space & throughput, & run them in parallel worker threads.
+10.19.2026 tps Optionally make thumbnails for image attachments locally instead of downloading them.
+10.19.2026 tps Accept --profile, to profile the stage. See stage_profiler.py.
+10.19.2026 tps Optionally download just the attachments for given courses, for the pipeline runner.
+10.19.2026 tps Optionally leave local thumbnails for the caller to make later, for the pipeline runner.
 """
 
 # import csv
-import os
+# import os
 # import re
 # import requests
+import sys
 
-import export_student_artifacts
-import path_consts
+import download_planner
+import download_queue
 import script_logging
-import http_downloader
+import stage_profiler
+import thumbnails
+
+#################### Constants ####################
+
+# The same file is often attached to several submissions. Set this to
+# download & store each unique file once. See blob_store.py.
+USE_BLOB_STORE = False
+
+# Set this to make thumbnails for image attachments from the downloaded
+# attachments, instead of downloading the thumbnails Canvas makes.
+# Needs Pillow. See thumbnails.py.
+LOCAL_THUMBNAILS = False
 
 # Prepare the regex expression for extracting the attachment file name.
 # The attachment file name is in HTTP request "Content-Disposition" header,
@@ -70,38 +93,52 @@ import http_downloader
 #     return '.'.join(attachment_file_name.split('.')[:-1]) + '_thumb.png'
 
 
-def download_all_attachments():
-    """Download all submission attachments by parsing exports folder.
+def make_local_thumbnails(thumbnail_jobs, use_blob_store = USE_BLOB_STORE):
+    """Make thumbnails from downloaded image attachments, & download the Canvas
+    thumbnails for images we couldn't make thumbnails from.
+    thumbnail_jobs -- List of (attachment task, thumbnail task) tuples from thumbnails.split_thumbnail_tasks().
+    Starts worker processes. See thumbnails.make_thumbnails().
     """
-    
-    # Walk exports directory looking for attachments csv files.
-    for (folder_path, dir_list, file_list) in os.walk(path_consts.EXPORTS_FOLDER):
-        if path_consts.ATTACHMENTS_FILE_NAME in file_list:
-
-            # Walk through all the student's submission attachments.
-            attachment_csv_file = os.path.join(folder_path, path_consts.ATTACHMENTS_FILE_NAME)
-            attachments = export_student_artifacts.load_csv_file(attachment_csv_file)
-            for attachment in attachments[1:]:  # Skip 1st row, which is the header.
-            
-                # #? 12.15.2017 Trap weird file name problem
-                # targetFile = os.path.join(folder_path, attachment.file_name)
-                # if not 'Who are all of the students in your classroom' in targetFile:
-                #     continue
-
-                # Download the attachment file
-                http_downloader.download(attachment.url, os.path.join(folder_path, attachment.file_name))
-                
-                # Download the thumbnail preview image, if any.
-                # Assume that if attachment has a preview image, it is a PNG file.
-                if attachment.thumbnail_url:
-                    # thumbnail_file_name = os.path.join(folder_path, png_thumbnail_file_name(attachment.file_name))
-                    thumbnail_file_name = os.path.join(folder_path, attachment.thumbnail_file)
-                    http_downloader.download(attachment.thumbnail_url, thumbnail_file_name)
+    fallback_tasks = thumbnails.make_thumbnails(thumbnail_jobs)
+    if fallback_tasks:
+        download_planner.run_downloads(fallback_tasks, use_blob_store=use_blob_store)
+
+def download_all_attachments(use_blob_store = USE_BLOB_STORE, shard_index = 0, shard_count = 1, shard_by = download_queue.SHARD_BY_COURSE,
+        local_thumbnails = LOCAL_THUMBNAILS, course_ids = None, defer_thumbnails = False):
+    """Download all submission attachments & their thumbnail images listed in the download queue.
+    Attachments that the download ledger shows haven't changed since
+    they were last downloaded are skipped.
+    use_blob_store parameter links student folder files to a shared blob store.
+    shard parameters select the part of the queue to download. See download_queue.load_tasks().
+    local_thumbnails parameter makes thumbnails for image attachments after they're downloaded.
+    course_ids parameter limits the downloads to the listed Canvas course IDs.
+    defer_thumbnails parameter leaves the thumbnails to make for the caller to pass to
+    make_local_thumbnails() later, e.g. when it isn't safe to start worker processes yet.
+    Returns list of the thumbnail jobs left to make.
+    """
+    tasks = download_queue.load_tasks((download_queue.KIND_ATTACHMENT, download_queue.KIND_THUMBNAIL),
+        shard_index, shard_count, shard_by, course_ids)
+
+    thumbnail_jobs = []
+    if local_thumbnails:
+        if thumbnails.Image is None:
+            script_logging.log_error('Pillow is not installed, so downloading thumbnails from Canvas')
+        (tasks, thumbnail_jobs) = thumbnails.split_thumbnail_tasks(tasks)
+
+    download_planner.run_downloads(tasks, use_blob_store=use_blob_store)
+
+    if defer_thumbnails:
+        return thumbnail_jobs
+    if thumbnail_jobs:
+        make_local_thumbnails(thumbnail_jobs, use_blob_store)
+    return []
 
 ######### Stand-Alone Execution #########
 
 if __name__ == "__main__":
 
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
     script_logging.clear_logs()
-    download_all_attachments()
-
+    stage_profiler.run_stage('download_attachments', download_all_attachments, local_thumbnails=(LOCAL_THUMBNAILS or '--local-thumbnails' in sys.argv[1:]),
+        **download_queue.parse_shard_args(sys.argv[1:]))
@@ -0,0 +1,150 @@
+"""Store of failed downloads, for retry_download_errors.py to retry.
+Replaces scraping err.txt for failed downloads, which broke on file names
+containing quotes & couldn't keep track of how many times a download was tried.
+
+The store is a JSON file containing a dictionary keyed by target file path.
+Each entry is the download queue task that failed, plus details of the failure:
+
+    "exports/CalStateTEACH Term 1/grios/Mentor Info.docx": {
+        "kind": "attachment",
+        "url": "https://ourdomain.instructure.com/files/8080/download?download_frd=1&verifier=zVZdnk",
+        "target": "exports/CalStateTEACH Term 1/grios/Mentor Info.docx",
+        ...
+        "error_class": "HTTPError",
+        "http_status": 403,
+        "error": "403 Client Error: Forbidden for url: ...",
+        "attempts": 2,
+        "next_attempt_at": 1508428800.0
+    }
+
+"attempts" counts the failed tries since the file was last downloaded, by
+the download scripts & retry_download_errors.py alike, across runs. Each retry
+waits twice as long as the one before, & retries stop after MAX_ATTEMPTS tries.
+A successful download removes the entry from the store.
+
+Like the download ledger, several processes can share the store file,
+holding its lock file while they load & save it.
+
+10.19.2026 tps Created.
+10.19.2026 tps Let callers schedule a retry right away, for files that failed verification.
+10.19.2026 tps Hold an inter-process lock while loading & saving the store, so processes
+               saving at the same time don't lose each other's changes.
+10.19.2026 tps Keep counting attempts when the download scripts fail a file that's already in the store,
+               instead of starting over, so MAX_ATTEMPTS & the backoff hold across runs.
+"""
+
+import json
+import os
+import threading
+import time
+
+import file_lock
+import path_consts
+
+#################### Constants ####################
+
+MAX_ATTEMPTS = 5        # Give up retrying a download after this many tries
+RETRY_DELAY = 30        # Seconds to wait before the 1st retry. Doubles with every try.
+MAX_RETRY_DELAY = 3600  # Longest wait between retries, in seconds
+
+#################### Module Variables ####################
+
+changed_keys = set()    # Keys of store entries this process has added or changed.
+removed_keys = set()    # Keys of store entries this process has removed.
+lock = threading.RLock()    # Serializes store updates from download worker threads.
+
+#################### Store Storage ####################
+
+def read_failures():
+    """Return the contents of the store file, or an empty dictionary. Call with the store's file lock held."""
+    file_name = path_consts.DOWNLOAD_FAILURES_FILE_NAME
+    if not os.path.isfile(file_name):
+        return {}
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+def load_failures():
+    """Return the failure dictionary saved by a previous run, or an empty one."""
+    if not os.path.isdir(path_consts.EXPORTS_FOLDER):
+        return {}   # Nowhere to put the lock file, & no store either.
+    with file_lock.locked(path_consts.DOWNLOAD_FAILURES_FILE_NAME):
+        return read_failures()
+
+def save_failures(failures):
+    """Write the failure store file, merging the entries changed by this process
+    into the file's current contents. The store's file lock keeps other processes
+    from saving between our reading the file & replacing it. Write to a temporary
+    file first, so that an interruption can't leave behind a truncated file.
+    """
+    file_name = path_consts.DOWNLOAD_FAILURES_FILE_NAME
+    with lock, file_lock.locked(file_name):
+        saved_failures = read_failures()
+        for key in removed_keys:
+            saved_failures.pop(key, None)
+        for key in changed_keys:
+            saved_failures[key] = failures[key]
+        failures.clear()
+        failures.update(saved_failures)
+
+        temp_file_name = '%s.%s.tmp' % (file_name, os.getpid())
+        with open(temp_file_name, 'w') as f:
+            json.dump(failures, f, indent=2)
+        file_lock.replace_file(temp_file_name, file_name)
+        changed_keys.clear()
+        removed_keys.clear()
+
+#################### Store Updates ####################
+
+def get_http_status(error):
+    """Return the HTTP status code of a failed download, or None if the
+    failure wasn't an HTTP error response.
+    """
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+def record_failure(failures, task, error, delay=None):
+    """Record a failed download task in the store. If the task is already
+    in the store, whoever tried it, count another attempt.
+    delay -- Seconds to wait before retrying. Defaults to a delay that doubles with every attempt.
+    """
+    with lock:
+        key = task['target']
+        entry = dict(task)
+        entry['attempts'] = 1
+        if key in failures:
+            entry['attempts'] = failures[key]['attempts'] + 1
+        entry['error_class'] = error.__class__.__name__
+        entry['http_status'] = get_http_status(error)
+        entry['error'] = str(error)
+        if delay is None:
+            delay = min(RETRY_DELAY * 2 ** (entry['attempts'] - 1), MAX_RETRY_DELAY)
+        entry['next_attempt_at'] = time.time() + delay
+
+        failures[key] = entry
+        changed_keys.add(key)
+        removed_keys.discard(key)
+
+def record_success(failures, task):
+    """Remove a task from the store, if it's there, after a successful download."""
+    with lock:
+        key = task['target']
+        if key in failures:
+            del failures[key]
+            removed_keys.add(key)
+            changed_keys.discard(key)
+
+#################### Store Queries ####################
+
+def get_pending(failures):
+    """Return list of failed tasks that haven't used up their retries."""
+    return [entry for entry in failures.values() if entry['attempts'] < MAX_ATTEMPTS]
+
+def get_eligible(failures, now=None):
+    """Return list of failed tasks that are due to be retried."""
+    if now is None:
+        now = time.time()
+    return [entry for entry in get_pending(failures) if entry['next_attempt_at'] <= now]
+
+def get_abandoned(failures):
+    """Return list of failed tasks that have used up their retries."""
+    return [entry for entry in failures.values() if entry['attempts'] >= MAX_ATTEMPTS]
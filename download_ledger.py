@@ -0,0 +1,175 @@
+"""Ledger of files that have already been downloaded to the exports folder.
+Lets the download scripts skip files that haven't changed in Canvas since
+the last run, so a nightly refresh only downloads new or modified files.
+
+The ledger is a JSON file containing a dictionary keyed by a string that
+identifies the Canvas file. Submission attachments are keyed by their
+Canvas attachment ID. Each entry looks like:
+
+    "8080": {
+        "updated_at": "2019-05-08T17:21:44Z",
+        "size": 48213,
+        "digest": "e00109d3c02544bdff619639455efdfe",
+        "paths": ["exports/CalStateTEACH Term 1/grios/Mentor Info.docx"]
+    }
+
+An attachment can be saved to more than one student folder, e.g. for
+group assignments, so the entry keeps a list of local paths.
+
+Several download processes can share the ledger file. Each one merges
+the entries it changed into the file's current contents when it saves,
+holding the ledger's lock file so no other process saves in between.
+
+10.19.2026 tps Created.
+10.19.2026 tps Optionally link downloads to a content-addressed blob store.
+10.19.2026 tps Merge changes into the saved ledger, so sharded download processes can share it.
+10.19.2026 tps Make ledger updates thread-safe & raise download errors for the caller to record.
+10.19.2026 tps Added forget_path(), so files that fail verification are downloaded again.
+10.19.2026 tps Hold an inter-process lock while loading & saving the ledger, so processes
+               saving at the same time don't lose each other's changes.
+"""
+
+import json
+import os
+import threading
+
+import blob_store
+import file_lock
+import http_downloader
+import path_consts
+import script_logging
+
+#################### Constants ####################
+
+# Number of ledger updates to accumulate before saving the ledger file.
+# Saving periodically means an interrupted run doesn't lose track of everything.
+SAVE_INTERVAL = 100
+
+#################### Module Variables ####################
+
+unsaved_count = 0   # Number of ledger updates since the ledger file was saved.
+changed_keys = set()    # Keys of ledger entries this process has changed.
+lock = threading.RLock()    # Serializes ledger updates from download worker threads.
+
+#################### Ledger Storage ####################
+
+def read_ledger():
+    """Return the contents of the ledger file, or an empty dictionary. Call with the ledger's file lock held."""
+    file_name = path_consts.DOWNLOAD_LEDGER_FILE_NAME
+    if not os.path.isfile(file_name):
+        return {}
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+def load_ledger():
+    """Return the ledger dictionary saved by a previous run, or an empty one."""
+    if not os.path.isdir(path_consts.EXPORTS_FOLDER):
+        return {}   # Nowhere to put the lock file, & no ledger either.
+    with file_lock.locked(path_consts.DOWNLOAD_LEDGER_FILE_NAME):
+        return read_ledger()
+
+def save_ledger(ledger):
+    """Write the ledger file. Entries changed by this process are merged into
+    the ledger file's current contents, in case another process has saved
+    its own changes since we loaded it. The ledger's file lock keeps other
+    processes from saving between our reading the file & replacing it.
+    Write to a temporary file first, so that an interruption can't leave
+    behind a truncated ledger.
+    """
+    global unsaved_count
+    file_name = path_consts.DOWNLOAD_LEDGER_FILE_NAME
+    with lock, file_lock.locked(file_name):
+        saved_ledger = read_ledger()
+        for key in changed_keys:
+            saved_ledger[key] = ledger[key]
+        ledger.update(saved_ledger)
+
+        temp_file_name = '%s.%s.tmp' % (file_name, os.getpid())
+        with open(temp_file_name, 'w') as f:
+            json.dump(ledger, f)
+        file_lock.replace_file(temp_file_name, file_name)
+        unsaved_count = 0
+        changed_keys.clear()
+
+#################### Ledger Lookups ####################
+
+def is_unchanged(ledger, key, updated_at, size, file_path):
+    """Test if a file was downloaded to the file path by a previous run
+    & hasn't changed in Canvas since then.
+    key -- Ledger key identifying the Canvas file.
+    updated_at -- Canvas update time for the file.
+    size -- Canvas file size in bytes, or None if not known.
+    file_path -- Local path the file is saved to.
+    """
+    entry = ledger.get(key)
+    if entry is None:
+        return False
+    if (entry['updated_at'] != updated_at) or (entry['size'] != size):
+        return False
+    if file_path not in entry['paths']:
+        return False
+
+    # Make sure nobody has deleted or truncated the local file since.
+    if not os.path.isfile(file_path):
+        return False
+    if (size is not None) and (os.path.getsize(file_path) != size):
+        return False
+    return True
+
+def record(ledger, key, updated_at, size, file_path, digest):
+    """Add a downloaded file to the ledger."""
+    global unsaved_count
+    with lock:
+        entry = ledger.get(key)
+        if (entry is None) or (entry['updated_at'] != updated_at) or (entry['digest'] != digest):
+            # New or modified file, so any copies saved before are out of date.
+            entry = {
+                'updated_at': updated_at,
+                'size': size,
+                'digest': digest,
+                'paths': [] }
+            ledger[key] = entry
+        if file_path not in entry['paths']:
+            entry['paths'].append(file_path)
+
+        changed_keys.add(key)
+        unsaved_count += 1
+        if unsaved_count >= SAVE_INTERVAL:
+            save_ledger(ledger)
+
+def forget_path(ledger, key, file_path):
+    """Remove a local path from a ledger entry, e.g. because the file there
+    turned out to be damaged, so the next run downloads it again.
+    """
+    with lock:
+        entry = ledger.get(key)
+        if (entry is not None) and (file_path in entry['paths']):
+            entry['paths'].remove(file_path)
+            changed_keys.add(key)
+
+#################### Download Functions ####################
+
+def download_if_changed(ledger, key, updated_at, size, download_url, target_file_path, segmented=False, use_blob_store=False):
+    """Download a file with http_downloader.download(), unless the ledger shows
+    the same version of the file has already been downloaded to the target path.
+    use_blob_store -- Keep the file in the blob store & link the target path to it.
+        If the ledger shows the same version of the file is already in the store,
+        e.g. because it was downloaded to another student folder, just link it
+        without downloading it again.
+    Raises an exception if the download fails.
+    """
+    if is_unchanged(ledger, key, updated_at, size, target_file_path):
+        script_logging.log_status('Unchanged %s' % target_file_path)
+        return
+
+    if use_blob_store:
+        entry = ledger.get(key)
+        if (entry is not None) and (entry['updated_at'] == updated_at) and blob_store.has_blob(entry['digest']):
+            blob_store.link_blob(entry['digest'], target_file_path)
+            record(ledger, key, updated_at, size, target_file_path, entry['digest'])
+            return
+
+    digest = http_downloader.download(download_url, target_file_path, segmented, raise_errors=True)
+    if use_blob_store:
+        blob_store.store_file(target_file_path, digest)
+    record(ledger, key, updated_at, size, target_file_path, digest)
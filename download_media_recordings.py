@@ -1,21 +1,35 @@
 """Download all media recording submissions to student folders.
-Finds media files to download by parsing exports folder, which
-is assumed to have been populated with student data by export_student_artifacts.py.
+Finds media files to download in the download queue, which
+is assumed to have been written by export_student_artifacts.py.
 
 09.03.2017 tps Created from download_attachments.ps.
 09.03.2017 tps Use http_downloader.py module to perform actual file download.
+10.19.2026 tps Optionally download large media files in parallel segments.
+10.19.2026 tps Skip media files the download ledger shows have already been downloaded.
+10.19.2026 tps Read media files from the download queue instead of walking the exports folder.
+10.19.2026 tps Accept command line arguments to download just one shard of the queue.
+10.19.2026 tps Record failed downloads in the download failure store.
+10.19.2026 tps Plan downloads for disk space & throughput, & run them in parallel worker threads.
+10.19.2026 tps Accept --profile, to profile the stage. See stage_profiler.py.
+10.19.2026 tps Optionally download just the media files for given courses, for the pipeline runner.
 """
 
 # import csv
-import os
+# import os
 # import re
 # import requests
+import sys
 
-import export_student_artifacts
-import path_consts
+import download_planner
+import download_queue
 import script_logging
-import http_downloader
+import stage_profiler
 
+#################### Constants ####################
+
+# Media recordings are our largest files. Set this to fetch the big ones
+# over several connections at once. See http_downloader.fetch_segmented().
+SEGMENTED_DOWNLOADS = False
 
 #################### Helper Functions ####################
 
@@ -42,34 +56,32 @@ import http_downloader
 
 
 
-def download_all_media_recordings(doDownload = True):
-    """Download all media recordings submissions by parsing exports folder.
+def download_all_media_recordings(doDownload = True, segmented = SEGMENTED_DOWNLOADS,
+        shard_index = 0, shard_count = 1, shard_by = download_queue.SHARD_BY_COURSE, course_ids = None):
+    """Download all media recordings submissions listed in the download queue.
     doDownload parameter lets us run this without actually downloading files, 
     which is useful during development.
-    """
-    
-    # Walk exports directory looking for submissions csv files.
-    for (folder_path, dir_list, file_list) in os.walk(path_consts.EXPORTS_FOLDER):
-        if path_consts.SUBMISSIONS_FILE_NAME in file_list:
+    segmented parameter downloads large files in parallel byte ranges.
+    shard parameters select the part of the queue to download. See download_queue.load_tasks().
+    course_ids parameter limits the downloads to the listed Canvas course IDs.
 
-            # Walk through all the student's submission attachments.
-            submissions_csv_file = os.path.join(folder_path, path_consts.SUBMISSIONS_FILE_NAME)
-            submissions = export_student_artifacts.load_csv_file(submissions_csv_file)
-            for submission in submissions[1:]:  # Skip 1st row, which is the header.
+    Media files that the download ledger shows were downloaded by an
+    earlier run are skipped.
+    """
+    tasks = download_queue.load_tasks((download_queue.KIND_MEDIA,), shard_index, shard_count, shard_by, course_ids)
+    if not doDownload:
+        for task in tasks:
+            script_logging.log_status('Download %s to %s' % (task['url'], task['target']))
+        return
 
-                # Look for media_recording submissions
-                if submission.submission_type == 'media_recording':
-                    target_file_path = os.path.join(folder_path, submission.media_file)
-                    if doDownload:
-                        http_downloader.download(submission.media_url, target_file_path)
-                    else:
-                        script_logging.log_status('Download %s to %s' % (submission.media_url, target_file_path))
+    download_planner.run_downloads(tasks, segmented=segmented)
 
 
 ######### Stand-Alone Execution #########
 
 if __name__ == "__main__":
 
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
     script_logging.clear_logs()
-    download_all_media_recordings()
-
+    stage_profiler.run_stage('download_media_recordings', download_all_media_recordings, **download_queue.parse_shard_args(sys.argv[1:]))
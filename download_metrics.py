@@ -0,0 +1,197 @@
+"""Throughput & latency measurements for file downloads, so we can tell
+whether a slow download run was held up by Canvas, the network or our disk.
+
+For each download, we record:
+- Time to first byte: seconds from sending the 1st request until the response
+  headers arrive. Long waits point at the server.
+- Duration: seconds from sending the 1st request until the file is complete.
+- Bytes received by this download. A resumed download counts only the bytes
+  it fetched, not the ones already in the partial file.
+- Disk time: seconds spent writing received bytes to disk.
+- Throughput: bytes received per second of duration.
+- Retries: how many times the file had failed before this attempt.
+
+download_queue.run_task() brackets each download with start_download() &
+finish_download(). In between, http_downloader reports what happens via the
+note_*() functions. The measurements for a download are kept per thread, so
+each download worker thread tracks its own download.
+
+write_report() writes a JSON run report next to log.txt, with totals &
+histograms of time to first byte & throughput for each content type & each
+host, plus the measurements for every download. Hosts are taken from the
+final URL after redirects, so files served by a storage host show up
+separately from the Canvas instance. write_report() can be called as often
+as needed, e.g. after each course's downloads. Processes of the same run, like
+shard processes, merge their downloads into the same report, so it covers all
+of them. A report left by an earlier run is replaced. See script_logging.run_id.
+
+10.19.2026 tps Created.
+10.19.2026 tps Merge the downloads of every process in the run into the report, instead
+               of each process replacing it with its own.
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+import urlparse
+
+import file_lock
+import script_logging
+
+#################### Constants ####################
+
+REPORT_FILE_NAME = 'download_report.json'   # Written to the same folder as log.txt.
+
+# Histogram bucket lower bounds. Each bucket runs up to the next bound.
+TTFB_BUCKETS = [0, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]  # Seconds
+THROUGHPUT_BUCKETS = [0, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]  # Bytes per second
+
+#################### Module Variables ####################
+
+lock = threading.Lock()     # Serializes updates to the list of downloads from worker threads.
+downloads = []              # Measurements for each finished download.
+current = threading.local() # Measurements for the download in progress on each thread.
+
+#################### Measurement Functions ####################
+
+def start_download():
+    """Start measuring a download on the current thread."""
+    current.download = {
+        'request_time': None,
+        'response_time': None,
+        'host': None,
+        'bytes': 0,
+        'disk_seconds': 0.0 }
+
+def get_current():
+    """Return measurements for the download in progress on the current thread,
+    or None if nobody is measuring it.
+    """
+    return getattr(current, 'download', None)
+
+def note_request():
+    """Note that a request for the file is being sent. Only the 1st request counts."""
+    download = get_current()
+    if (download is not None) and (download['request_time'] is None):
+        download['request_time'] = time.time()
+
+def note_response(url):
+    """Note that response headers have arrived from the given URL. Only the 1st response counts."""
+    download = get_current()
+    if (download is not None) and (download['response_time'] is None):
+        download['response_time'] = time.time()
+        download['host'] = urlparse.urlparse(url).netloc
+
+def note_chunk(byte_count, disk_seconds):
+    """Note bytes received & the seconds spent writing them to disk."""
+    download = get_current()
+    if download is not None:
+        download['bytes'] += byte_count
+        download['disk_seconds'] += disk_seconds
+
+def finish_download(task, error=None):
+    """Finish measuring a download task on the current thread & add it to the run's measurements.
+    error -- Exception raised by a failed download, or None if it succeeded.
+    Downloads that never sent a request, like unchanged files, aren't counted.
+    """
+    download = get_current()
+    current.download = None
+    if (download is None) or (download['request_time'] is None):
+        return
+
+    now = time.time()
+    duration = now - download['request_time']
+    ttfb = None
+    if download['response_time'] is not None:
+        ttfb = download['response_time'] - download['request_time']
+    host = download['host'] or urlparse.urlparse(task['url']).netloc
+
+    measurements = {
+        'run': script_logging.run_id,
+        'pid': os.getpid(),
+        'target': task['target'],
+        'kind': task['kind'],
+        'content_type': task.get('content_type') or 'unknown',
+        'host': host,
+        'succeeded': error is None,
+        'error_class': None if error is None else error.__class__.__name__,
+        'retries': task.get('attempts', 0),
+        'bytes': download['bytes'],
+        'ttfb_seconds': ttfb,
+        'duration_seconds': duration,
+        'disk_seconds': download['disk_seconds'],
+        'throughput': download['bytes'] / duration if duration > 0 else None }
+    with lock:
+        downloads.append(measurements)
+
+#################### Report Functions ####################
+
+def make_histogram(values, bucket_bounds):
+    """Return list of [bucket lower bound, count] pairs for a list of values."""
+    counts = [0] * len(bucket_bounds)
+    for value in values:
+        bucket = 0
+        while (bucket + 1 < len(bucket_bounds)) and (value >= bucket_bounds[bucket + 1]):
+            bucket += 1
+        counts[bucket] += 1
+    return [[bound, count] for (bound, count) in zip(bucket_bounds, counts)]
+
+def summarize(measurements_list):
+    """Return dictionary of totals & histograms for a list of download measurements."""
+    total_bytes = sum(m['bytes'] for m in measurements_list)
+    total_seconds = sum(m['duration_seconds'] for m in measurements_list)
+    ttfbs = [m['ttfb_seconds'] for m in measurements_list if m['ttfb_seconds'] is not None]
+    throughputs = [m['throughput'] for m in measurements_list if m['succeeded'] and (m['throughput'] is not None)]
+    return {
+        'count': len(measurements_list),
+        'failed': len([m for m in measurements_list if not m['succeeded']]),
+        'retries': sum(m['retries'] for m in measurements_list),
+        'bytes': total_bytes,
+        'duration_seconds': total_seconds,
+        'disk_seconds': sum(m['disk_seconds'] for m in measurements_list),
+        'mean_ttfb_seconds': sum(ttfbs) / len(ttfbs) if ttfbs else None,
+        'throughput': total_bytes / total_seconds if total_seconds > 0 else None,
+        'ttfb_histogram': make_histogram(ttfbs, TTFB_BUCKETS),
+        'throughput_histogram': make_histogram(throughputs, THROUGHPUT_BUCKETS) }
+
+def summarize_by(measurements_list, field_name):
+    """Return dictionary of summaries for downloads grouped by a measurement field."""
+    groups = {}
+    for measurements in measurements_list:
+        groups.setdefault(measurements[field_name], []).append(measurements)
+    return dict((value, summarize(group)) for (value, group) in groups.items())
+
+def load_other_downloads(report_file_name):
+    """Return list of the measurements in a saved report that other processes of this run made."""
+    if not os.path.isfile(report_file_name):
+        return []
+    with open(report_file_name, 'r') as f:
+        report = json.load(f)
+    return [m for m in report.get('downloads', [])
+        if (m.get('run') == script_logging.run_id) and (m.get('pid') != os.getpid())]
+
+def write_report():
+    """Write the run report for all the downloads measured so far in this process,
+    merged with those saved by other processes of the same run.
+    """
+    report_file_name = os.path.join(os.path.dirname(script_logging.LOG_FILE_NAME), REPORT_FILE_NAME)
+    with lock, file_lock.locked(report_file_name):
+        measurements_list = load_other_downloads(report_file_name) + downloads
+        totals = summarize(measurements_list)
+        report = {
+            'run': script_logging.run_id,
+            'generated_at': datetime.datetime.now().isoformat(),
+            'totals': totals,
+            'by_content_type': summarize_by(measurements_list, 'content_type'),
+            'by_host': summarize_by(measurements_list, 'host'),
+            'downloads': measurements_list }
+
+        temp_file_name = '%s.%s.tmp' % (report_file_name, os.getpid())
+        with open(temp_file_name, 'w') as f:
+            json.dump(report, f, indent=2)
+        file_lock.replace_file(temp_file_name, report_file_name)
+
+    script_logging.log_status('Measured %s downloads, %s failed, %.1fMB in %.1f seconds of download time. Report in %s'
+        % (totals['count'], totals['failed'], totals['bytes'] / (1024.0 * 1024.0), totals['duration_seconds'], report_file_name))
@@ -0,0 +1,179 @@
+"""Plan & run the downloads in the download queue.
+Before downloading anything, the planner works out how much there is to
+download, totals it up by course, & checks there's enough free disk space
+for it. It then orders the work for throughput & hands it to a pool of
+download worker threads, logging the bytes remaining & an estimated time
+to completion as downloads finish. When the downloads are done, it writes
+the download metrics report.
+
+Canvas tells us the size of attachment files, but not of thumbnail images
+or media recordings, so the plan uses estimated sizes for those.
+
+10.19.2026 tps Created.
+10.19.2026 tps Write the download metrics report after running downloads.
+10.19.2026 tps Leave failed downloads out of the download rate & count them separately in progress messages.
+"""
+
+import ctypes
+import multiprocessing.pool
+import os
+import threading
+import time
+
+import download_failures
+import download_ledger
+import download_metrics
+import download_queue
+import path_consts
+import script_logging
+
+#################### Constants ####################
+
+DOWNLOAD_WORKERS = 4    # Number of files to download at once
+
+# Estimated sizes of files whose size Canvas doesn't tell us, in bytes.
+UNKNOWN_SIZE_ESTIMATES = {
+    download_queue.KIND_ATTACHMENT: 1024 * 1024,
+    download_queue.KIND_THUMBNAIL: 16 * 1024,
+    download_queue.KIND_MEDIA: 64 * 1024 * 1024 }
+
+# Free disk space to leave after the planned downloads, in bytes.
+FREE_SPACE_MARGIN = 1024 * 1024 * 1024
+
+#################### Module Variables ####################
+
+progress_lock = threading.Lock()    # Serializes progress updates from download worker threads.
+
+#################### Helper Functions ####################
+
+def get_planned_size(task):
+    """Return the size of a task's file, or an estimate if Canvas didn't tell us."""
+    if task['size'] is not None:
+        return task['size']
+    return UNKNOWN_SIZE_ESTIMATES[task['kind']]
+
+def get_free_space(folder_path):
+    """Return free disk space available to us in the given folder, in bytes."""
+    if hasattr(os, 'statvfs'):
+        stats = os.statvfs(folder_path)
+        return stats.f_bavail * stats.f_frsize
+    free_bytes = ctypes.c_ulonglong(0)
+    ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(folder_path), ctypes.pointer(free_bytes), None, None)
+    return free_bytes.value
+
+def format_bytes(byte_count):
+    return '%.1fMB' % (byte_count / (1024.0 * 1024.0))
+
+def format_seconds(seconds):
+    return '%d:%02d:%02d' % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+def order_for_throughput(tasks):
+    """Return tasks ordered to alternate between the largest & smallest remaining files.
+    With several workers downloading at once, this keeps some of them streaming
+    big files at full speed while others work through small files, whose
+    download times are mostly request round trips.
+    """
+    tasks = sorted(tasks, key=get_planned_size)
+    ordered_tasks = []
+    while tasks:
+        ordered_tasks.append(tasks.pop())
+        if tasks:
+            ordered_tasks.append(tasks.pop(0))
+    return ordered_tasks
+
+#################### Planning Functions ####################
+
+def plan_downloads(ledger, tasks):
+    """Return list of tasks that need downloading, ordered for throughput,
+    or None if there isn't enough free disk space to download them.
+    Tasks that the download ledger shows haven't changed are left out.
+    """
+    tasks = [task for task in tasks
+        if not download_ledger.is_unchanged(ledger, task['key'], task['updated_at'], task['size'], task['target'])]
+
+    # Total up the work for each course.
+    course_bytes = {}
+    course_counts = {}
+    unknown_size_count = 0
+    for task in tasks:
+        course_bytes[task['course_id']] = course_bytes.get(task['course_id'], 0) + get_planned_size(task)
+        course_counts[task['course_id']] = course_counts.get(task['course_id'], 0) + 1
+        if task['size'] is None:
+            unknown_size_count += 1
+    for course_id in sorted(course_bytes.keys()):
+        script_logging.log_status('Planned %s files, %s for course %s'
+            % (course_counts[course_id], format_bytes(course_bytes[course_id]), course_id))
+    total_bytes = sum(course_bytes.values())
+    script_logging.log_status('Planned %s files, %s in all, including estimates for %s files of unknown size'
+        % (len(tasks), format_bytes(total_bytes), unknown_size_count))
+
+    # Make sure the downloads will fit on disk.
+    free_bytes = get_free_space(path_consts.EXPORTS_FOLDER)
+    if total_bytes + FREE_SPACE_MARGIN > free_bytes:
+        script_logging.log_error('Not enough disk space for downloads. Need %s plus %s margin, have %s free'
+            % (format_bytes(total_bytes), format_bytes(FREE_SPACE_MARGIN), format_bytes(free_bytes)))
+        return None
+
+    return order_for_throughput(tasks)
+
+#################### Progress Functions ####################
+
+def make_progress(tasks):
+    """Return dictionary used to track progress through a list of tasks."""
+    return {
+        'total_bytes': sum(get_planned_size(task) for task in tasks),
+        'done_bytes': 0,
+        'done_count': 0,
+        'failed_bytes': 0,
+        'failed_count': 0,
+        'total_count': len(tasks),
+        'start_time': time.time() }
+
+def update_progress(progress, task, succeeded):
+    """Count a finished task & log the bytes remaining with an estimated time to completion.
+    succeeded -- The task's file was downloaded. Failed tasks are counted separately,
+        & their bytes aren't counted in the download rate.
+    """
+    with progress_lock:
+        if succeeded:
+            progress['done_bytes'] += get_planned_size(task)
+            progress['done_count'] += 1
+        else:
+            progress['failed_bytes'] += get_planned_size(task)
+            progress['failed_count'] += 1
+        remaining_bytes = progress['total_bytes'] - progress['done_bytes'] - progress['failed_bytes']
+        elapsed = time.time() - progress['start_time']
+        rate = progress['done_bytes'] / elapsed if elapsed > 0 else 0
+        eta = format_seconds(remaining_bytes / rate) if rate > 0 else 'unknown'
+        script_logging.log_status('Progress: %s of %s files done, %s failed, %s remaining, %s/s, ETA %s'
+            % (progress['done_count'], progress['total_count'], progress['failed_count'],
+                format_bytes(remaining_bytes), format_bytes(rate), eta))
+
+#################### Download Functions ####################
+
+def run_downloads(tasks, worker_count=DOWNLOAD_WORKERS, segmented=False, use_blob_store=False):
+    """Plan the downloads for a list of tasks & run them in worker threads.
+    segmented & use_blob_store parameters are passed on to download_queue.run_task().
+    """
+    ledger = download_ledger.load_ledger()
+    failures = download_failures.load_failures()
+    try:
+        tasks = plan_downloads(ledger, tasks)
+        if tasks is None:
+            return
+        progress = make_progress(tasks)
+
+        def run_planned_task(task):
+            succeeded = download_queue.run_task(ledger, failures, task, segmented=segmented, use_blob_store=use_blob_store)
+            update_progress(progress, task, succeeded)
+
+        pool = multiprocessing.pool.ThreadPool(worker_count)
+        try:
+            pool.map(run_planned_task, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        download_ledger.save_ledger(ledger)
+        download_failures.save_failures(failures)
+        download_metrics.write_report()
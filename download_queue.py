@@ -0,0 +1,216 @@
+"""Queue of files for the download scripts to fetch.
+export_student_artifacts.py writes the queue while it creates the student
+folders, so the download scripts don't have to walk the whole exports folder
+& re-parse every student's csv files to find out what to download.
+
+The queue is kept in a hidden folder in the exports folder, with one file
+per course, named after the Canvas course ID. Each line of a queue file
+is a JSON object describing one download task:
+
+    {"kind": "attachment",
+     "url": "https://ourdomain.instructure.com/files/8080/download?download_frd=1&verifier=zVZdnk",
+     "target": "exports/CalStateTEACH Term 1/grios/Mentor Info.docx",
+     "size": 48213,
+     "content_type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+     "key": "8080",
+     "updated_at": "2019-05-08T17:21:44Z",
+     "course_id": 101, "assignment_id": 2020, "user_id": 3030, "file_id": 8080}
+
+"size" is the expected file size in bytes, or null if Canvas doesn't tell us.
+"key" identifies the file in the download ledger.
+
+The work can be split between several processes or machines by giving each
+one a shard of the queue. Shards can be made up of whole courses, or of tasks
+assigned by a hash of their target path, which spreads big courses around.
+
+10.19.2026 tps Created.
+10.19.2026 tps Record failed tasks in the download failure store.
+10.19.2026 tps Include content type in download tasks.
+10.19.2026 tps Measure each download task for the download metrics report.
+10.19.2026 tps Log an event for each download task.
+10.19.2026 tps Optionally load just the tasks for given courses, for the pipeline runner.
+10.19.2026 tps Reject unknown ways to split the queue into shards.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import time
+
+import download_failures
+import download_ledger
+import download_metrics
+import path_consts
+import script_logging
+
+#################### Constants ####################
+
+# Kinds of download tasks
+KIND_ATTACHMENT = 'attachment'
+KIND_THUMBNAIL  = 'thumbnail'
+KIND_MEDIA      = 'media'
+
+# Ways to split the queue into shards
+SHARD_BY_COURSE = 'course'
+SHARD_BY_HASH   = 'hash'
+SHARD_BY_CHOICES = (SHARD_BY_COURSE, SHARD_BY_HASH)
+
+QUEUE_FILE_EXTENSION = '.jsonl'
+
+#################### Helper Functions ####################
+
+def make_task(kind, url, file_name, key, updated_at, size=None, content_type=None, **ids):
+    """Return a dictionary describing a download task.
+    The task's target path is filled in when the student's folder is written.
+    ids -- Canvas IDs identifying where the file came from, e.g. course_id.
+    """
+    task = {
+        'kind': kind,
+        'url': url,
+        'file_name': file_name,
+        'size': size,
+        'content_type': content_type,
+        'key': key,
+        'updated_at': updated_at }
+    task.update(ids)
+    return task
+
+def set_target_folder(task, folder_path):
+    """Replace a task's file name with its target path in the given folder."""
+    task['target'] = os.path.join(folder_path, task.pop('file_name'))
+    return task
+
+def get_shard(value, shard_count):
+    """Return shard number for a value. Uses md5 instead of hash() so every
+    process & machine agrees on the answer.
+    """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return int(hashlib.md5(str(value)).hexdigest(), 16) % shard_count
+
+def get_queue_file_name(course_id):
+    return os.path.join(path_consts.DOWNLOAD_QUEUE_FOLDER, '%s%s' % (course_id, QUEUE_FILE_EXTENSION))
+
+def parse_shard_args(args):
+    """Parse command line arguments selecting a shard of the queue, like:
+        --shard 2/4 --shard-by hash
+    Shard numbers start at 0. Returns a dictionary of keyword arguments
+    for the download functions. Exits with a usage message if --shard-by
+    isn't one of the ways to split the queue.
+    """
+    shard_args = {}
+    if '--shard' in args:
+        (shard_index, shard_count) = args[args.index('--shard') + 1].split('/')
+        shard_args['shard_index'] = int(shard_index)
+        shard_args['shard_count'] = int(shard_count)
+    if '--shard-by' in args:
+        shard_args['shard_by'] = args[args.index('--shard-by') + 1]
+        if shard_args['shard_by'] not in SHARD_BY_CHOICES:
+            sys.exit('Usage: --shard <index>/<count> --shard-by {%s}. Unknown --shard-by value: %s'
+                % ('|'.join(SHARD_BY_CHOICES), shard_args['shard_by']))
+    return shard_args
+
+#################### Queue Storage ####################
+
+def clear_queue():
+    """Delete all queue files, so courses that are no longer exported don't leave work behind."""
+    if os.path.isdir(path_consts.DOWNLOAD_QUEUE_FOLDER):
+        shutil.rmtree(path_consts.DOWNLOAD_QUEUE_FOLDER)
+
+def write_course_queue(course_id, tasks):
+    """Write the download tasks for a course to its queue file."""
+    if not os.path.isdir(path_consts.DOWNLOAD_QUEUE_FOLDER):
+        os.makedirs(path_consts.DOWNLOAD_QUEUE_FOLDER)
+
+    file_name = get_queue_file_name(course_id)
+    script_logging.log_status('Writing %s' % file_name)
+    with io.open(file_name, 'w', encoding='utf-8') as f:
+        for task in tasks:
+            f.write(unicode(json.dumps(task, ensure_ascii=False)) + u'\n')
+
+def load_tasks(kinds, shard_index=0, shard_count=1, shard_by=SHARD_BY_COURSE, course_ids=None):
+    """Return list of queued download tasks of the given kinds that belong to a shard.
+    kinds -- Tuple of task kinds to load.
+    shard_index -- Which shard to load, numbered from 0.
+    shard_count -- Number of shards the queue is split into.
+    shard_by -- SHARD_BY_COURSE or SHARD_BY_HASH.
+    course_ids -- List of Canvas IDs of the courses to load tasks for, or None for all courses.
+    """
+    if shard_by not in SHARD_BY_CHOICES:
+        raise ValueError('Unknown way to shard the download queue: %s' % shard_by)
+    tasks = []
+    if not os.path.isdir(path_consts.DOWNLOAD_QUEUE_FOLDER):
+        script_logging.log_error('No download queue found in %s' % path_consts.DOWNLOAD_QUEUE_FOLDER)
+        return tasks
+
+    for queue_file in sorted(os.listdir(path_consts.DOWNLOAD_QUEUE_FOLDER)):
+        if not queue_file.endswith(QUEUE_FILE_EXTENSION):
+            continue
+
+        # The queue files are named after their courses, so we only have to
+        # read the files for the courses in our shard.
+        course_id = queue_file[:-len(QUEUE_FILE_EXTENSION)]
+        if (course_ids is not None) and (course_id not in [str(id) for id in course_ids]):
+            continue
+        if (shard_by == SHARD_BY_COURSE) and (get_shard(course_id, shard_count) != shard_index):
+            continue
+
+        with io.open(os.path.join(path_consts.DOWNLOAD_QUEUE_FOLDER, queue_file), 'r', encoding='utf-8') as f:
+            for line in f:
+                task = json.loads(line)
+                if task['kind'] not in kinds:
+                    continue
+                if (shard_by == SHARD_BY_HASH) and (get_shard(task['target'], shard_count) != shard_index):
+                    continue
+                tasks.append(task)
+
+    script_logging.log_status('Loaded %s download tasks of kinds %s for shard %s of %s'
+        % (len(tasks), ', '.join(kinds), shard_index, shard_count))
+    return tasks
+
+#################### Task Execution ####################
+
+def log_download_event(task, start_time, error=None):
+    """Log an event for a finished download task, with the bytes it received.
+    Call before download_metrics.finish_download(), which discards the measurements.
+    """
+    download = download_metrics.get_current()
+    script_logging.log_event('download',
+        kind=task['kind'],
+        course_id=task.get('course_id'),
+        assignment_id=task.get('assignment_id'),
+        target=task['target'],
+        bytes=download['bytes'] if download else 0,
+        error=None if error is None else error.__class__.__name__,
+        duration=time.time() - start_time)
+
+def run_task(ledger, failures, task, segmented=False, use_blob_store=False):
+    """Download the file for a task, unless the download ledger shows it hasn't changed.
+    A failed download is recorded in the download failure store, to be retried later.
+    Returns True if the file is in place, False if the download failed.
+    """
+    start_time = time.time()
+    download_metrics.start_download()
+    try:
+        download_ledger.download_if_changed(ledger,
+            task['key'],
+            task['updated_at'],
+            task['size'],
+            task['url'],
+            task['target'],
+            segmented=segmented,
+            use_blob_store=use_blob_store)
+    except Exception as e:
+        log_download_event(task, start_time, e)
+        download_metrics.finish_download(task, e)
+        script_logging.log_status('Recording failed download of %s' % task['target'])
+        download_failures.record_failure(failures, task, e)
+        return False
+
+    log_download_event(task, start_time)
+    download_metrics.finish_download(task)
+    download_failures.record_success(failures, task)
+    return True
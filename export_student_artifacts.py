@@ -46,18 +46,41 @@ may cause problems to UTF-8.
 01.16.2019 tps Handle multiple rubric assessments per assignment.
 05.08.2019 tps Add a thumbnail file name that we make up to the attachments output, since Canvas does not supply
                thunbnail file names.
+10.19.2026 tps Include attachment ID, size & update time, so downloads can skip files that haven't changed.
+10.19.2026 tps Write queue of files for the download scripts to fetch.
+10.19.2026 tps Include attachment content type, & content type & size in the download queue, for download planning.
+10.19.2026 tps Optionally generate each course's HTML pages straight from the student data in memory,
+               instead of having make_html.py read it back from the csv files.
+10.19.2026 tps Build the full-text search index for each course.
+10.19.2026 tps Log events timing each course's export & each csv file written.
+10.19.2026 tps Accept --profile, to profile the stage. See stage_profiler.py.
+10.19.2026 tps Split out the export of a single course, for the pipeline runner.
+10.19.2026 tps Optionally publish each student folder to queues as soon as it's written. See stream_exports.py.
+10.19.2026 tps Added EXPORT_VERSION, so the pipeline runner exports courses again when the export changes.
 """
 
 import collections
 # import csv
 import os
+import sys
+import time
 import unicodecsv as csv
 import io
 
 
+import download_queue
 import script_logging
 import json_artifacts
+import make_html
 import path_consts
+import search_index
+import stage_profiler
+
+#################### Constants ####################
+
+# Part of the pipeline's export fingerprint. Change it when the exported files change,
+# so run_pipeline.py exports courses exported by an older version of this script again.
+EXPORT_VERSION = 1
 
 #################### String Constants ####################
 
@@ -67,6 +90,15 @@ DICT_KEY_SUBMISSIONS        = 'submissions'
 DICT_KEY_COMMENTS           = 'submission_comments'
 DICT_KEY_ATTACHMENTS        = 'submission_attachments'
 DICT_KEY_RUBRIC_ASSESSMENTS = 'submission_rubric_assessments'
+DICT_KEY_DOWNLOADS          = 'downloads'
+
+# Dictionary keys of the student folders published by write_student_folders().
+STREAM_KEY_COURSE_ID        = 'course_id'
+STREAM_KEY_COURSE_FOLDER    = 'course_folder'   # Name of the course folder
+STREAM_KEY_STUDENT_FOLDERS  = 'student_folders' # Sorted list of the names of the course's student folders
+STREAM_KEY_PAGE_INDEX       = 'page_index'      # Position of the student's folder in the list
+STREAM_KEY_DOWNLOADS        = 'downloads'       # List of the student's download tasks
+STREAM_KEY_CSV_LISTS        = 'csv_lists'       # Student's data by csv file name, for make_html.make_student_page()
 
 #################### CSV File Headers ####################
 
@@ -101,7 +133,11 @@ SUBMISSION_ATTACHMENT_HEADERS = (
     'file_name',
     'display_name',
     'thumbnail_url',
-    'thumbnail_file')
+    'thumbnail_file',
+    'attachment_id',
+    'size',
+    'updated_at',
+    'content_type')
 
 SUBMISSION_RUBRIC_ASSESSMENT_HEADERS = (
     'submission_id',
@@ -143,10 +179,12 @@ def write_csv_file(file_path, csv_headers, csv_data):
         #     print(data)
         #     csv_writer.writerow(data)
 
-    with io.FileIO(file_path, 'w') as f:
-        w = csv.writer(f, encoding='utf-8')
-        w.writerow(csv_headers)
-        w.writerows(csv_data)
+    with script_logging.timed('write_csv', file=file_path, rows=len(csv_data)) as fields:
+        with io.FileIO(file_path, 'w') as f:
+            w = csv.writer(f, encoding='utf-8')
+            w.writerow(csv_headers)
+            w.writerows(csv_data)
+            fields['bytes'] = f.tell()
 
 
 def load_csv_file(csv_file_path):
@@ -173,13 +211,54 @@ def load_csv_file(csv_file_path):
     #         csv_list = list(f_csv)
     # return csv_list
 
+def csv_string(value):
+    """Return a data value as the unicode string it becomes after a trip through a csv file."""
+    if value is None:
+        return u''
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if isinstance(value, float):
+        return unicode(repr(value))     # The csv writer uses repr() for floats.
+    return unicode(value)
+
+def make_csv_list(csv_headers, csv_data):
+    """Return csv data in the same form that load_csv_file() returns it,
+    as if it had been written to a csv file & loaded back.
+    csv_headers -- Tuple containing csv headers.
+    csv_data -- List of tuples containing csv data rows.
+    """
+    csv_headers = [csv_string(header) for header in csv_headers]
+    named_tuple_type = collections.namedtuple('row_tuple_type', csv_headers)
+    return [csv_headers] + [named_tuple_type._make(map(csv_string, row)) for row in csv_data]
 
-#################### Data Parsing Functions ####################
 
-def write_student_folders():
-    """Create student data folders from JSON data files."""
+def get_search_documents(user_name, student_data):
+    """Return list of search index documents for a student's submission text,
+    submission comments & rubric assessment comments.
+    """
+    documents = []
+    assignment_names = {}
+    for submission in student_data[DICT_KEY_SUBMISSIONS]:
+        assignment_names[submission[0]] = csv_string(submission[4])
+        if submission[8]:
+            documents.append(search_index.make_document(user_name, assignment_names[submission[0]],
+                search_index.KIND_SUBMISSION, user_name, csv_string(submission[8])))
+    for comment in student_data[DICT_KEY_COMMENTS]:
+        documents.append(search_index.make_document(user_name, assignment_names.get(comment[0], u''),
+            search_index.KIND_COMMENT, csv_string(comment[3]), csv_string(comment[2])))
+    for rubric_assessment in student_data[DICT_KEY_RUBRIC_ASSESSMENTS]:
+        if rubric_assessment[4]:
+            documents.append(search_index.make_document(user_name, assignment_names.get(rubric_assessment[0], u''),
+                search_index.KIND_RUBRIC, csv_string(rubric_assessment[1]), csv_string(rubric_assessment[4])))
+    return documents
+
+
+#################### Data Parsing Functions ####################
 
-    # Make sure the top-level exports folder exist.
+def begin_export():
+    """Make sure the top-level exports folder exists & write the export time stamp to it."""
     if not os.path.isdir(path_consts.EXPORTS_FOLDER):
         os.mkdir(path_consts.EXPORTS_FOLDER)
 
@@ -187,336 +266,473 @@ def write_student_folders():
     with open(path_consts.TIME_STAMP_FILE_NAME, 'w') as f:
         f.write(json_artifacts.get_time_stamp())
 
-    # Walk through exports for each course.
-    courses = json_artifacts.load_courses_json()
-    for course in courses:
-        
-        # Course data needed for export records
-        course_id = course['id']
-        course_name = course['name']
-        course_code = course['course_code']
-        course_start_at = course['start_at']
-
-        # Dictionary for resolving user IDs of students & commenters to their user names.
-        user_lookup = json_artifacts.create_user_lookup(json_artifacts.load_users_json(course_id))
-
-        # Create dictionary collection used to accumulate submissions by student.
-        students_dict = {}
-        students = json_artifacts.load_students_json(course_id)
-        for student in students:
-
-            # Derive a user name to associate with the student record,
-            # instead of using the internal Canvas ID.
-            # We might not be able to derive a user name from the student 
-            # record, in which case we have to skip it.
-            user_name = get_user_name(student)
-            if user_name is None:
-                continue
-
-            # Stucture to accumulate submission data for each student in course.
-            students_dict[student['id']] = {
-                DICT_KEY_USER_NAME: user_name,
-                DICT_KEY_SUBMISSIONS: [],
-                DICT_KEY_COMMENTS: [],
-                DICT_KEY_ATTACHMENTS: [],
-                DICT_KEY_RUBRIC_ASSESSMENTS: [] }
-
-        # Walk through assignments in the course.
-        assignments = json_artifacts.load_assignments_json(course_id)
-        for assignment in assignments:
-            # Assume assignments are ordered by position.
-
-            # Assignment data needed for export records.
-            assignment_id = assignment['id']
-            assignment_name = assignment['name']
-
-            # Encode weird unicode characters as utf-8
-            # The description string might be Null.
-            assignment_description = assignment['description']
-            if (assignment_description is None):
-                assignment_description = ""
-            assignment_description = assignment_description.encode("utf-8")
-
-            # Walk through submissions for the assignment.
-            submissions = json_artifacts.load_submissions_json(assignment_id)
-            for submission in submissions:
-
-                # Submission data needed for export records.
-                submission_id = submission['id']
-                submitter_id = submission['user_id']
-
-                # 08.02.2018 tps Work on retrieving rubric points & comments, if any
-                """ If a submission has a rubric, it's in a dictionary property like this:
-      
-                    "rubric_assessment": {
-                        "_4848": {
-                            "points": 3.0, 
-                            "comments": ""
-                    }
-
-                    I don't know what the "_4848" key means, but it seems to be that there is only
-                    ever 1 entry, so we'll just say that we can grab that one entry's data & be done.
-                    
-                    - The entry might not have a 'points' property
-                    - 'comments' value might be null.
-                """
-                # submission_rubric_pts = None        # 01.16.2019 tps No longer used to generate HTML pages
-                # submission_rubric_comments = None   # 01.16.2019 tps No longer used to generate HTML pages
-
-                # if 'rubric_assessment' in submission:
-                #     # script_logging.log_status(
-                #     #     '**** Found rubric of type %s of length %s for course %s, assignment %s, submission %s, user %s'
-                #     #     % (type(submission['rubric_assessment']), len(submission['rubric_assessment']), course_id, assignment_id, submission_id, submitter_id))
-                #
-                #     rubric_dict = submission['rubric_assessment']
-                #     # rubric_element = rubric_dict[rubric_dict.keys()[0]]
-                #     # if 'points' in rubric_element:
-                #     #     submission_rubric_pts = rubric_element['points']
-                #     # if rubric_element['comments'] is not None:
-                #     #     submission_rubric_comments = rubric_element['comments']
-                #
-                #     # script_logging.log_status(
-                #     #     '**** Found rubric points %s comments %s'
-                #     #     % (submission_rubric_pts, submission_rubric_comments))
-                #
-                #     # 01.16.2019 tps Gather multiple rubric assessments into a flat data structure
-                #     # The rubric description & ratings come from the assignment record.
-                #     # The keys in the rubric assessment dictionary can be matched to IDs of
-                #     # rubric objects in the assignment record.
-                #     rubric_list = assignment['rubric']
-                #     for rubric_id, assessment in rubric_dict.iteritems():   # Loop through assessments
-                #
-                #         # There might not be a "points" field in the assessment, in which case
-                #         # there is nothing for us to report.
-                #         if 'points' not in assessment:
-                #             continue
-                #
-                #         # The "comments" value might be null, in which case use an empty string.
-                #         rubric_assessment_comments = ''
-                #         if assessment['comments'] is not None:
-                #             rubric_assessment_comments = assessment['comments']
-                #
-                #         # Find the rubric description
-                #         rubric = next(( x for x in rubric_list if x['id'] == rubric_id), None)
-                #
-                #         # Find the corresponding assessment rating
-                #         # There may not be corresponding rating object for the points value
-                #         rating = next(( x for x in rubric['ratings'] if x['points'] == assessment['points']), None)
-                #         rating_description = ''
-                #         if rating is not None:
-                #             rating_description = rating['description']
-                #
-                #         rubric_assessment = (
-                #             submission_id,
-                #             rubric['description'],
-                #             assessment['points'],
-                #             rating_description,
-                #             rubric_assessment_comments.encode("utf-8")
-                #         )
-                #         students_dict[submitter_id][DICT_KEY_RUBRIC_ASSESSMENTS].append(rubric_assessment)
-
-                # We've found cases where the submitter is "Test Student",
-                # which is a student created by Canvas for impersonation purposes.
-                # Since this is not a real student, it won't be found in the student
-                # collection, & it should be OK to skip these submissions.
-
-                # We've found cases where the submitter is a student with pending
-                # enrollment & the user object retrieved from Canvas doesn't 
-                # have email login ID. This means it won't be found in the
-                # student_dict collection, & it should be OK to skip it.
-
-                if (submitter_id in user_lookup) and (submitter_id in students_dict):
-                    submission_user = user_lookup[submitter_id]
-
-
-                    submission_user_name = get_user_name(submission_user)
-                    submitted_at = submission['submitted_at']
-                    submission_type = submission['submission_type']
-                    submission_body = submission['body']
-                    if submission_body is not None:
-                         # Encode weird unicode characters as utf-8
-                        submission_body = submission_body.encode("utf-8")
-                    submission_url = submission['url']
-
-                    # 09.02.2017 tps
-                    # Collect data for media_recording submission, which needs to be
-                    # downloaded separately.
-                    # Assume that all the media recordings are video/mp4 files.
-                    submission_media_file = None    # Name for downloaded file
-                    submission_media_type = None
-                    submission_media_url = None
-                    if submission_type == 'media_recording':
-                        media_comment = submission['media_comment']
-                        submission_media_file = media_comment['media_id'] + '.mp4'
-                        submission_media_type = media_comment['media_type']
-                        submission_media_url = media_comment['url']
-
-                        # print('Submission for course %s %s, assignment %s, submission %s, user %s, type %s' % (course_id, course_name, assignment_id, submission_id, submission_user_name, submission_type))
-                        # print(submission_media_file)
-                        #print('media url: %s type: %s, display_name: %s' % (submission['media_comment']['url'], submission['media_comment']['media_type'], submission['media_comment']['display_name']))
-
-                    # Gather student's submission data.
-                    submission_data = (
-                        submission_id,
-                        submission_user_name,
-                        course_name,
-                        course_start_at,
-                        assignment_name,
-                        assignment_description,
-                        submitted_at, 
-                        submission_type,
-                        submission_body,
-                        submission_url,
-                        submission_media_file,
-                        submission_media_type,
+def export_course(course, render_html=False, student_queues=None):
+    """Create the student data folders for a course from its JSON data files,
+    & write the course's download queue & search index shard.
+    course -- Course JSON, as returned by json_artifacts.load_courses_json().
+    render_html -- Generate the course's HTML pages from the student data in memory.
+    student_queues -- List of queues to publish each student folder to. See write_student_folders().
+    """
+    # Course data needed for export records
+    course_start_time = time.time()
+    course_id = course['id']
+    course_name = course['name']
+    course_code = course['course_code']
+    course_start_at = course['start_at']
+
+    # Dictionary for resolving user IDs of students & commenters to their user names.
+    user_lookup = json_artifacts.create_user_lookup(json_artifacts.load_users_json(course_id))
+
+    # Create dictionary collection used to accumulate submissions by student.
+    students_dict = {}
+    students = json_artifacts.load_students_json(course_id)
+    for student in students:
+
+        # Derive a user name to associate with the student record,
+        # instead of using the internal Canvas ID.
+        # We might not be able to derive a user name from the student 
+        # record, in which case we have to skip it.
+        user_name = get_user_name(student)
+        if user_name is None:
+            continue
+
+        # Stucture to accumulate submission data for each student in course.
+        students_dict[student['id']] = {
+            DICT_KEY_USER_NAME: user_name,
+            DICT_KEY_SUBMISSIONS: [],
+            DICT_KEY_COMMENTS: [],
+            DICT_KEY_ATTACHMENTS: [],
+            DICT_KEY_RUBRIC_ASSESSMENTS: [],
+            DICT_KEY_DOWNLOADS: [] }
+
+    # Walk through assignments in the course.
+    assignments = json_artifacts.load_assignments_json(course_id)
+    for assignment in assignments:
+        # Assume assignments are ordered by position.
+
+        # Assignment data needed for export records.
+        assignment_id = assignment['id']
+        assignment_name = assignment['name']
+
+        # Encode weird unicode characters as utf-8
+        # The description string might be Null.
+        assignment_description = assignment['description']
+        if (assignment_description is None):
+            assignment_description = ""
+        assignment_description = assignment_description.encode("utf-8")
+
+        # Walk through submissions for the assignment.
+        submissions = json_artifacts.load_submissions_json(assignment_id)
+        for submission in submissions:
+
+            # Submission data needed for export records.
+            submission_id = submission['id']
+            submitter_id = submission['user_id']
+
+            # 08.02.2018 tps Work on retrieving rubric points & comments, if any
+            """ If a submission has a rubric, it's in a dictionary property like this:
+  
+                "rubric_assessment": {
+                    "_4848": {
+                        "points": 3.0, 
+                        "comments": ""
+                }
+
+                I don't know what the "_4848" key means, but it seems to be that there is only
+                ever 1 entry, so we'll just say that we can grab that one entry's data & be done.
+                
+                - The entry might not have a 'points' property
+                - 'comments' value might be null.
+            """
+            # submission_rubric_pts = None        # 01.16.2019 tps No longer used to generate HTML pages
+            # submission_rubric_comments = None   # 01.16.2019 tps No longer used to generate HTML pages
+
+            # if 'rubric_assessment' in submission:
+            #     # script_logging.log_status(
+            #     #     '**** Found rubric of type %s of length %s for course %s, assignment %s, submission %s, user %s'
+            #     #     % (type(submission['rubric_assessment']), len(submission['rubric_assessment']), course_id, assignment_id, submission_id, submitter_id))
+            #
+            #     rubric_dict = submission['rubric_assessment']
+            #     # rubric_element = rubric_dict[rubric_dict.keys()[0]]
+            #     # if 'points' in rubric_element:
+            #     #     submission_rubric_pts = rubric_element['points']
+            #     # if rubric_element['comments'] is not None:
+            #     #     submission_rubric_comments = rubric_element['comments']
+            #
+            #     # script_logging.log_status(
+            #     #     '**** Found rubric points %s comments %s'
+            #     #     % (submission_rubric_pts, submission_rubric_comments))
+            #
+            #     # 01.16.2019 tps Gather multiple rubric assessments into a flat data structure
+            #     # The rubric description & ratings come from the assignment record.
+            #     # The keys in the rubric assessment dictionary can be matched to IDs of
+            #     # rubric objects in the assignment record.
+            #     rubric_list = assignment['rubric']
+            #     for rubric_id, assessment in rubric_dict.iteritems():   # Loop through assessments
+            #
+            #         # There might not be a "points" field in the assessment, in which case
+            #         # there is nothing for us to report.
+            #         if 'points' not in assessment:
+            #             continue
+            #
+            #         # The "comments" value might be null, in which case use an empty string.
+            #         rubric_assessment_comments = ''
+            #         if assessment['comments'] is not None:
+            #             rubric_assessment_comments = assessment['comments']
+            #
+            #         # Find the rubric description
+            #         rubric = next(( x for x in rubric_list if x['id'] == rubric_id), None)
+            #
+            #         # Find the corresponding assessment rating
+            #         # There may not be corresponding rating object for the points value
+            #         rating = next(( x for x in rubric['ratings'] if x['points'] == assessment['points']), None)
+            #         rating_description = ''
+            #         if rating is not None:
+            #             rating_description = rating['description']
+            #
+            #         rubric_assessment = (
+            #             submission_id,
+            #             rubric['description'],
+            #             assessment['points'],
+            #             rating_description,
+            #             rubric_assessment_comments.encode("utf-8")
+            #         )
+            #         students_dict[submitter_id][DICT_KEY_RUBRIC_ASSESSMENTS].append(rubric_assessment)
+
+            # We've found cases where the submitter is "Test Student",
+            # which is a student created by Canvas for impersonation purposes.
+            # Since this is not a real student, it won't be found in the student
+            # collection, & it should be OK to skip these submissions.
+
+            # We've found cases where the submitter is a student with pending
+            # enrollment & the user object retrieved from Canvas doesn't 
+            # have email login ID. This means it won't be found in the
+            # student_dict collection, & it should be OK to skip it.
+
+            if (submitter_id in user_lookup) and (submitter_id in students_dict):
+                submission_user = user_lookup[submitter_id]
+
+
+                submission_user_name = get_user_name(submission_user)
+                submitted_at = submission['submitted_at']
+                submission_type = submission['submission_type']
+                submission_body = submission['body']
+                if submission_body is not None:
+                     # Encode weird unicode characters as utf-8
+                    submission_body = submission_body.encode("utf-8")
+                submission_url = submission['url']
+
+                # 09.02.2017 tps
+                # Collect data for media_recording submission, which needs to be
+                # downloaded separately.
+                # Assume that all the media recordings are video/mp4 files.
+                submission_media_file = None    # Name for downloaded file
+                submission_media_type = None
+                submission_media_url = None
+                if submission_type == 'media_recording':
+                    media_comment = submission['media_comment']
+                    submission_media_file = media_comment['media_id'] + '.mp4'
+                    submission_media_type = media_comment['media_type']
+                    submission_media_url = media_comment['url']
+
+                    # Queue the media file for download.
+                    # A media ID always refers to the same recording, so use the submission time as its update time.
+                    students_dict[submitter_id][DICT_KEY_DOWNLOADS].append(download_queue.make_task(
+                        download_queue.KIND_MEDIA,
                         submission_media_url,
-                        submission['grade']
-                        # submission_rubric_pts,
-                        # submission_rubric_comments
-                    )
-                    students_dict[submitter_id][DICT_KEY_SUBMISSIONS].append(submission_data)
-
-                    # Gather submission comments, if any.
-                    submission_comments = submission[DICT_KEY_COMMENTS]
-                    if len(submission_comments) > 0:
-                        for submission_comment in submission_comments:
-
-                            # Extract items we need to export records.
-                            comment_created_at = submission_comment['created_at']
-                            comment = submission_comment['comment'].encode("utf-8")
-
-                            # 01.11.2019 tps We can always retrieve the author's name from the submission record.
-                            author_user_name = submission_comment['author']['display_name']
-
-                            # 01.11.2019 tps We'd prefer to show the user's login name, but We've seen cases where
-                            # the comment author was dropped from the course,
-                            # in which case there is no user record for them.
-                            comment_author_id = submission_comment['author_id']
-                            if comment_author_id in user_lookup:
-                                commenter = user_lookup[submission_comment['author_id']]
-                                author_user_name = get_user_name(commenter)
-                            else:
-                                script_logging.log_error('Encountered submission comment in course %s (%s), assignment %s (%s), submitted by user %s (%s) who is not enrolled in the course'
-                                    % (
-                                    course_name,
-                                    course_id,
-                                    assignment_name,
-                                    assignment_id,
-                                    author_user_name,
-                                    comment_author_id
-                                    ))
-
-                            # commenter = user_lookup[submission_comment['author_id']]
-                            # author_user_name = get_user_name(commenter)
-
-                            # Accumulate submission comments for the student.
-                            comment_data = (
-                                submission_id,
-                                comment_created_at,
-                                comment,
-                                author_user_name)
-                            students_dict[submitter_id][DICT_KEY_COMMENTS].append(comment_data)
-
-
-                    # Gather submission attachments, if any.
-                    if 'attachments' in submission:
-                        for submission_attachment in submission['attachments']:
-                            # Accumulate submission attachment data for the student.
-
-                            # 05.08.2019 tps If there is a thumbnail for the attachment, make up a name
-                            # for its thumbnail file, since Canvas doesn't provide names for thumbnail files.
-                            # Assume all thumbnails are PNG images.
-                            thumbnail_file = None
-                            if submission_attachment['thumbnail_url']:
-                                thumbnail_file = 'thumb' + str(hash(submission_attachment['thumbnail_url'])) + '.png'
-
-                            attachment_data = (
-                                submission_id,
-                                submission_attachment['url'],
-                                submission_attachment['filename'],
-                                submission_attachment['display_name'],
-                                # submission_attachment['display_name'].replace('/', '%2F'),  # Some attachments have weird file names
+                        submission_media_file,
+                        'media_' + submission_media_file,
+                        submitted_at,
+                        content_type='video/mp4',
+                        course_id=course_id,
+                        assignment_id=assignment_id,
+                        user_id=submitter_id))
+
+                    # print('Submission for course %s %s, assignment %s, submission %s, user %s, type %s' % (course_id, course_name, assignment_id, submission_id, submission_user_name, submission_type))
+                    # print(submission_media_file)
+                    #print('media url: %s type: %s, display_name: %s' % (submission['media_comment']['url'], submission['media_comment']['media_type'], submission['media_comment']['display_name']))
+
+                # Gather student's submission data.
+                submission_data = (
+                    submission_id,
+                    submission_user_name,
+                    course_name,
+                    course_start_at,
+                    assignment_name,
+                    assignment_description,
+                    submitted_at, 
+                    submission_type,
+                    submission_body,
+                    submission_url,
+                    submission_media_file,
+                    submission_media_type,
+                    submission_media_url,
+                    submission['grade']
+                    # submission_rubric_pts,
+                    # submission_rubric_comments
+                )
+                students_dict[submitter_id][DICT_KEY_SUBMISSIONS].append(submission_data)
+
+                # Gather submission comments, if any.
+                submission_comments = submission[DICT_KEY_COMMENTS]
+                if len(submission_comments) > 0:
+                    for submission_comment in submission_comments:
+
+                        # Extract items we need to export records.
+                        comment_created_at = submission_comment['created_at']
+                        comment = submission_comment['comment'].encode("utf-8")
+
+                        # 01.11.2019 tps We can always retrieve the author's name from the submission record.
+                        author_user_name = submission_comment['author']['display_name']
+
+                        # 01.11.2019 tps We'd prefer to show the user's login name, but We've seen cases where
+                        # the comment author was dropped from the course,
+                        # in which case there is no user record for them.
+                        comment_author_id = submission_comment['author_id']
+                        if comment_author_id in user_lookup:
+                            commenter = user_lookup[submission_comment['author_id']]
+                            author_user_name = get_user_name(commenter)
+                        else:
+                            script_logging.log_error('Encountered submission comment in course %s (%s), assignment %s (%s), submitted by user %s (%s) who is not enrolled in the course'
+                                % (
+                                course_name,
+                                course_id,
+                                assignment_name,
+                                assignment_id,
+                                author_user_name,
+                                comment_author_id
+                                ))
+
+                        # commenter = user_lookup[submission_comment['author_id']]
+                        # author_user_name = get_user_name(commenter)
+
+                        # Accumulate submission comments for the student.
+                        comment_data = (
+                            submission_id,
+                            comment_created_at,
+                            comment,
+                            author_user_name)
+                        students_dict[submitter_id][DICT_KEY_COMMENTS].append(comment_data)
+
+
+                # Gather submission attachments, if any.
+                if 'attachments' in submission:
+                    for submission_attachment in submission['attachments']:
+                        # Accumulate submission attachment data for the student.
+
+                        # 05.08.2019 tps If there is a thumbnail for the attachment, make up a name
+                        # for its thumbnail file, since Canvas doesn't provide names for thumbnail files.
+                        # Assume all thumbnails are PNG images.
+                        thumbnail_file = None
+                        if submission_attachment['thumbnail_url']:
+                            thumbnail_file = 'thumb' + str(hash(submission_attachment['thumbnail_url'])) + '.png'
+
+                        attachment_data = (
+                            submission_id,
+                            submission_attachment['url'],
+                            submission_attachment['filename'],
+                            submission_attachment['display_name'],
+                            # submission_attachment['display_name'].replace('/', '%2F'),  # Some attachments have weird file names
+                            submission_attachment['thumbnail_url'],
+                            thumbnail_file,
+                            submission_attachment['id'],
+                            submission_attachment['size'],
+                            submission_attachment['updated_at'],
+                            submission_attachment['content-type']
+                        )
+                        students_dict[submitter_id][DICT_KEY_ATTACHMENTS].append(attachment_data)
+
+                        # Queue the attachment & its thumbnail for download.
+                        # The thumbnail changes when its attachment does.
+                        attachment_ids = {
+                            'course_id': course_id,
+                            'assignment_id': assignment_id,
+                            'user_id': submitter_id,
+                            'file_id': submission_attachment['id'] }
+                        students_dict[submitter_id][DICT_KEY_DOWNLOADS].append(download_queue.make_task(
+                            download_queue.KIND_ATTACHMENT,
+                            submission_attachment['url'],
+                            submission_attachment['filename'],
+                            str(submission_attachment['id']),
+                            submission_attachment['updated_at'],
+                            submission_attachment['size'],
+                            submission_attachment['content-type'],
+                            **attachment_ids))
+                        if thumbnail_file:
+                            students_dict[submitter_id][DICT_KEY_DOWNLOADS].append(download_queue.make_task(
+                                download_queue.KIND_THUMBNAIL,
                                 submission_attachment['thumbnail_url'],
-                                thumbnail_file
-                            )
-                            students_dict[submitter_id][DICT_KEY_ATTACHMENTS].append(attachment_data)
-
-                            # print('attachment for course %s, assignment %s, submission %s, user %s, type %s, display name %s' % (course_name, assignment_id, submission_id, user_name, submission_type, submission_attachment['display_name']))
-                            #print('attachment for course %s, assignment %s, submission %s, user %s, type %s, display name %s' % (course_name, assignment_id, submission_id, user_name, submission_type, submission_attachment['display_name']))
-
-                    # 01.16.2019 tps Gather multiple rubric assessments into a flat data structure.
-                    # The rubric description & ratings come from the assignment record.
-                    # The keys in the rubric assessment dictionary can be matched to IDs of
-                    # rubric objects in the assignment record.
-                    if 'rubric_assessment' in submission:
-
-                        rubric_dict = submission['rubric_assessment']
-                        rubric_list = assignment['rubric']
-                        for rubric_id, assessment in rubric_dict.iteritems():   # Loop through assessments
-
-                            # There might not be a "points" field in the assessment, in which case
-                            # there is nothing for us to report.
-                            if 'points' not in assessment:
-                                continue
-
-                            # The "comments" value might be null, in which case use an empty string.
-                            rubric_assessment_comments = ''
-                            if assessment['comments'] is not None:
-                                rubric_assessment_comments = assessment['comments']
-
-                            # Find the rubric description
-                            rubric = next(( x for x in rubric_list if x['id'] == rubric_id), None)
-
-                            # Find the corresponding assessment rating.
-                            # There may not be a corresponding rating object for the points value.
-                            rating = next(( x for x in rubric['ratings'] if x['points'] == assessment['points']), None)
-                            rating_description = ''
-                            if rating is not None:
-                                rating_description = rating['description']
-
-                            rubric_assessment = (
-                                submission_id,
-                                rubric['description'],
-                                assessment['points'],
-                                rating_description,
-                                rubric_assessment_comments.encode("utf-8")
-                            )
-                            students_dict[submitter_id][DICT_KEY_RUBRIC_ASSESSMENTS].append(rubric_assessment)
-
-                else:
-                    # Mention that we skipped a submission
-                    script_logging.log_status(
-                        'Skipped submission for course %s, assignment %s, submission %s, user %s'
-                        % (course_id, assignment_id, submission_id, submitter_id))
-
-        # Make a file directory to hold course data, named after the course.
-        course_folder_name = os.path.join(path_consts.EXPORTS_FOLDER, course_name)
-        if not os.path.isdir(course_folder_name):
-            os.mkdir(course_folder_name)
-
-        # We're ready to output all the course's student data csv files.
-        for user_id, student_data in students_dict.items():
-            # Each student gets their own folder, named by their user name.
-            user_name = student_data[DICT_KEY_USER_NAME]
-            student_folder_name = os.path.join(course_folder_name, user_name)
+                                thumbnail_file,
+                                'thumbnail_%s' % submission_attachment['id'],
+                                submission_attachment['updated_at'],
+                                content_type='image/png',
+                                **attachment_ids))
+
+                        # print('attachment for course %s, assignment %s, submission %s, user %s, type %s, display name %s' % (course_name, assignment_id, submission_id, user_name, submission_type, submission_attachment['display_name']))
+                        #print('attachment for course %s, assignment %s, submission %s, user %s, type %s, display name %s' % (course_name, assignment_id, submission_id, user_name, submission_type, submission_attachment['display_name']))
+
+                # 01.16.2019 tps Gather multiple rubric assessments into a flat data structure.
+                # The rubric description & ratings come from the assignment record.
+                # The keys in the rubric assessment dictionary can be matched to IDs of
+                # rubric objects in the assignment record.
+                if 'rubric_assessment' in submission:
+
+                    rubric_dict = submission['rubric_assessment']
+                    rubric_list = assignment['rubric']
+                    for rubric_id, assessment in rubric_dict.iteritems():   # Loop through assessments
+
+                        # There might not be a "points" field in the assessment, in which case
+                        # there is nothing for us to report.
+                        if 'points' not in assessment:
+                            continue
+
+                        # The "comments" value might be null, in which case use an empty string.
+                        rubric_assessment_comments = ''
+                        if assessment['comments'] is not None:
+                            rubric_assessment_comments = assessment['comments']
+
+                        # Find the rubric description
+                        rubric = next(( x for x in rubric_list if x['id'] == rubric_id), None)
+
+                        # Find the corresponding assessment rating.
+                        # There may not be a corresponding rating object for the points value.
+                        rating = next(( x for x in rubric['ratings'] if x['points'] == assessment['points']), None)
+                        rating_description = ''
+                        if rating is not None:
+                            rating_description = rating['description']
+
+                        rubric_assessment = (
+                            submission_id,
+                            rubric['description'],
+                            assessment['points'],
+                            rating_description,
+                            rubric_assessment_comments.encode("utf-8")
+                        )
+                        students_dict[submitter_id][DICT_KEY_RUBRIC_ASSESSMENTS].append(rubric_assessment)
+
+            else:
+                # Mention that we skipped a submission
+                script_logging.log_status(
+                    'Skipped submission for course %s, assignment %s, submission %s, user %s'
+                    % (course_id, assignment_id, submission_id, submitter_id))
+
+    # Make a file directory to hold course data, named after the course.
+    course_folder_name = os.path.join(path_consts.EXPORTS_FOLDER, course_name)
+    if not os.path.isdir(course_folder_name):
+        os.mkdir(course_folder_name)
+
+    # When publishing student folders, make them all first, so each student's
+    # place in the sorted list of the course's student folders is known as soon
+    # as the student's files are written. The list includes folders left over
+    # from earlier exports, the same as the list make_html.py pages through.
+    if student_queues:
+        for student_data in students_dict.values():
+            student_folder_name = os.path.join(course_folder_name, student_data[DICT_KEY_USER_NAME])
             if not os.path.isdir(student_folder_name):
                 os.mkdir(student_folder_name)
+        student_folders_list = make_html.get_subdirs(course_folder_name)
+
+    # We're ready to output all the course's student data csv files.
+    course_download_tasks = []
+    course_csv_lists = {}
+    for user_id, student_data in students_dict.items():
+        # Each student gets their own folder, named by their user name.
+        user_name = student_data[DICT_KEY_USER_NAME]
+        student_folder_name = os.path.join(course_folder_name, user_name)
+        if not os.path.isdir(student_folder_name):
+            os.mkdir(student_folder_name)
+
+        # Write submissions file.
+        file_path = os.path.join(student_folder_name, path_consts.SUBMISSIONS_FILE_NAME)
+        write_csv_file(file_path, SUBMISSION_HEADERS, student_data[DICT_KEY_SUBMISSIONS])
+
+        # Write submission comments file.
+        file_path = os.path.join(student_folder_name, path_consts.COMMENTS_FILE_NAME)
+        write_csv_file(file_path, SUBMISSION_COMMENT_HEADERS, student_data[DICT_KEY_COMMENTS])
+
+        # Write submission attachments file.
+        file_path = os.path.join(student_folder_name, path_consts.ATTACHMENTS_FILE_NAME)
+        write_csv_file(file_path, SUBMISSION_ATTACHMENT_HEADERS, student_data[DICT_KEY_ATTACHMENTS])
+
+        # Write rubric assessments file.
+        file_path = os.path.join(student_folder_name, path_consts.RUBRIC_ASSESSMENTS_FILE_NAME)
+        write_csv_file(file_path, SUBMISSION_RUBRIC_ASSESSMENT_HEADERS, student_data[DICT_KEY_RUBRIC_ASSESSMENTS])
+
+        # Files to download go in the student's folder.
+        for task in student_data[DICT_KEY_DOWNLOADS]:
+            course_download_tasks.append(download_queue.set_target_folder(task, student_folder_name))
+
+        # Keep the student's data in the form the HTML generator reads it from the csv files.
+        if render_html or student_queues:
+            course_csv_lists[user_name] = {
+                path_consts.SUBMISSIONS_FILE_NAME: make_csv_list(SUBMISSION_HEADERS, student_data[DICT_KEY_SUBMISSIONS]),
+                path_consts.COMMENTS_FILE_NAME: make_csv_list(SUBMISSION_COMMENT_HEADERS, student_data[DICT_KEY_COMMENTS]),
+                path_consts.ATTACHMENTS_FILE_NAME: make_csv_list(SUBMISSION_ATTACHMENT_HEADERS, student_data[DICT_KEY_ATTACHMENTS]),
+                path_consts.RUBRIC_ASSESSMENTS_FILE_NAME: make_csv_list(SUBMISSION_RUBRIC_ASSESSMENT_HEADERS, student_data[DICT_KEY_RUBRIC_ASSESSMENTS]) }
+
+        # Hand the finished student folder on. Blocks while a queue is full,
+        # so the export can't get too far ahead of the queues' consumers.
+        if student_queues:
+            student_folder = {
+                STREAM_KEY_COURSE_ID: course_id,
+                STREAM_KEY_COURSE_FOLDER: course_name,
+                STREAM_KEY_STUDENT_FOLDERS: student_folders_list,
+                STREAM_KEY_PAGE_INDEX: student_folders_list.index(user_name),
+                STREAM_KEY_DOWNLOADS: student_data[DICT_KEY_DOWNLOADS],
+                STREAM_KEY_CSV_LISTS: course_csv_lists.pop(user_name) }
+            for student_queue in student_queues:
+                student_queue.put(student_folder)
+
+    # Write the course's download queue.
+    download_queue.write_course_queue(course_id, course_download_tasks)
+
+    # Index the course's text for searching, in a consistent order of students.
+    search_documents = []
+    for student_data in sorted(students_dict.values(), key=lambda student_data: student_data[DICT_KEY_USER_NAME]):
+        search_documents += get_search_documents(student_data[DICT_KEY_USER_NAME], student_data)
+    search_index.write_course_index(course_id, course_name, search_documents)
+    script_logging.log_event('export_course',
+        course_id=course_id,
+        students=len(students_dict),
+        downloads=len(course_download_tasks),
+        duration=time.time() - course_start_time)
+
+    # Generate the course's HTML pages. Student folders left over from
+    # earlier exports are still in the course, so they get read from their csv files.
+    if render_html:
+        make_html.make_course_pages(course_name, student_csv_lists=course_csv_lists)
+
+
+def write_student_folders(render_html=False, student_queues=None):
+    """Create student data folders from JSON data files.
+    render_html -- Generate the HTML pages for each course as soon as its folders
+        are written, from the student data in memory. This saves make_html.py from
+        reading all the csv files back. The csv files are still written.
+    student_queues -- List of queues, e.g. bounded Queue.Queue objects, to publish each
+        student folder to as soon as its files are written, so downloads & HTML pages can
+        start on it while the export goes on. Each student folder is published as a
+        dictionary with the STREAM_KEY_* keys. Use instead of render_html.
+    """
+    begin_export()
 
-            # Write submissions file.
-            file_path = os.path.join(student_folder_name, path_consts.SUBMISSIONS_FILE_NAME)
-            write_csv_file(file_path, SUBMISSION_HEADERS, student_data[DICT_KEY_SUBMISSIONS])
+    # Start a new download queue & search index.
+    download_queue.clear_queue()
+    search_index.clear_index()
 
-            # Write submission comments file.
-            file_path = os.path.join(student_folder_name, path_consts.COMMENTS_FILE_NAME)
-            write_csv_file(file_path, SUBMISSION_COMMENT_HEADERS, student_data[DICT_KEY_COMMENTS])
+    # Walk through exports for each course.
+    courses = json_artifacts.load_courses_json()
+    for course in courses:
+        export_course(course, render_html, student_queues)
 
-            # Write submission attachments file.
-            file_path = os.path.join(student_folder_name, path_consts.ATTACHMENTS_FILE_NAME)
-            write_csv_file(file_path, SUBMISSION_ATTACHMENT_HEADERS, student_data[DICT_KEY_ATTACHMENTS])
+    search_index.write_course_list([(course['id'], course['name']) for course in courses])
 
-            # Write rubric assessments file.
-            file_path = os.path.join(student_folder_name, path_consts.RUBRIC_ASSESSMENTS_FILE_NAME)
-            write_csv_file(file_path, SUBMISSION_RUBRIC_ASSESSMENT_HEADERS, student_data[DICT_KEY_RUBRIC_ASSESSMENTS])
+    # Generate pages for any courses left over from earlier exports, & the top-level page.
+    if render_html:
+        exported_course_names = set(course['name'] for course in courses)
+        for course_folder in make_html.get_subdirs(path_consts.EXPORTS_FOLDER):
+            if course_folder not in exported_course_names:
+                make_html.make_course_pages(course_folder)
+        make_html.make_exports_html()
 
 
 
@@ -524,6 +740,8 @@ def write_student_folders():
 
 if __name__ == "__main__":
 
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
     script_logging.clear_logs()     # Existence of error log can tell us if errors occured. 
-    write_student_folders()
+    stage_profiler.run_stage('export', write_student_folders, render_html=('--render-html' in sys.argv[1:]))
 
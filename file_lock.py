@@ -0,0 +1,72 @@
+"""Locks that serialize updates to a file shared by several processes, like
+the download ledger, which sharded download processes load, merge their
+changes into & write back.
+
+A file's lock is held on a lock file next to it, named <file name>.lock.
+The lock is taken with fcntl.flock() on POSIX & msvcrt.locking() on Windows,
+so the operating system lets it go if a process dies while holding it.
+The lock file itself is left in place.
+
+Locks are per open file, not per thread, so a process mustn't take a lock
+it already holds, & threads of the same process should serialize their own
+updates with a threading lock as well.
+
+10.19.2026 tps Created.
+"""
+
+import contextlib
+import os
+import time
+
+try:
+    import fcntl    # POSIX
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    import msvcrt   # Windows
+
+#################### Constants ####################
+
+LOCK_FILE_SUFFIX = '.lock'
+RETRY_INTERVAL = 0.1    # Seconds between tries to take a lock on Windows
+
+#################### Lock Functions ####################
+
+@contextlib.contextmanager
+def locked(file_name):
+    """Context manager that holds the inter-process lock for a file, waiting for it if needed."""
+    lock_file = open(file_name + LOCK_FILE_SUFFIX, 'a+')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            # Lock the 1st byte of the file. LK_NBLCK fails at once if it's locked.
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except IOError:
+                    time.sleep(RETRY_INTERVAL)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        lock_file.close()
+
+def replace_file(temp_file_name, file_name):
+    """Rename a temporary file over the file it replaces. Used by everything
+    that writes a file through a temporary file, locked or not.
+    On POSIX, the rename replaces the old file in one step, so readers see
+    either the old file or the new one. Windows can't rename over an existing
+    file, so the old one is removed first. For a file other processes read under
+    its lock, hold the lock while doing this, so they never find it missing.
+    """
+    if os.name == 'nt' and os.path.isfile(file_name):
+        os.remove(file_name)
+    os.rename(temp_file_name, file_name)
@@ -2,39 +2,345 @@
 09.03.2017 tps Created.
 09.04.2017 tps Add error logging line suitable for attempting to recreate the download.
 05.07.2019 tps Log more response data, to diagnose download failures.
+10.19.2026 tps Stream downloads to a partial file & resume interrupted downloads with HTTP Range requests.
+10.19.2026 tps Add segmented download mode that fetches byte ranges of large files over parallel connections.
+10.19.2026 tps Optionally re-raise download errors, so callers can record what went wrong.
+10.19.2026 tps Throttle downloads to the global bandwidth limit.
+10.19.2026 tps Report time to first byte, bytes received & disk write time to download_metrics.
+10.19.2026 tps Check a segmented download by the bytes its segments received, not the size of the preallocated file.
+10.19.2026 tps Log each segment's byte count as debugging detail.
+10.19.2026 tps Move finished downloads into place with file_lock.replace_file().
 """
+import hashlib
+import json
+import os
+import threading
+import time
+
 import requests
+
+import bandwidth_limiter
+import download_metrics
+import file_lock
 import script_logging
 
 REQUEST_TIMEOUT = 30    # Request timeout in seconds
+CHUNK_SIZE = 64 * 1024  # Bytes to read from the response stream at a time
+
+# Suffixes for the files that hold an interrupted download until it can be resumed.
+PARTIAL_FILE_SUFFIX = '.part'       # Bytes received so far
+PARTIAL_INFO_SUFFIX = '.part.json'  # Response validators needed to resume safely
+
+# Segmented downloads
+SEGMENT_THRESHOLD = 64 * 1024 * 1024    # Only files at least this many bytes are split into segments
+SEGMENT_COUNT = 4                       # Number of parallel connections per segmented file
+
+
+#################### Helper Functions ####################
+
+def load_partial_info(info_file_path):
+    """Return the validators saved for a partial download, or None if there are none."""
+    if not os.path.isfile(info_file_path):
+        return None
+    try:
+        with open(info_file_path, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return None     # Unreadable info file. Treat the partial file as unusable.
+
+def save_partial_info(info_file_path, resp):
+    """Save the response headers that identify which version of a file
+    the partial download contains.
+    """
+    info = {
+        'etag': resp.headers.get('ETag'),
+        'last_modified': resp.headers.get('Last-Modified'),
+        'length': resp.headers.get('Content-Length')
+    }
+    with open(info_file_path, 'w') as f:
+        json.dump(info, f)
+
+def get_if_range_validator(info):
+    """Return the value to send in an If-Range header, or None if the saved
+    validators can't guarantee that resumed content matches the partial file.
+    Weak ETags aren't allowed in If-Range, so fall back on Last-Modified for those.
+    """
+    if info is None:
+        return None
+    etag = info.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return info.get('last_modified')
+
+def remove_file(file_path):
+    if os.path.isfile(file_path):
+        os.remove(file_path)
+
+def hash_file(file_path, md5):
+    """Feed an existing file's contents into an md5 hash object."""
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            md5.update(chunk)
+
+def check_resume_range(resp, offset, info):
+    """Check that a 206 Partial Content response picks up exactly where the
+    partial file leaves off. Raises an exception if it doesn't.
+    """
+    # Content-Range looks like "bytes 1000-49999/50000"
+    content_range = resp.headers.get('Content-Range', '')
+    try:
+        range_start = int(content_range.split(' ')[1].split('-')[0])
+        total_length = content_range.split('/')[1]
+    except (IndexError, ValueError):
+        raise Exception('Unparseable Content-Range header: %s' % content_range)
+
+    if range_start != offset:
+        raise Exception('Content-Range %s does not start at byte %s' % (content_range, offset))
+
+    # If the total size changed, the file changed, whatever the validators said.
+    if info.get('length') and total_length != '*' and total_length != info['length']:
+        raise Exception('Content-Range %s does not match partial file length %s' % (content_range, info['length']))
+
+
+def probe_ranges(download_url):
+    """Ask for the 1st byte of a file to find out whether the server supports
+    byte ranges for it. Returns a tuple of (final URL after redirects, total file length,
+    If-Range validator), or None if the file can't be fetched in segments.
+    """
+    download_metrics.note_request()
+    resp = requests.get(download_url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'},
+        timeout=REQUEST_TIMEOUT, stream=True)
+    download_metrics.note_response(resp.url)
+    try:
+        script_logging.log_status('Probe status code: %s' % resp.status_code)
+        if resp.status_code != 206:
+            return None
+
+        # Content-Range looks like "bytes 0-0/50000"
+        total_length = resp.headers.get('Content-Range', '').split('/')[-1]
+        if not total_length.isdigit():
+            return None
+
+        # Segments must all come from the same version of the file.
+        validator = get_if_range_validator({
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified') })
+        if validator is None:
+            return None
+
+        return (resp.url, int(total_length), validator)
+    finally:
+        resp.close()
+
+def fetch_segment(segment_url, part_file_path, validator, range_start, range_end, errors, chunk_counts):
+    """Download one byte range of a file into its place in the partial file.
+    Runs in its own thread, so exceptions are collected in the errors list
+    for the calling thread to deal with. Likewise, a tuple of (bytes received,
+    seconds spent writing them) is added to the chunk_counts list, for the
+    calling thread to report to download_metrics.
+    """
+    received_length = 0
+    disk_seconds = 0.0
+    try:
+        request_headers = {
+            'Range': 'bytes=%s-%s' % (range_start, range_end),
+            'If-Range': validator,
+            'Accept-Encoding': 'identity' }
+        resp = requests.get(segment_url, headers=request_headers, timeout=REQUEST_TIMEOUT, stream=True)
+        try:
+            resp.raise_for_status()
+
+            # A 200 response means the file changed since we probed it.
+            if resp.status_code != 206:
+                raise Exception('Segment %s-%s returned status %s' % (range_start, range_end, resp.status_code))
+
+            with open(part_file_path, 'r+b') as ofile:
+                ofile.seek(range_start)
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    write_start = time.time()
+                    ofile.write(chunk)
+                    disk_seconds += time.time() - write_start
+                    received_length += len(chunk)
+                    bandwidth_limiter.consume(len(chunk))
+        finally:
+            resp.close()
 
+        expected_length = range_end - range_start + 1
+        if received_length != expected_length:
+            raise Exception('Segment %s-%s received %s of %s bytes' % (range_start, range_end, received_length, expected_length))
+        script_logging.log_debug('Segment %s-%s received %s bytes in %.2f seconds of disk time'
+            % (range_start, range_end, received_length, disk_seconds))
 
-def download(download_url, target_file_path):
+    except Exception as e:
+        errors.append(e)
+    finally:
+        chunk_counts.append((received_length, disk_seconds))
+
+
+#################### Download Functions ####################
+
+def fetch(download_url, target_file_path):
+    """Download the file at the given URL to the target file path.
+    Bytes are streamed to a partial file that replaces the target file
+    only when the download is complete. If an earlier attempt left a partial
+    file behind, try to download just the missing bytes with a Range request.
+    The If-Range header makes the server send the whole file instead if
+    it has changed since the partial file was started.
+
+    Raises an exception if the download fails, leaving the partial file for next time.
+    Returns the hex md5 digest of the downloaded file.
+    """
+    part_file_path = target_file_path + PARTIAL_FILE_SUFFIX
+    info_file_path = target_file_path + PARTIAL_INFO_SUFFIX
+
+    # Ask for the file bytes as stored, so byte ranges line up with the partial file.
+    request_headers = {'Accept-Encoding': 'identity'}
+
+    # See if we have a partial file we can resume.
+    offset = 0
+    info = load_partial_info(info_file_path)
+    validator = get_if_range_validator(info)
+    if validator and os.path.isfile(part_file_path):
+        offset = os.path.getsize(part_file_path)
+        if offset > 0:
+            request_headers['Range'] = 'bytes=%s-' % offset
+            request_headers['If-Range'] = validator
+            script_logging.log_status('Resume download at byte %s' % offset)
+
+    download_metrics.note_request()
+    resp = requests.get(download_url, headers=request_headers, timeout=REQUEST_TIMEOUT, stream=True)    # Don't download content immediately
+    download_metrics.note_response(resp.url)
+    try:
+        script_logging.log_status('Status code: %s' % resp.status_code)
+        script_logging.log_status('Headers: %s' % resp.headers)
+
+        # Server may not be able to satisfy the range if the partial file is bad.
+        # Throw it away so the next attempt starts over.
+        if resp.status_code == 416:
+            remove_file(part_file_path)
+            remove_file(info_file_path)
+        resp.raise_for_status()
+
+        md5 = hashlib.md5()
+        if resp.status_code == 206:
+            # Server is sending the rest of the same file we started.
+            check_resume_range(resp, offset, info)
+            hash_file(part_file_path, md5)
+            file_mode = 'ab'
+        else:
+            # Server is sending the whole file, so start the partial file over.
+            save_partial_info(info_file_path, resp)
+            file_mode = 'wb'
+
+        with open(part_file_path, file_mode) as ofile:
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                write_start = time.time()
+                ofile.write(chunk)
+                download_metrics.note_chunk(len(chunk), time.time() - write_start)
+                md5.update(chunk)
+                bandwidth_limiter.consume(len(chunk))
+    finally:
+        resp.close()
+
+    # Make sure we got everything the server promised.
+    # For a resumed download, the promise covers the whole file.
+    if (info is not None) and (resp.status_code == 206):
+        expected_length = info.get('length')
+    else:
+        expected_length = resp.headers.get('Content-Length')
+    received_length = os.path.getsize(part_file_path)
+    if (expected_length is not None) and (received_length != int(expected_length)):
+        raise Exception('Received %s of %s bytes' % (received_length, expected_length))
+
+    # Download is complete, so the partial file becomes the target file.
+    file_lock.replace_file(part_file_path, target_file_path)
+    remove_file(info_file_path)
+    return md5.hexdigest()
+
+
+def fetch_segmented(download_url, target_file_path):
+    """Download a large file as SEGMENT_COUNT byte ranges over parallel connections,
+    writing each range into its place in a partial file. Files that are smaller
+    than SEGMENT_THRESHOLD, files whose server doesn't support byte ranges, &
+    downloads that already have a resumable partial file are handed off to fetch().
+
+    Each segment has to receive exactly the bytes of its range, & the segments
+    together have to receive the length the server promised. The partial file
+    is preallocated to that length, so its size proves nothing. Every segment
+    request is conditional on the file being unchanged since it was probed.
+    If any segment fails, the partial file is thrown away, since a file with
+    holes in it can't be resumed.
+
+    Raises an exception if the download fails.
+    Returns the hex md5 digest of the downloaded file, for the download ledger.
+    The server doesn't give us a digest to check it against.
+    """
+    part_file_path = target_file_path + PARTIAL_FILE_SUFFIX
+    if os.path.isfile(target_file_path + PARTIAL_INFO_SUFFIX):
+        return fetch(download_url, target_file_path)
+
+    probe = probe_ranges(download_url)
+    if (probe is None) or (probe[1] < SEGMENT_THRESHOLD):
+        return fetch(download_url, target_file_path)
+    (segment_url, total_length, validator) = probe
+    script_logging.log_status('Download %s bytes in %s segments' % (total_length, SEGMENT_COUNT))
+
+    # Preallocate the partial file so each segment can write at its own offset.
+    with open(part_file_path, 'wb') as ofile:
+        ofile.truncate(total_length)
+
+    # Start a thread for each segment.
+    errors = []
+    chunk_counts = []
+    threads = []
+    segment_length = (total_length + SEGMENT_COUNT - 1) // SEGMENT_COUNT
+    for range_start in range(0, total_length, segment_length):
+        range_end = min(range_start + segment_length, total_length) - 1
+        thread = threading.Thread(target=fetch_segment,
+            args=(segment_url, part_file_path, validator, range_start, range_end, errors, chunk_counts))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    download_metrics.note_chunk(sum(count[0] for count in chunk_counts), sum(count[1] for count in chunk_counts))
+
+    if errors:
+        remove_file(part_file_path)
+        raise errors[0]
+
+    # Make sure the segments covered the whole file.
+    received_length = sum(count[0] for count in chunk_counts)
+    if (len(chunk_counts) != len(threads)) or (received_length != total_length):
+        remove_file(part_file_path)
+        raise Exception('Received %s of %s bytes' % (received_length, total_length))
+    md5 = hashlib.md5()
+    hash_file(part_file_path, md5)
+
+    file_lock.replace_file(part_file_path, target_file_path)
+    return md5.hexdigest()
+
+
+def download(download_url, target_file_path, segmented=False, raise_errors=False):
     """Download the file at the given URL to the target folder.
     If something bad happens, just skip the download & log it as an error.
+    segmented -- Fetch large files in parallel byte ranges. See fetch_segmented().
+    raise_errors -- Re-raise the exception after logging it, instead of skipping the download.
+    Returns the hex md5 digest of the downloaded file, or None if the download failed.
     """
     try:
         script_logging.log_status('Download file %s' % target_file_path)
         script_logging.log_status('Download URL %s' % download_url)
 
-        # attachment_resp = requests.get(download_url)
-        # attachment_resp = requests.get(download_url, timeout=10)    # 10 second timeout
-        attachment_resp = requests.get(download_url, timeout=REQUEST_TIMEOUT, stream=True)    # Don't download content immediately
-
-        script_logging.log_status('Status code: %s' % attachment_resp.status_code)
-        script_logging.log_status('Headers: %s' % attachment_resp.headers)
-
-        # # Extract name to use for saving file
-        # content_header = attachment_resp.headers['Content-Disposition']
-        # file_name = re_filename.search(content_header).group(1)
+        if segmented:
+            digest = fetch_segmented(download_url, target_file_path)
+        else:
+            digest = fetch(download_url, target_file_path)
 
-        # Save attachment file to target file
-        # saved_file_name = os.path.join(target_folder, file_name)
-        # script_logging.log_status('Downloading %s' % target_file_path)
-        with open(target_file_path, "wb") as ofile:
-            ofile.write(attachment_resp.content)
-    
         script_logging.log_status('Done downloading %s' % target_file_path)
+        return digest
 
     except Exception as e:
         # Escape file names in case they have weird characters in them.
@@ -42,3 +348,6 @@ def download(download_url, target_file_path):
         escaped_url = download_url.replace("'", "\'")
         script_logging.log_error("Error_http_downloader '%s', '%s'" % (escaped_file, escaped_url))
         script_logging.log_error("Error object: " + str(e))
+        if raise_errors:
+            raise
+        return None
@@ -9,15 +9,21 @@ retrieval without having to hit Canvas API.
 11.29.2016 tps Move data retrieval test into function so we can run this from other modules.\
 02.20.2017 tps Rename function test_json_retrieval() to retrieve_json().
 08.01.2018 tps Add optional command line parameters to download data for just specific courses.
+10.19.2026 tps Log events timing the retrieval of each course & assignment, & each JSON file written.
+10.19.2026 tps Accept --profile, to profile the stage. See stage_profiler.py.
+10.19.2026 tps Split out retrieval of a single course, for the pipeline runner.
+10.19.2026 tps Split out retrieval of the course list, for the pipeline runner.
 """
 
 import datetime
 import json
 import os
 import sys
+import time
 
 import canvas_data
 import script_logging
+import stage_profiler
 
 #################### File Name Constants ####################
 
@@ -45,8 +51,10 @@ def dump_json(json_data, file_name_template, record_id, content_description):
     """
     file_name = file_name_template % (record_id)
     script_logging.log_status('Storing %s JSON to %s' % (content_description, file_name))
-    with open(file_name, 'w') as f:
-        json.dump(json_data, f, indent = 2)
+    with script_logging.timed('write_json', file=file_name) as fields:
+        with open(file_name, 'w') as f:
+            json.dump(json_data, f, indent = 2)
+        fields['bytes'] = os.path.getsize(file_name)
 
 def load_json(file_name_template, record_id):
     """Helper function to return JSON data saved to an external file.
@@ -76,21 +84,51 @@ def get_time_stamp():
 
 #################### JSON Data Storage & Retrieval Functions ####################
 
-def dump_all_json():
-    """Retrieve all relevant artifact data from Canvas API & store to files.
+def dump_course_json(course):
+    """Retrieve a course's students, users, assignments & submissions from Canvas API & store to files.
+    course -- Course JSON, as returned by canvas_data.pull_courses().
     """
+    course_id = course['id']
+    course_start_time = time.time()
+
+    # Pull students in each course
+    students = canvas_data.pull_course_students(course_id)
+    dump_json(students, STUDENTS_FILE_NAME, course_id, "course students")
+
+    # Pull users for each course.
+    # We'll need this to look up comment submitters.
+    users = canvas_data.pull_course_users(course_id)
+    dump_json(users, USERS_FILE_NAME, course_id, "course users")
+
+    # pull assignments for each course
+    assignments = canvas_data.pull_assignments(course_id)
+    dump_json(assignments, ASSIGNMENTS_FILE_NAME, course_id, 'course assignments')
+
+    # pull submissions for each assignment
+    for assignment in assignments:
+        assignment_id = assignment["id"]
+        with script_logging.timed('fetch_assignment', course_id=course_id, assignment_id=assignment_id) as fields:
+            submissions = canvas_data.pull_submissions_with_comments(course_id, assignment_id)
+            fields['submissions'] = len(submissions)
+        dump_json(submissions, SUBMISSIONS_FILE_NAME, assignment_id, 'assignment submissions')
+
+    script_logging.log_event('fetch_course',
+        course_id=course_id,
+        students=len(students),
+        assignments=len(assignments),
+        duration=time.time() - course_start_time)
 
-    # Set up process logging.
-    # Existence of error log file can tell us if errors occur.
-    script_logging.clear_status_log()
-    script_logging.clear_error_log()
 
+def dump_courses_json(course_id_list=None):
+    """Retrieve the list of courses from Canvas API & store to file.
+    course_id_list -- List of Canvas course IDs to keep, or None for all courses.
+    Returns the list of course JSON stored.
+    """
     # Pull list of courses
     courses = canvas_data.pull_courses()
 
-    # If there are course ID parameters, just load the specified courses
-    if len(sys.argv) > 1:
-        course_id_list = map(int, sys.argv[1:])
+    # If there are course IDs, just keep the specified courses
+    if course_id_list:
         courses = [course for course in courses if course['id'] in course_id_list]
 
         # course_id = int(sys.argv[1])
@@ -99,29 +137,25 @@ def dump_all_json():
     script_logging.log_status('Storing courses JSON to %s' % (COURSES_FILE_NAME))
     with open(COURSES_FILE_NAME, 'w') as f:
         json.dump(courses, f, indent = 2)
-    
-    for course in courses:
-        course_id = course['id']
-
-        # Pull students in each course
-        students = canvas_data.pull_course_students(course_id)
-        dump_json(students, STUDENTS_FILE_NAME, course_id, "course students")
+    return courses
 
-        # Pull users for each course.
-        # We'll need this to look up comment submitters.
-        users = canvas_data.pull_course_users(course_id)
-        dump_json(users, USERS_FILE_NAME, course_id, "course users")
-
-        # pull assignments for each course
-        assignments = canvas_data.pull_assignments(course_id)
-        dump_json(assignments, ASSIGNMENTS_FILE_NAME, course_id, 'course assignments')
+def dump_all_json():
+    """Retrieve all relevant artifact data from Canvas API & store to files.
+    """
 
-        # pull submissions for each assignment
-        for assignment in assignments:
-            assignment_id = assignment["id"]
-            submissions = canvas_data.pull_submissions_with_comments(course_id, assignment_id)
-            dump_json(submissions, SUBMISSIONS_FILE_NAME, assignment_id, 'assignment submissions')
+    # Set up process logging.
+    # Existence of error log file can tell us if errors occur.
+    script_logging.clear_status_log()
+    script_logging.clear_error_log()
 
+    # If there are course ID parameters, just load the specified courses
+    course_id_list = None
+    if len(sys.argv) > 1:
+        course_id_list = map(int, sys.argv[1:])
+    courses = dump_courses_json(course_id_list)
+    
+    for course in courses:
+        dump_course_json(course)
 
 def load_courses_json():
     with open(COURSES_FILE_NAME, 'r') as f:
@@ -196,5 +230,7 @@ if __name__ == "__main__":
     # for arg in sys.argv:
     #     print arg
 
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()     # Before dump_all_json() reads course IDs from the command line.
     script_logging.clear_logs()
-    retrieve_json()
+    stage_profiler.run_stage('retrieve_json', retrieve_json)
@@ -20,25 +20,140 @@ Assumes export folder populated by export_student_artifacts.py.
 01.16.2019 tps Omit redundant submission ID from nested comment & rubric assessment tables.
 05.08.2019 tps Get name of thumbnail file from submissions list instead of call to download_attachments module.
 05.08.2019 tps Display attachment file name.
+10.19.2026 tps Ignore hidden folders, like the download blob store, in the exports folder.
+10.19.2026 tps Index attachments, comments & rubric assessments by submission ID instead of
+               scanning the whole list for every submission. Move student page generation
+               into make_student_page(), so it can be benchmarked on its own.
+10.19.2026 tps Optionally generate student pages in parallel worker processes, a course per task.
+10.19.2026 tps Skip generating pages whose inputs haven't changed since the last run.
+10.19.2026 tps Accept student data already in memory, for export_student_artifacts.py to generate pages as it exports.
+10.19.2026 tps Render submission rows from precompiled templates & stream pages straight to disk,
+               through a temporary file, instead of building them in a StringIO buffer.
+10.19.2026 tps Split the top-level page into an index page for each course, with a student
+               filter on the top-level page that loads a manifest of all the students on demand.
+10.19.2026 tps Link the top-level page to the search page.
+10.19.2026 tps Lazy-load thumbnail images, so long student pages don't fetch every thumbnail up front.
+10.19.2026 tps Log an event timing each course's pages.
+10.19.2026 tps Accept --profile, to profile the stage. See stage_profiler.py.
+10.19.2026 tps Split out making a single student's page if it changed, for stream_exports.py to make pages as students are exported.
+10.19.2026 tps Show the export time stamp on the top-level page from a script, so a new export
+               only remakes the page when the course or student lists change.
+10.19.2026 tps Replace pages with file_lock.replace_file().
 """
 
 import cgi
+import codecs
 # import csv
 import datetime
-import cStringIO
-import StringIO   # For handling unicode data
+import functools
+import hashlib
+import json
+import multiprocessing
 import os
-import io
+import sys
+import time
 import urllib
 
 import export_student_artifacts
+import file_lock
 # import download_attachments
 import path_consts  # Export folder location
 import script_logging
+import stage_profiler
 
 #################### File Name Constants ####################
 
 INDEX_FILE = 'index.html'
+FINGERPRINT_FILE = '.html_fingerprint'  # Fingerprint of the inputs of the index.html page in the same folder.
+MANIFEST_FILE = 'manifest.js'   # Course & student names for the top-level page's student filter.
+TIME_STAMP_SCRIPT_FILE = 'timestamp.js'  # Export time stamp for the top-level page, so the page itself needn't change.
+
+#################### Constants ####################
+
+# Number of worker processes generating student pages. Each worker generates
+# the pages for a whole course at a time. 1 generates them all in this process.
+# On Windows, scripts that call make_index_pages() with more than 1 worker
+# need an if __name__ == "__main__" guard, since worker processes re-import them.
+HTML_WORKERS = 1
+
+# Part of every page fingerprint. Change it when the generated HTML changes,
+# so pages generated by an older version of this script are regenerated.
+GENERATOR_VERSION = 4
+
+#################### HTML Templates ####################
+
+TABLE_HEADER_TEMPLATE   = '<TH>%s</TH>'
+TABLE_DATA_TEMPLATE     = '<TD>%s</TD>'
+TABLE_ROW_TEMPLATE      = '<TR>%s</TR>\n'
+LINK_DATA_TEMPLATE      = '<TD><A HREF="%s">%s</A></TD>'
+EMPTY_TABLE_DATA        = TABLE_DATA_TEMPLATE % ''
+THUMBNAIL_LINK_TEMPLATE = '<DIV STYLE="margin-bottom:1em"><A HREF="%s"><IMG SRC="%s" ALT="Attachment" LOADING="lazy"></A></DIV>'
+FILE_LINK_TEMPLATE      = '<DIV STYLE="margin-bottom:1em"><A HREF="%s">%s</A></DIV>'
+
+# Submissions table row: 5 data cells, the HTML assignment description, 3 more data cells,
+# then URL & media recording links, attachments, comments, grade & rubric assessments.
+SUBMISSION_ROW_TEMPLATE = TABLE_ROW_TEMPLATE % (
+    TABLE_DATA_TEMPLATE * 9 + '%s%s%s%s' + TABLE_DATA_TEMPLATE + '%s')
+
+# Student filter for the top-level page. The manifest of course & student names
+# is only loaded the 1st time someone types in the filter box, so the page opens
+# at once however many students there are. The manifest is loaded with a script
+# element, since browsers won't fetch() files from a file:// share.
+STUDENT_FILTER_HTML = '''<P><INPUT ID="filter" TYPE="search" SIZE="40" PLACEHOLDER="Find a student or course"></P>
+<DIV ID="matches"></DIV>
+<SCRIPT>
+(function () {
+    var MAX_MATCHES = 200;
+    var input = document.getElementById('filter');
+    var matches = document.getElementById('matches');
+    var loading = false;
+
+    function loadManifest(callback) {
+        if (window.exportsManifest) {
+            callback();
+        } else if (!loading) {
+            loading = true;
+            var script = document.createElement('script');
+            script.src = '%(manifest_file)s';
+            script.onload = callback;
+            document.head.appendChild(script);
+        }
+    }
+
+    function escapeHtml(text) {
+        return text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+    }
+
+    function showMatches() {
+        var text = input.value.toLowerCase();
+        var items = [];
+        if (text) {
+            window.exportsManifest.forEach(function (course) {
+                var courseMatches = course[0].toLowerCase().indexOf(text) >= 0;
+                course[1].forEach(function (student) {
+                    if ((items.length < MAX_MATCHES) && (courseMatches || (student.toLowerCase().indexOf(text) >= 0))) {
+                        items.push('<LI><A HREF="' + encodeURIComponent(course[0]) + '/' + encodeURIComponent(student)
+                            + '/%(index_file)s">' + escapeHtml(student) + '</A> (' + escapeHtml(course[0]) + ')</LI>');
+                    }
+                });
+            });
+        }
+        matches.innerHTML = items.length ? '<UL>' + items.join('') + '</UL>' : '';
+    }
+
+    input.addEventListener('input', function () { loadManifest(showMatches); });
+})();
+</SCRIPT>
+''' % { 'manifest_file': MANIFEST_FILE, 'index_file': INDEX_FILE }
+
+# Export time stamp on the top-level page. It's filled in by a script written on every run,
+# so a new export only changes the page when the course or student lists change.
+TIME_STAMP_SCRIPT_HTML = '''<P ID="time_stamp"></P>
+<SCRIPT SRC="%s"></SCRIPT>
+''' % TIME_STAMP_SCRIPT_FILE
+
+HTML_BUFFER_SIZE = 256 * 1024   # Bytes of HTML to buffer before writing to disk
+TEMP_FILE_SUFFIX = '.tmp'       # Pages are written to a temporary file, then renamed.
 
 #################### Module Variables ####################
 
@@ -46,10 +161,79 @@ time_stamp_string = None    # Populated the 1st time write_html_time_stamp() is
 
 #################### Helper Functions ####################
 
+def to_unicode(name):
+    """Return a file or folder name as a unicode string.
+    Names listed from a str path are utf-8 encoded strs.
+    """
+    if isinstance(name, str):
+        return name.decode('utf-8')
+    return name
+
+def quote_path(*names):
+    """Return relative URL for a path made up of file & folder names."""
+    return urllib.quote('/'.join([to_unicode(name).encode('utf-8') for name in names]))
+
 def get_subdirs(dir_path):
     """Return list of folders within the given directory.
+    Hidden folders hold working data, not course or student data, so skip them.
+    """
+    return [d for d in sorted(os.listdir(dir_path)) if os.path.isdir(os.path.join(dir_path, d)) and not d.startswith('.')]
+
+def index_by_submission_id(csv_list):
+    """Return dictionary of the data rows in a list loaded by load_csv_file(),
+    grouped into lists keyed by submission ID. Rows keep their order in the csv file.
+    """
+    index = {}
+    for row in csv_list[1:]:    # Skip header row
+        index.setdefault(row.submission_id, []).append(row)
+    return index
+
+
+#################### Fingerprint Functions ####################
+# A page is only generated again if the fingerprint of its inputs differs from
+# the one saved in the page's folder when it was last generated, or if the page is missing.
+
+def get_file_digest(file_path):
+    """Return hex md5 digest of a file's contents, or None if there's no such file."""
+    if not os.path.isfile(file_path):
+        return None
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        md5.update(f.read())
+    return md5.hexdigest()
+
+def make_fingerprint(inputs):
+    """Return hex md5 fingerprint of a list of page inputs, which must be JSON serializable."""
+    return hashlib.md5(json.dumps([GENERATOR_VERSION] + inputs)).hexdigest()
+
+def get_student_fingerprint(student_folder_path, page_index, student_folders_list):
+    """Return fingerprint of the inputs to a student page: the student's csv files,
+    & the names of the student & the neighbors the page links to.
+    The export time stamp is left out, because every export changes it,
+    so a student page is only regenerated when the student's data changes.
     """
-    return [d for d in sorted(os.listdir(dir_path)) if os.path.isdir(os.path.join(dir_path, d))]
+    prev_student = student_folders_list[page_index - 1] if page_index > 0 else None
+    next_student = student_folders_list[page_index + 1] if page_index < (len(student_folders_list) - 1) else None
+    csv_digests = [get_file_digest(os.path.join(student_folder_path, csv_file_name))
+        for csv_file_name in (
+            path_consts.SUBMISSIONS_FILE_NAME,
+            path_consts.COMMENTS_FILE_NAME,
+            path_consts.ATTACHMENTS_FILE_NAME,
+            path_consts.RUBRIC_ASSESSMENTS_FILE_NAME)]
+    return make_fingerprint([student_folders_list[page_index], prev_student, next_student] + csv_digests)
+
+def is_page_current(folder_path, fingerprint):
+    """Return True if the folder's index page exists & was generated from inputs with the given fingerprint."""
+    fingerprint_file_path = os.path.join(folder_path, FINGERPRINT_FILE)
+    if not (os.path.isfile(os.path.join(folder_path, INDEX_FILE)) and os.path.isfile(fingerprint_file_path)):
+        return False
+    with open(fingerprint_file_path, 'r') as f:
+        return f.read() == fingerprint
+
+def save_fingerprint(folder_path, fingerprint):
+    """Save the fingerprint of the inputs the folder's index page was generated from."""
+    with open(os.path.join(folder_path, FINGERPRINT_FILE), 'w') as f:
+        f.write(fingerprint)
 
 
 #################### HTML Generator Functions ####################
@@ -70,6 +254,23 @@ def begin_exports_html(write_stream):
 <H1>Artifact Exports</H1>
 ''')
 
+def begin_course_html(write_stream, course_name):
+    write_stream.write(u'''<!doctype html>
+<html lang="en">
+<head>
+    <meta charset="utf-8">
+    <title>%s</title>
+    <style>
+<!--
+.studentlist { column-count:5 }
+-->        
+    </style>
+</head>
+<body>
+<A HREF="../%s">Artifact Exports</A>
+<H1>%s</H1>
+''' % (course_name, INDEX_FILE, course_name))
+
 def begin_student_html(write_stream, user_name):
     write_stream.write('''<!doctype html>
 <html lang="en">
@@ -105,92 +306,73 @@ def write_course_html(write_stream, course_name):
 def write_student_html(write_stream, user_name):
     write_stream.write('<H3>%s</H3>\n' % user_name)
 
-def write_begin_html_table(write_stream, headers):
-    # write_stream.write('<TABLE BORDER="1">\n')
-    write_stream.write('<TABLE>\n')
-    write_stream.write('<TR>')
-    write_stream.write(''.join([ '<TH>%s</TH>' % item for item in headers]))
-    write_stream.write('</TR>\n')
+def render_begin_html_table(headers):
+    # return '<TABLE BORDER="1">\n'
+    return '<TABLE>\n' + TABLE_ROW_TEMPLATE % ''.join([TABLE_HEADER_TEMPLATE % item for item in headers])
 
-def write_begin_html_table_row(write_stream):
-    write_stream.write('<TR>')
+def render_html_table_data(row):
+    return ''.join([TABLE_DATA_TEMPLATE % cgi.escape(item) for item in row])
 
-def write_html_table_data(write_stream, row):
-    write_stream.write(''.join([ '<TD>%s</TD>' % cgi.escape(item) for item in row]))    
-
-def write_html_table_data_as_html(write_stream, row):
-    write_stream.write(''.join([ '<TD>%s</TD>' % item for item in row]))
-
-def write_html_table_data_link(write_stream, url_link, link_text):
+def render_html_table_data_link(url_link, link_text):
     if url_link != '':
-        # write_stream.write('<TD><A HREF="%s">%s</A></TD>' % (url_link, url_link))
-        write_stream.write('<TD><A HREF="%s">%s</A></TD>' % (url_link, cgi.escape(link_text)))
-    else:
-        write_html_table_data(write_stream, [''])
-
-def write_end_html_table_row(write_stream):
-    write_stream.write('</TR>\n')
-
-def write_end_html_table(write_stream):
-    write_stream.write('</TABLE>\n')
+        return LINK_DATA_TEMPLATE % (url_link, cgi.escape(link_text))
+    return EMPTY_TABLE_DATA
 
-def write_html_comments_table(write_stream, comments_list):
-    # Write HTML table inside an HTML table data cell.
-    # 01.16.2019 tps It's OK to omit the 1st column, which contains a redundant submission ID.
+def render_html_comments_table(comments_list):
+    """Render HTML table inside an HTML table data cell.
+    01.16.2019 tps It's OK to omit the 1st column, which contains a redundant submission ID.
+    """
     if len(comments_list) > 1:
-        write_stream.write('<TD>')
-        # write_begin_html_table(write_stream, comments_list[0])
-        write_begin_html_table(write_stream, comments_list[0][1:])
-
-        for row in comments_list[1:]:
-            write_begin_html_table_row(write_stream)
-            # write_html_table_data(write_stream, row)
-            write_html_table_data(write_stream, row[1:])
-            write_end_html_table_row(write_stream)
-
-        write_end_html_table(write_stream)
-        write_stream.write('</TD>')
-    else:
-        # There may be nothing to write.
-        write_html_table_data(write_stream, [''])
-
-def write_html_attachments_table(write_stream, attachments_list):
-    """Write HTML for attachment as image link to attachment file,
+        cells = ['<TD>', render_begin_html_table(comments_list[0][1:])]
+        cells += [TABLE_ROW_TEMPLATE % render_html_table_data(row[1:]) for row in comments_list[1:]]
+        cells.append('</TABLE>\n</TD>')
+        return ''.join(cells)
+    # There may be nothing to render.
+    return EMPTY_TABLE_DATA
+
+def render_html_attachments_table(attachments_list):
+    """Render HTML for attachment as image link to attachment file,
     which is expected to be in the student's folder.
 
     attachments_list -- List containing tuples describing
         attachments for the submission. It might be empty.
     """
     if len(attachments_list) > 1:
-        write_stream.write('<TD>')
+        cells = ['<TD>']
 
         # First row of attachment list contains column headers, so skip it.
         for row in attachments_list[1:]:
             # File name might have weird characters, so URL encode it.
             encoded_file_name = urllib.quote(row.file_name)
 
-            # Get name of attachment's thumbnail preview image, which should also be
-            # in the student folder. We get it from the download_attachments module,
-            # which downloaded it.
             # There may not be a thumbnail preview, in which case just use a text link.
             # 05.08.2019 tps Find thumbnail file name in the attachments list instead of having to derive it.
-            write_stream.write('<DIV STYLE="margin-bottom:1em">')
             if (row.thumbnail_url):
-                # thumbnail_file_name = urllib.quote(download_attachments.png_thumbnail_file_name(row.file_name))
-                thumbnail_file_name = urllib.quote(row.thumbnail_file)
-                write_stream.write('<A HREF="%s"><IMG SRC="%s" ALT="Attachment"></A>' % (encoded_file_name, thumbnail_file_name))
-                # write_stream.write('<A HREF="%s"><IMG SRC="%s" ALT="Attachment"></A>' % (row.file_name, thumbnail_file_name))
-                #write_stream.write('<video controls><source src="%s" type="video/quicktime"></video>' % row[2])
+                cells.append(THUMBNAIL_LINK_TEMPLATE % (encoded_file_name, urllib.quote(row.thumbnail_file)))
             else:
-                write_stream.write('<A HREF="%s">%s</A>' % (encoded_file_name, cgi.escape(row.display_name)))
-                # write_stream.write('<A HREF="%s">Attachment</A>' % encoded_file_name)
-                # write_stream.write('<A HREF="%s">Attachment</A>' % row.file_name)
+                cells.append(FILE_LINK_TEMPLATE % (encoded_file_name, cgi.escape(row.display_name)))
 
-            write_stream.write('</DIV>')
-        write_stream.write('</TD>')
-    else:
-        # There may be nothing to write.
-        write_html_table_data(write_stream, [''])
+        cells.append('</TD>')
+        return ''.join(cells)
+    # There may be nothing to render.
+    return EMPTY_TABLE_DATA
+
+def render_submission_row(row, attachments_list, comments_list, rubric_assessments_list):
+    """Render a submissions table row with a single format operation.
+    The attachments, comments & rubric assessments lists contain the
+    column headers followed by the rows for the submission.
+    """
+    escape = cgi.escape
+    return SUBMISSION_ROW_TEMPLATE % (
+        escape(row[0]), escape(row[1]), escape(row[2]), escape(row[3]), escape(row[4]),
+        row[5],     # HTML assignment description
+        escape(row[6]), escape(row[7]), escape(row[8]),
+        render_html_table_data_link(row[9], 'Online URL'),  # URL submission
+        render_html_table_data_link(row[10], row[11]),      # Media recording file & type
+        render_html_attachments_table(attachments_list),
+        render_html_comments_table(comments_list),
+        escape(row[13]),    # Grade
+        render_html_comments_table(rubric_assessments_list))
 
 def write_html_time_stamp(write_stream):
     """Write export time stamp.
@@ -204,6 +386,17 @@ def write_html_time_stamp(write_stream):
             time_stamp_string = '<P>Data exported at %s</P>\n' % s
     write_stream.write(time_stamp_string)
 
+def write_time_stamp_script():
+    """Write the script that fills in the export time stamp on the top-level page."""
+    with open(path_consts.TIME_STAMP_FILE_NAME, 'r') as f:
+        s = f.read()
+    script_file_name = os.path.join(path_consts.EXPORTS_FOLDER, TIME_STAMP_SCRIPT_FILE)
+    temp_file_name = script_file_name + TEMP_FILE_SUFFIX
+    with open(temp_file_name, 'wb') as ofile:
+        ofile.write("document.getElementById('time_stamp').textContent = %s;\n"
+            % json.dumps('Data exported at %s' % to_unicode(s)))
+    file_lock.replace_file(temp_file_name, script_file_name)
+
 def write_html_student_navigation(write_stream, page_index, student_list):
     """Generate home/prev/next navigation for student page.
     """
@@ -221,200 +414,248 @@ def write_html_csv_links(write_stream):
     write_stream.write(' | <A HREF="%s">%s</A>' % (path_consts.RUBRIC_ASSESSMENTS_FILE_NAME, path_consts.RUBRIC_ASSESSMENTS_FILE_NAME))
     write_stream.write(' | <A HREF="%s">%s</A></P>\n' % (path_consts.ATTACHMENTS_FILE_NAME, path_consts.ATTACHMENTS_FILE_NAME))
 
-def make_exports_html():
+def make_exports_html(force=False):
     """Make top-level HTML page for exports directory that contains
-    links to individual student pages.
+    links to the index page for each course, & a filter that finds
+    student pages using the manifest of all the course & student names.
+    The page & manifest are only made if the course or student lists have
+    changed since they were last made, unless force is True. The export time
+    stamp is written to a script the page loads, so it's always current.
     """
 
-    # Create HTML output stream
-    html_output = cStringIO.StringIO()
-    begin_exports_html(html_output)
-    write_html_time_stamp(html_output)
-
     # Walk course folders in exports directory
-    course_folder_list = get_subdirs(path_consts.EXPORTS_FOLDER)
-    for course_folder in course_folder_list:
-        write_course_html(html_output, course_folder)
-
-        # Walk student folders
-        html_output.write('<DIV CLASS="studentlist"><UL>\n')
-        student_folders_list = get_subdirs(os.path.join(path_consts.EXPORTS_FOLDER, course_folder))
-        for student_folder in student_folders_list:
-            student_folder_link = urllib.quote('/'.join((course_folder, student_folder, INDEX_FILE)))
-            html_output.write('<LI><A HREF="%s">%s</A></LI>\n' % (student_folder_link, student_folder))
-        html_output.write('</UL></DIV>\n')
-                                
-    end_html(html_output)
-
-    # We're ready to output the HTML page.
+    course_list = []
+    for course_folder in get_subdirs(path_consts.EXPORTS_FOLDER):
+        course_list.append((course_folder, get_subdirs(os.path.join(path_consts.EXPORTS_FOLDER, course_folder))))
+
+    write_time_stamp_script()
+    fingerprint = make_fingerprint([course_list])
+    if (not force) and is_page_current(path_consts.EXPORTS_FOLDER, fingerprint):
+        script_logging.log_status('Skipping unchanged %s' % os.path.join(path_consts.EXPORTS_FOLDER, INDEX_FILE))
+        return
+
+    # Write the manifest as compact JSON, wrapped in a script that the page's student filter can load.
+    manifest_file_name = os.path.join(path_consts.EXPORTS_FOLDER, MANIFEST_FILE)
+    temp_file_name = manifest_file_name + TEMP_FILE_SUFFIX
+    with open(temp_file_name, 'wb', HTML_BUFFER_SIZE) as ofile:
+        ofile.write('window.exportsManifest = ')
+        json.dump(course_list, ofile, separators=(',', ':'))
+        ofile.write(';\n')
+    file_lock.replace_file(temp_file_name, manifest_file_name)
+
+    # Stream the page straight to a temporary file, which replaces the page when it's complete.
     html_file_name = os.path.join(path_consts.EXPORTS_FOLDER, INDEX_FILE)
     script_logging.log_status('Making %s' % html_file_name)
-    with open(html_file_name, 'w') as ofile:
-        ofile.write(html_output.getvalue())
+    temp_file_name = html_file_name + TEMP_FILE_SUFFIX
+    with open(temp_file_name, 'wb', HTML_BUFFER_SIZE) as ofile:
+        html_output = codecs.getwriter('utf-8')(ofile)
+        begin_exports_html(html_output)
+        html_output.write(TIME_STAMP_SCRIPT_HTML)
+        html_output.write(STUDENT_FILTER_HTML)
+        html_output.write('<P><A HREF="%s">Search submissions &amp; comments</A></P>\n'
+            % os.path.basename(path_consts.SEARCH_PAGE_FILE_NAME))
+
+        # Write the list of course links all at once.
+        course_links = ['<H2>Courses</H2>\n<UL>\n']
+        for (course_folder, student_folders_list) in course_list:
+            course_links.append(u'<LI><A HREF="%s">%s</A> (%s students)</LI>\n'
+                % (quote_path(course_folder, INDEX_FILE), cgi.escape(to_unicode(course_folder)), len(student_folders_list)))
+        course_links.append('</UL>\n')
+        html_output.write(u''.join(course_links))
+
+        end_html(html_output)
+    file_lock.replace_file(temp_file_name, html_file_name)
+    save_fingerprint(path_consts.EXPORTS_FOLDER, fingerprint)
+
+def make_course_html(course_folder, student_folders_list, force=False):
+    """Make index HTML page for a course folder that contains links to its student pages.
+    The page is only made if the student list has changed since it was last made, unless force is True.
+    """
+    course_folder_path = os.path.join(path_consts.EXPORTS_FOLDER, course_folder)
+    fingerprint = make_fingerprint([course_folder, student_folders_list])
+    if (not force) and is_page_current(course_folder_path, fingerprint):
+        return
 
-    html_output.close() # We're done with the output buffer
+    html_file_name = os.path.join(course_folder_path, INDEX_FILE)
+    script_logging.log_status('Making %s' % html_file_name)
+    temp_file_name = html_file_name + TEMP_FILE_SUFFIX
+    with open(temp_file_name, 'wb', HTML_BUFFER_SIZE) as ofile:
+        html_output = codecs.getwriter('utf-8')(ofile)
+        begin_course_html(html_output, cgi.escape(to_unicode(course_folder)))
 
-def make_student_html():
-    """Create HTML page for each student folder."""
+        # Write the list of student links all at once.
+        student_links = ['<DIV CLASS="studentlist"><UL>\n']
+        for student_folder in student_folders_list:
+            student_links.append(u'<LI><A HREF="%s">%s</A></LI>\n'
+                % (quote_path(student_folder, INDEX_FILE), cgi.escape(to_unicode(student_folder))))
+        student_links.append('</UL></DIV>\n')
+        html_output.write(u''.join(student_links))
+
+        end_html(html_output)
+    file_lock.replace_file(temp_file_name, html_file_name)
+    save_fingerprint(course_folder_path, fingerprint)
+
+def make_student_page(student_folder_path, page_index, student_folders_list, csv_lists=None):
+    """Create HTML page for one student folder.
+    page_index -- Position of the student folder in the sorted list of its course's
+        student folders, used to generate next/prev navigation links.
+    csv_lists -- Dictionary of the student's data keyed by csv file name, in the form
+        export_student_artifacts.load_csv_file() returns it. If None, the data is
+        loaded from the csv files in the student folder.
+    """
+    if csv_lists is None:
+        csv_lists = {}
+    def load_csv_list(csv_file_name):
+        if csv_file_name in csv_lists:
+            return csv_lists[csv_file_name]
+        return export_student_artifacts.load_csv_file(os.path.join(student_folder_path, csv_file_name))
+
+    student_html_file = os.path.join(student_folder_path, INDEX_FILE)
+    script_logging.log_status('Making %s' % student_html_file)
+
+    # Read in submission comments, rubric assessments & attachments files.
+    # Index their contents by submission, so we can insert them as we step
+    # through the submissions.
+    comments_list = load_csv_list(path_consts.COMMENTS_FILE_NAME)
+    comments_index = index_by_submission_id(comments_list)
+    rubric_assessments_list = load_csv_list(path_consts.RUBRIC_ASSESSMENTS_FILE_NAME)
+    rubric_assessments_index = index_by_submission_id(rubric_assessments_list)
+    attachments_list = load_csv_list(path_consts.ATTACHMENTS_FILE_NAME)
+    attachments_index = index_by_submission_id(attachments_list)
+
+    # Parse student submissions file.
+    # Split list into header & data rows.
+    submissions_list = load_csv_list(path_consts.SUBMISSIONS_FILE_NAME)
+    csv_headers = submissions_list[0]
+    submissions_list = submissions_list[1:]
+
+    # The last 3 columns are for media recording fields.
+    # Replace them with a single column with a link to the media recording download.
+    csv_headers = list(csv_headers[:10])
+    csv_headers.append('media_recording')
+
+    # Add columns for attachments, submission comments, grade & rubric assessments.
+    csv_headers += ['attachments', 'comments', 'grade', 'rubric_assessments']
+
+    # Stream the page straight to a temporary file, a row at a time, without
+    # building the whole page in memory. The file replaces the student's
+    # page when it's complete.
+    # Data can contain unicode characters, so encode everything as utf-8 on the way out.
+    temp_file_name = student_html_file + TEMP_FILE_SUFFIX
+    with open(temp_file_name, 'wb', HTML_BUFFER_SIZE) as ofile:
+        html_output = codecs.getwriter('utf-8')(ofile)
+        begin_student_html(html_output, student_folders_list[page_index])
+
+        # Generate navigation links
+        write_html_student_navigation(html_output, page_index, student_folders_list)
+
+        # Display when the data was exported.
+        write_html_time_stamp(html_output)
+
+        html_output.write(render_begin_html_table(csv_headers))
+        for row in submissions_list:
+            # Look for attachments, comments & rubric assessments for this submission in the other csv files.
+            # Their lists still need their column headers.
+            submission_id = row.submission_id
+            html_output.write(render_submission_row(row,
+                [attachments_list[0]] + attachments_index.get(submission_id, []),
+                [comments_list[0]] + comments_index.get(submission_id, []),
+                [rubric_assessments_list[0]] + rubric_assessments_index.get(submission_id, [])))
+        html_output.write('</TABLE>\n')
+
+        write_html_csv_links(html_output)   # Add links to underlying csv files.
+
+        # We're done writing HTML for one student.
+        end_html(html_output)
+    file_lock.replace_file(temp_file_name, student_html_file)
+
+def make_student_page_if_changed(course_folder_path, page_index, student_folders_list, csv_lists=None, force=False):
+    """Create HTML page for one student folder, unless its inputs haven't changed
+    since it was last made. See make_student_page() for the parameters.
+    Returns True if the page was made.
+    """
+    student_folder_path = os.path.join(course_folder_path, student_folders_list[page_index])
+    fingerprint = get_student_fingerprint(student_folder_path, page_index, student_folders_list)
+    if (not force) and is_page_current(student_folder_path, fingerprint):
+        return False
+    make_student_page(student_folder_path, page_index, student_folders_list, csv_lists)
+    save_fingerprint(student_folder_path, fingerprint)
+    return True
+
+def make_course_pages(course_folder, force=False, student_csv_lists=None, student_folders_done=None):
+    """Create the course's index page & an HTML page for each student folder in a course folder.
+    A student's page depends only on its own folder & the sorted list of
+    its neighbors, so courses can be generated in any order, in any process.
+    Pages whose inputs haven't changed since they were last made are skipped, unless force is True.
+    student_csv_lists -- Dictionary of student data already in memory, keyed by student
+        folder name. See make_student_page(). Other students' data is loaded from their csv files.
+    student_folders_done -- Set of names of student folders whose pages were already made
+        from the current student list, which are skipped without checking them.
+    Returns tuple of (number of student pages made, number of student pages skipped).
+    """
+    if student_csv_lists is None:
+        student_csv_lists = {}
+    if student_folders_done is None:
+        student_folders_done = set()
+    start_time = time.time()
+
+    # Walk student folders. Folder names are same as user names.
+    course_folder_path = os.path.join(path_consts.EXPORTS_FOLDER, course_folder)
+    student_folders_list = get_subdirs(course_folder_path)
+    make_course_html(course_folder, student_folders_list, force)
+
+    # Walk folder list by index number, so we can use index
+    # to generate next/prev navigation links for each page.
+    made_count = 0
+    for i in range(0, len(student_folders_list)):
+        if to_unicode(student_folders_list[i]) in student_folders_done:
+            continue
+        if make_student_page_if_changed(course_folder_path, i, student_folders_list,
+                student_csv_lists.get(student_folders_list[i]), force):
+            made_count += 1
+
+    script_logging.log_event('html_course',
+        course=to_unicode(course_folder),
+        made=made_count,
+        skipped=len(student_folders_list) - made_count,
+        duration=time.time() - start_time)
+    return (made_count, len(student_folders_list) - made_count)
+
+def make_student_html(worker_count=HTML_WORKERS, force=False):
+    """Create HTML page for each student folder.
+    worker_count -- Number of processes to generate pages in.
+    force -- Make every page, even ones whose inputs haven't changed.
+    """
 
     # Walk course folders in exports directory
     course_folder_list = get_subdirs(path_consts.EXPORTS_FOLDER)
-    for course_folder in course_folder_list:
-
-        # Walk student folders. Folder names are same as user names.
-        course_folder_path = os.path.join(path_consts.EXPORTS_FOLDER, course_folder)
-        student_folders_list = get_subdirs(course_folder_path)
-
-        # Walk folder list by index number, so we can use index
-        # to generate next/prev navigation links for each page.
-        for i in range(0, len(student_folders_list)):
-            student_folder = student_folders_list[i]
-
-            # Build paths we need for the student folder.
-            student_folder_path = os.path.join(course_folder_path, student_folder) 
-            student_html_file = os.path.join(student_folder_path, INDEX_FILE)
-            script_logging.log_status('Making %s' % student_html_file)
-
-            # Start generating HTML for the student folder.
-            # html_output = cStringIO.StringIO()
-            html_output = StringIO.StringIO()   # Because cStringIO doesn't handle unicode data.
-            begin_student_html(html_output, student_folder)
-
-            # Generate navigation links
-            write_html_student_navigation(html_output, i, student_folders_list)
-
-            # Display when the data was exported.
-            write_html_time_stamp(html_output)
-
-            # Read in submission comments file.
-            # We'll look for places to insert its contents as we step
-            # through the submissions.
-            comments_list = export_student_artifacts.load_csv_file(os.path.join(student_folder_path, path_consts.COMMENTS_FILE_NAME))
-
-            # Read in rubric assessments file.
-            # We'll look for places to insert its contents as we step
-            # through the submissions.
-            rubric_assessments_list = export_student_artifacts.load_csv_file(os.path.join(student_folder_path, path_consts.RUBRIC_ASSESSMENTS_FILE_NAME))
-
-            # Read in attachments file
-            # We'll look for places to insert its contents as we step
-            # through the submissions.
-            attachments_list = export_student_artifacts.load_csv_file(os.path.join(student_folder_path, path_consts.ATTACHMENTS_FILE_NAME))
-            
-            # Parse student submissions file.
-            # Split list into header & data rows.
-            submissions_list = export_student_artifacts.load_csv_file(os.path.join(student_folder_path, path_consts.SUBMISSIONS_FILE_NAME))
-            csv_headers = submissions_list[0]
-            submissions_list = submissions_list[1:]
-
-            # The last 3 columns are for media recording fields.
-            # Replace them with a single column with a link to the media recording download.
-            csv_headers = csv_headers[:10]
-            csv_headers.append('media_recording')
-
-            # Add a column for attachments.
-            csv_headers.append('attachments')
-
-            # Add a column for submission comments.
-            csv_headers = list(csv_headers)
-            csv_headers.append('comments')
-
-            # Add a column for grade
-            csv_headers.append('grade')
-
-            # # Add 2 columns for rubric data
-            # csv_headers.append('rubric_points')
-            # csv_headers.append('rubric_comments')
-
-            # Add column for rubric assessments
-            csv_headers.append('rubric_assessments')
-
-
-            write_begin_html_table(html_output, csv_headers)
-            for row in submissions_list:
-                write_begin_html_table_row(html_output)
-
-                # # 1st 9 elements are just data to display.
-                # write_html_table_data(html_output, row[:9])
-
-                # 1st 4 elements are just data to display.
-                write_html_table_data(html_output, row[:5])
-
-                # Next column is an HTML assignment description
-                write_html_table_data_as_html(html_output, row[5:6])
-
-                # Next 4 elements are just data to display
-                write_html_table_data(html_output, row[6:9])
-
-
-                # Next element is for URL submission
-                write_html_table_data_link(html_output, row[9], 'Online URL')
-
-                # # Next element is media recording id
-                # write_html_table_data(html_output, [row[10]])
-                
-                # Next element is media recording type
-                write_html_table_data_link(html_output, row[10], row[11])
-                
-                # # Next element is media recording url
-                # write_html_table_data(html_output, [row[12]])
-                
-                # Look for comments & attachments for this submission in other csv files.
-                submission_id = row.submission_id
-
-                # See if there are are any attachments.
-                # Doing this the dumb way, by simplying looping through
-                # all attachments, looking for ones that match.
-                relevant_attachments = [attachments_list[0]]  # Include column headers
-                for attachment in attachments_list[1:]:     # Skip header row
-                    if submission_id == attachment.submission_id:
-                        relevant_attachments.append(attachment)
-                write_html_attachments_table(html_output, relevant_attachments)
-
-                # See if there are are any submissions comments.
-                # Doing this the dumb way, by simply looping through
-                # all submission comments, looking for ones that match.
-                relevant_comments = [comments_list[0]]  # We still need the headers.
-                for comment in comments_list[1:]:   # Skip header row
-                    if submission_id == comment.submission_id:
-                        relevant_comments.append(comment)
-                write_html_comments_table(html_output, relevant_comments)
-
-                # Next columns is for grade
-                write_html_table_data(html_output, row[13:14])
-
-                # # Next 2 columns are for rubric data
-                # write_html_table_data(html_output, row[14:16])
-
-                # 01.16.2019 tps Render rubric assessments, if any.
-                # Loop through all rubric assessments, looking for ones that match.
-                relevant_rubric_assessments = [rubric_assessments_list[0]]  # We still need the headers.
-                for rubric_assessment in rubric_assessments_list[1:]:   # Skip header row
-                    if submission_id == rubric_assessment.submission_id:
-                        relevant_rubric_assessments.append(rubric_assessment)
-                write_html_comments_table(html_output, relevant_rubric_assessments)
-
-                write_end_html_table_row(html_output)
-            write_end_html_table(html_output)
-
-            write_html_csv_links(html_output)   # Add links to underlying csv files.
-        
-            # We're done writing HTML for one student.
-            end_html(html_output)
-
-            # Output the student HTML file.
-            # with open(student_html_file, 'w') as ofile:
-            with io.open(student_html_file, 'w', encoding='utf-8') as ofile:
-                ofile.write(html_output.getvalue())
-
-            html_output.close() # We're done with the output buffer
-
-def make_index_pages():
-    make_exports_html()
-    make_student_html()
+    if worker_count <= 1:
+        counts = [make_course_pages(course_folder, force) for course_folder in course_folder_list]
+    else:
+        # Start the biggest courses first, so a big course started last doesn't hold up the finish.
+        course_folder_list.sort(key=lambda course_folder:
+            len(os.listdir(os.path.join(path_consts.EXPORTS_FOLDER, course_folder))), reverse=True)
+        pool = multiprocessing.Pool(worker_count)
+        try:
+            counts = pool.map(functools.partial(make_course_pages, force=force), course_folder_list, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    script_logging.log_status('Made %s student pages, skipped %s unchanged pages'
+        % (sum(count[0] for count in counts), sum(count[1] for count in counts)))
+
+def make_index_pages(worker_count=HTML_WORKERS, force=False):
+    make_exports_html(force)
+    make_student_html(worker_count, force)
 
 #################### Stand-Alone Execution ####################
 
 if __name__ == "__main__":
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
     script_logging.clear_logs()
-    make_index_pages()
+    worker_count = HTML_WORKERS
+    if '--workers' in sys.argv[1:]:
+        worker_count = int(sys.argv[sys.argv.index('--workers') + 1])
+    stage_profiler.run_stage('make_html', make_index_pages, worker_count, force=('--force' in sys.argv[1:]))
@@ -0,0 +1,147 @@
+"""Package each course folder in the exports folder into a zip archive,
+for handing to accreditation reviewers.
+
+Each course is written to its own archive in the archives folder, named
+after the course folder. Courses are compressed in parallel, a course per
+worker process, & each file is streamed into its archive a chunk at a time,
+so big media files are never held in memory. Files that are already
+compressed, like videos, images & Office documents, are stored as they are,
+since compressing them again costs CPU time & saves next to nothing.
+
+Working files are left out of the archives: hidden files & folders, like
+HTML page fingerprints, & partial or temporary files left by downloads
+in progress.
+
+An archive is written to a temporary file & renamed when it's complete,
+so a course can be packaged as soon as its downloads finish, even while
+other courses are still downloading, without reviewers ever seeing a
+half-written archive.
+
+Package all the courses, or just the named course folders, with:
+    python package_exports.py [course folder ...] [--workers N]
+
+10.19.2026 tps Created.
+10.19.2026 tps Accept --profile, to profile the stage. See stage_profiler.py.
+10.19.2026 tps Replace archives with file_lock.replace_file(), & clean up partial archives without catching KeyboardInterrupt.
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+
+import file_lock
+import http_downloader
+import make_html
+import path_consts
+import script_logging
+import stage_profiler
+
+#################### Constants ####################
+
+PACKAGE_WORKERS = None      # Number of courses to compress at once. None uses one for each CPU core.
+ARCHIVE_FILE_EXTENSION = '.zip'
+
+# Extensions of files that are already compressed, so are stored without compression.
+STORED_EXTENSIONS = set([
+    '.7z', '.aac', '.avi', '.docx', '.gif', '.gz', '.jpeg', '.jpg', '.key', '.m4a', '.m4v',
+    '.mov', '.mp3', '.mp4', '.numbers', '.ogg', '.pages', '.png', '.pptx', '.rar', '.webm',
+    '.webp', '.wmv', '.xlsx', '.zip' ])
+
+# Endings of the names of working files left by downloads & page generation.
+EXCLUDED_SUFFIXES = (
+    http_downloader.PARTIAL_FILE_SUFFIX,
+    http_downloader.PARTIAL_INFO_SUFFIX,
+    '.tmp' )
+
+#################### Helper Functions ####################
+
+def get_archive_file_name(course_folder):
+    return os.path.join(path_consts.ARCHIVES_FOLDER, course_folder + ARCHIVE_FILE_EXTENSION)
+
+def is_excluded(name):
+    """Test if a file or folder is working data to leave out of archives."""
+    return name.startswith('.') or name.endswith(EXCLUDED_SUFFIXES)
+
+def get_compress_type(file_name):
+    """Return the zip compression to use for a file, based on its extension."""
+    if os.path.splitext(file_name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def list_course_files(course_folder):
+    """Return sorted list of (file path, name in archive) tuples for the files to package
+    from a course folder. Archive names start with the course folder name.
+    """
+    course_folder_path = os.path.join(path_consts.EXPORTS_FOLDER, make_html.to_unicode(course_folder))
+    files = []
+    for (folder_path, folder_names, file_names) in os.walk(course_folder_path):
+        folder_names[:] = [name for name in folder_names if not is_excluded(name)]
+        for file_name in file_names:
+            if is_excluded(file_name):
+                continue
+            file_path = os.path.join(folder_path, file_name)
+            archive_name = os.path.relpath(file_path, path_consts.EXPORTS_FOLDER).replace(os.sep, '/')
+            files.append((file_path, archive_name))
+    return sorted(files, key=lambda f: f[1])
+
+#################### Packaging Functions ####################
+
+def package_course(course_folder):
+    """Write the zip archive for a course folder in the exports folder.
+    Can run in a worker process.
+    Returns tuple of (course folder, number of files, archive size in bytes).
+    """
+    start_time = time.time()
+    archive_file_name = get_archive_file_name(course_folder)
+    temp_file_name = '%s.%s.tmp' % (archive_file_name, os.getpid())
+    files = list_course_files(course_folder)
+    try:
+        with zipfile.ZipFile(temp_file_name, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for (file_path, archive_name) in files:
+                archive.write(file_path, archive_name, get_compress_type(file_path))
+        file_lock.replace_file(temp_file_name, archive_file_name)
+    finally:
+        # Don't leave a partial archive behind if the zip couldn't be finished.
+        if os.path.isfile(temp_file_name):
+            os.remove(temp_file_name)
+
+    archive_size = os.path.getsize(archive_file_name)
+    script_logging.log_status('Packaged %s files from %s into %s, %.1fMB in %.1f seconds'
+        % (len(files), course_folder, archive_file_name, archive_size / (1024.0 * 1024.0), time.time() - start_time))
+    return (course_folder, len(files), archive_size)
+
+def package_exports(course_folders=None, worker_count=PACKAGE_WORKERS):
+    """Write zip archives for course folders in parallel worker processes.
+    course_folders -- List of course folder names to package, or None to package them all.
+    Returns list of (course folder, number of files, archive size in bytes) tuples.
+    """
+    if course_folders is None:
+        course_folders = make_html.get_subdirs(path_consts.EXPORTS_FOLDER)
+    if not os.path.isdir(path_consts.ARCHIVES_FOLDER):
+        os.makedirs(path_consts.ARCHIVES_FOLDER)
+
+    script_logging.log_status('Packaging %s courses' % len(course_folders))
+    pool = multiprocessing.Pool(worker_count)
+    try:
+        results = pool.map(package_course, course_folders, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+######### Stand-Alone Execution #########
+
+if __name__ == "__main__":
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
+    script_logging.clear_logs()
+    args = sys.argv[1:]
+    worker_count = PACKAGE_WORKERS
+    if '--workers' in args:
+        i = args.index('--workers')
+        worker_count = int(args[i + 1])
+        del args[i:i + 2]
+    stage_profiler.run_stage('package_exports', package_exports, args or None, worker_count)
@@ -1,6 +1,14 @@
 """Shared folder paths & file names for outputting artifact data files.
 11.25.2016 tps
 01.16.2019 tps Add file for rubric assessments.
+10.19.2026 tps Add download ledger file.
+10.19.2026 tps Add blob store folder for deduplicated downloads.
+10.19.2026 tps Add download queue folder.
+10.19.2026 tps Add store of failed downloads.
+10.19.2026 tps Add search index folder & search page.
+10.19.2026 tps Add archives folder for packaged course exports.
+10.19.2026 tps Add pipeline state file.
+10.19.2026 tps Add bandwidth limiter state file.
 """
 
 import os
@@ -12,4 +20,15 @@ SUBMISSIONS_FILE_NAME           = 'submissions.csv'
 COMMENTS_FILE_NAME              = 'comments.csv'
 ATTACHMENTS_FILE_NAME           = 'attachments.csv'
 RUBRIC_ASSESSMENTS_FILE_NAME    = 'rubric_assessments.csv'
-TIME_STAMP_FILE_NAME = os.path.join(EXPORTS_FOLDER, 'timestamp.txt')
\ No newline at end of file
+TIME_STAMP_FILE_NAME = os.path.join(EXPORTS_FOLDER, 'timestamp.txt')
+DOWNLOAD_LEDGER_FILE_NAME = os.path.join(EXPORTS_FOLDER, 'download_ledger.json')
+BLOB_STORE_FOLDER = os.path.join(EXPORTS_FOLDER, '.blobs')  # Hidden, so it isn't mistaken for a course folder.
+DOWNLOAD_QUEUE_FOLDER = os.path.join(EXPORTS_FOLDER, '.queue')
+DOWNLOAD_FAILURES_FILE_NAME = os.path.join(EXPORTS_FOLDER, 'download_failures.json')
+SEARCH_INDEX_FOLDER = os.path.join(EXPORTS_FOLDER, '.search')
+SEARCH_PAGE_FILE_NAME = os.path.join(EXPORTS_FOLDER, 'search.html')
+PIPELINE_STATE_FILE_NAME = os.path.join(EXPORTS_FOLDER, 'pipeline_state.json')
+BANDWIDTH_BUCKET_FILE_NAME = os.path.join(EXPORTS_FOLDER, '.bandwidth_bucket.json')  # Hidden, like the other working files.
+
+# Folder for zip archives of course folders. Outside the exports folder, so archives aren't packaged themselves.
+ARCHIVES_FOLDER = 'archives'
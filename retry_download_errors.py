@@ -1,87 +1,163 @@
-"""Retry downloading files that caused errors in http_downloader.
-We can find files to try downloading again by parsing the err.txt file for error messages.
-Error log lines we are interested in look like:
-
-09-04-2017 12:45:17..Error_http_downloader 'exports/CalStateTEACH Term 1/grios/Schedule/Mentor Info.docx', 'https://ourdomain.instructure.com/files/8080/download?download_frd=1&verifier=zVZdnkpTmmJIGYAg2U0PaDqESrJBFLi0Xsm73Eldu'
-
-A regex string that captures the file name & URL looks like:
-
-[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]\.\.Error_http_downloader '(.*)', '(.*)'$
+"""Retry downloading files that failed in the download scripts.
+Failed downloads are recorded in the download failure store by download_queue.run_task().
+See download_failures.py.
+
+Retries run in parallel worker threads. Each failed file waits longer before
+every retry, so a file that keeps failing doesn't hold things up, & we give up
+on a file after download_failures.MAX_ATTEMPTS tries. The script keeps going
+until every failed file has either been downloaded or given up on.
+
+Attachment URLs carry a verifier token & media recording URLs are signed,
+so by the time we retry a download, its URL may have expired. Before each
+round of retries, downloads that failed with an expired URL response get
+fresh URLs from the Canvas API. Attachments sharing a Canvas file are refreshed
+with one files API request, & media recordings with one submissions request
+per assignment.
 
 09.04.2017 tps Created.
 09.17.2018 tps Change bad global Null reference to None.
+10.19.2026 tps Retry failures from the download failure store in parallel, with exponential backoff,
+               instead of scraping err.txt for failed downloads.
+10.19.2026 tps Refresh expired download URLs from the Canvas API before retrying.
+10.19.2026 tps Write the download metrics report, including the retried downloads.
+10.19.2026 tps Accept --profile, to profile the stage. See stage_profiler.py.
+10.19.2026 tps Keep a task's old URL when the files API doesn't return a new one.
 """
+import multiprocessing.pool
+import time
+
+import canvas_data
+import download_attachments
+import download_failures
+import download_ledger
+import download_media_recordings
+import download_metrics
+import download_queue
 import script_logging
-import http_downloader
-import os
-import re
-import shutil
+import stage_profiler
 
 
 ######### Constants #########
 
-# Regex pattern for extracting file download details from error log.
-REGEX_PATTERN = "[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]\.\.Error_http_downloader '(.*)', '(.*)'$"
- 
+RETRY_WORKERS = 4   # Number of downloads to retry at once
 
-def make_cp_file_name():
-    """Create a unique file that looks like "retry000.txt", "retry001.txt", 
-    "retry002.txt", etc.
-    """
+# HTTP status codes that mean a download URL's token or signature has expired.
+EXPIRED_URL_STATUSES = (401, 403, 410)
 
-    cp_file_name = None  # Function return variable
-    n = 0
-    while True:
-        cp_file_name = 'retry%03d.txt' % n
-        if (not os.path.exists(cp_file_name)):
-            break 
-        else:
-            n = n + 1
-            continue
-
-    return cp_file_name
 
+######### URL Refresh Functions #########
 
-def cp_err_log():
-    err_log_file = script_logging.ERR_FILE_NAME
-    err_log_cp = make_cp_file_name()
-    script_logging.log_status('Copying error log %s to %s' % (err_log_file, err_log_cp))
-    shutil.copy(err_log_file, err_log_cp)
+def is_url_expired(task):
+    return task['http_status'] in EXPIRED_URL_STATUSES
 
+def refresh_file_urls(file_id, tasks):
+    """Give attachment & thumbnail tasks for a Canvas file fresh URLs from the files API.
+    Tasks keep their old URLs if the API doesn't return new ones, e.g. a null thumbnail URL.
+    """
+    file_json = canvas_data.pull_file(file_id)[0]
+    for task in tasks:
+        if task['kind'] == download_queue.KIND_THUMBNAIL:
+            url = file_json.get('thumbnail_url')
+        else:
+            url = file_json.get('url')
+        if url:
+            task['url'] = url
 
-def load_errors():
-    pattern = re.compile(REGEX_PATTERN)
+def refresh_media_urls(course_id, assignment_id, tasks):
+    """Give media recording tasks for an assignment fresh URLs from the
+    assignment's submissions, fetched with a single request.
+    """
+    submissions = canvas_data.pull_submissions_with_comments(course_id, assignment_id)
+    submission_lookup = dict((submission['user_id'], submission) for submission in submissions)
+    for task in tasks:
+        submission = submission_lookup.get(task['user_id'])
+        if submission and submission.get('media_comment'):
+            task['url'] = submission['media_comment']['url']
+
+def refresh_url_batch(batch):
+    """Refresh the URLs for a batch of tasks. If the Canvas API request fails,
+    the tasks keep their old URLs & their retries will fail again.
+    """
+    (batch_key, tasks) = batch
+    script_logging.log_status('Refreshing %s expired download URLs for %s' % (len(tasks), batch_key))
+    try:
+        if batch_key[0] == download_queue.KIND_MEDIA:
+            refresh_media_urls(batch_key[1], batch_key[2], tasks)
+        else:
+            refresh_file_urls(batch_key[1], tasks)
+    except Exception as e:
+        script_logging.log_error('Error refreshing download URLs for %s: %s' % (batch_key, e))
 
-    err_list = []       # Accumulate the download errors
+def refresh_expired_urls(pool, tasks):
+    """Get fresh URLs for tasks that failed because their URLs expired.
+    Tasks are batched so each Canvas API request refreshes as many URLs as it can.
+    """
+    batches = {}
+    for task in tasks:
+        if not is_url_expired(task):
+            continue
+        if task['kind'] == download_queue.KIND_MEDIA:
+            batch_key = (download_queue.KIND_MEDIA, task['course_id'], task['assignment_id'])
+        else:
+            batch_key = ('file', task['file_id'])
+        batches.setdefault(batch_key, []).append(task)
+    pool.map(refresh_url_batch, batches.items())
 
-    file_name = script_logging.ERR_FILE_NAME
-    if (os.path.isfile(file_name)):
-        with open(file_name, 'r') as f:
-            for line in f:
-                match = pattern.match(line)
-                if match:
-                    err_list.append((match.group(1), match.group(2)))
 
-    # Let's see what download errors we found
-    if len(err_list) > 0:
-        # This process might still generate errors, so save the current
-        # error before starting a new one.
-        cp_err_log()
-        script_logging.clear_error_log()
-        
-        for err in err_list:
-            # Retry the download
-            download_file = err[0]
-            download_url = err[1]
-            http_downloader.download(download_url, download_file)
+######### Retry Functions #########
 
+def retry_task(ledger, failures, task):
+    """Retry one failed download, with the same options the download scripts use."""
+    if task['kind'] == download_queue.KIND_MEDIA:
+        return download_queue.run_task(ledger, failures, task,
+            segmented=download_media_recordings.SEGMENTED_DOWNLOADS)
+    else:
+        return download_queue.run_task(ledger, failures, task,
+            use_blob_store=download_attachments.USE_BLOB_STORE)
 
 
-    else:
+def retry_downloads(worker_count=RETRY_WORKERS):
+    """Retry failed downloads until they succeed or use up their retries."""
+    ledger = download_ledger.load_ledger()
+    failures = download_failures.load_failures()
+    if len(download_failures.get_pending(failures)) == 0:
         script_logging.log_status('No download errors to retry.')
 
+    pool = multiprocessing.pool.ThreadPool(worker_count)
+    try:
+        while True:
+            pending = download_failures.get_pending(failures)
+            if len(pending) == 0:
+                break
+
+            # Wait for the next failed download to come due.
+            eligible = download_failures.get_eligible(failures)
+            if len(eligible) == 0:
+                wait = min(task['next_attempt_at'] for task in pending) - time.time()
+                script_logging.log_status('Waiting %d seconds to retry %s failed downloads' % (wait, len(pending)))
+                time.sleep(max(wait, 0))
+                continue
+
+            refresh_expired_urls(pool, eligible)
+            script_logging.log_status('Retrying %s failed downloads' % len(eligible))
+            pool.map(lambda task: retry_task(ledger, failures, task), eligible)
+            download_failures.save_failures(failures)
+    finally:
+        pool.close()
+        pool.join()
+        download_ledger.save_ledger(ledger)
+        download_failures.save_failures(failures)
+        download_metrics.write_report()
+
+    # Report the downloads we gave up on.
+    for task in download_failures.get_abandoned(failures):
+        script_logging.log_error("Gave up downloading '%s' after %s attempts: %s"
+            % (task['target'], task['attempts'], task['error']))
+
 
 ######### Stand-Alone Execution #########
 
 if __name__ == "__main__":
-    load_errors()
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
+    stage_profiler.run_stage('retry_downloads', retry_downloads)
@@ -4,8 +4,14 @@ fully populate artifacts export folder from Canvas API.
 11.29.2016 tps
 09.02.2017 tps Download media recording submissions.
 09.24.2018 tps Retry download errors.
+10.19.2026 tps Retry downloads from the download failure store.
+10.19.2026 tps Log an event timing each stage, for summarize_events.py.
+10.19.2026 tps Accept --profile, to profile each stage. See stage_profiler.py.
+10.19.2026 tps Accept --stream, to download files & generate HTML as students are exported. See stream_exports.py.
 """
 
+import sys
+
 import json_artifacts
 import export_student_artifacts
 import download_attachments
@@ -13,21 +19,32 @@ import download_media_recordings
 import make_html
 import script_logging
 import retry_download_errors
-
+import stage_profiler
+import stream_exports
+
+script_logging.parse_logging_args()
+stage_profiler.parse_profile_arg()    # Before json_artifacts reads course IDs from the command line.
+stream = '--stream' in sys.argv[1:]
+if stream:
+    sys.argv.remove('--stream')
 script_logging.clear_logs()
 script_logging.log_status('Retrieve Canvas JSON data')
-json_artifacts.retrieve_json()
+stage_profiler.run_stage('retrieve_json', json_artifacts.retrieve_json)
 
-script_logging.log_status('Create student folders')
-export_student_artifacts.write_student_folders()
+if stream:
+    script_logging.log_status('Create student folders, download files & generate HTML as students are exported')
+    stage_profiler.run_stage('stream_exports', stream_exports.stream_student_folders)
+else:
+    script_logging.log_status('Create student folders')
+    stage_profiler.run_stage('export', export_student_artifacts.write_student_folders)
 
-script_logging.log_status('Download attachments')
-download_attachments.download_all_attachments()
+    script_logging.log_status('Download attachments')
+    stage_profiler.run_stage('download_attachments', download_attachments.download_all_attachments)
 
-script_logging.log_status('Download media recordings')
-download_media_recordings.download_all_media_recordings()
+    script_logging.log_status('Download media recordings')
+    stage_profiler.run_stage('download_media_recordings', download_media_recordings.download_all_media_recordings)
 
-script_logging.log_status('Generate HTML')
-make_html.make_index_pages()
+    script_logging.log_status('Generate HTML')
+    stage_profiler.run_stage('make_html', make_html.make_index_pages)
 
-retry_download_errors.load_errors()
\ No newline at end of file
+stage_profiler.run_stage('retry_downloads', retry_download_errors.retry_downloads)
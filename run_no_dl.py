@@ -3,6 +3,7 @@ fully populate artifacts export folder from Canvas API,
 except for downloading attachments & media recordings.
 
 08.31.2018 tps
+10.19.2026 tps Accept --profile, to profile each stage. See stage_profiler.py.
 """
 
 import json_artifacts
@@ -11,13 +12,16 @@ import export_student_artifacts
 # import download_media_recordings
 import make_html
 import script_logging
+import stage_profiler
 
+script_logging.parse_logging_args()
+stage_profiler.parse_profile_arg()    # Before json_artifacts reads course IDs from the command line.
 script_logging.clear_logs()
 script_logging.log_status('Retrieve Canvas JSON data')
-json_artifacts.retrieve_json()
+stage_profiler.run_stage('retrieve_json', json_artifacts.retrieve_json)
 
 script_logging.log_status('Create student folders')
-export_student_artifacts.write_student_folders()
+stage_profiler.run_stage('export', export_student_artifacts.write_student_folders)
 
 # script_logging.log_status('Download attachments')
 # download_attachments.download_all_attachments()
@@ -26,4 +30,4 @@ export_student_artifacts.write_student_folders()
 # download_media_recordings.download_all_media_recordings()
 
 script_logging.log_status('Generate HTML')
-make_html.make_index_pages()
\ No newline at end of file
+stage_profiler.run_stage('make_html', make_html.make_index_pages)
\ No newline at end of file
@@ -0,0 +1,341 @@
+"""Run the stages of run_all.py course by course, skipping the work whose
+inputs haven't changed since the last run, & overlapping the stages so one
+course's downloads & HTML pages proceed while the next course is exported.
+
+Each course goes through these stages:
+    retrieve -- Retrieve the course's JSON data from Canvas API.
+    export -- Write the course's student folders, download queue & search index shard.
+    download -- Download the course's attachments, thumbnails & media recordings.
+    html -- Make the course's HTML pages.
+
+Each stage runs in its own thread & hands courses on to the next stage
+through a queue as it finishes them, so the stages work on different courses
+at once. The html stage follows the export stage, since the pages only link to
+the downloaded files, so a course's pages are made while its files download.
+There's a single thread for each stage, so the download ledger & failure
+store are only updated by one course's downloads at a time. Local thumbnails
+are made after the stage threads are done, since that starts worker processes.
+
+A stage is skipped for a course if the fingerprint of its inputs matches
+the one saved in the pipeline state file by the last run in which the stage
+finished the course:
+    export -- The course's JSON files & the export version. Also runs if its
+        download queue, search index shard or course folder are missing.
+    download -- The course's download queue file. A course whose downloads
+        left failures in the download failure store is downloaded again,
+        until they use up their retries.
+    html -- The export fingerprint & the HTML generator version.
+make_html.py still skips unchanged pages within the courses it makes pages for.
+
+After the courses are done, the pipeline writes the search index course list &
+the top-level exports page. Optionally, it then retries failed downloads &
+packages the courses that changed into zip archives.
+
+Usage:
+    python run_pipeline.py [course ID ...] [--no-retrieve] [--force] [--retry] [--package] [--profile]
+
+    course ID -- Just run the given courses, like json_artifacts.py.
+    --no-retrieve -- Use the JSON data from an earlier run instead of retrieving it from Canvas.
+    --force -- Run every stage for every course, whether its inputs changed or not.
+    --retry -- Retry failed downloads from the download failure store.
+    --package -- Package the course folders that changed. See package_exports.py.
+
+10.19.2026 tps Created.
+10.19.2026 tps Include the export version in the export fingerprint, & retrieve the course list with json_artifacts.
+10.19.2026 tps Make local thumbnails after the stage threads are done, since that starts worker processes.
+10.19.2026 tps Ignore failures that used up their retries when deciding whether to download a course again.
+10.19.2026 tps Replace the state file with file_lock.replace_file().
+"""
+
+import hashlib
+import json
+import os
+import Queue
+import sys
+import threading
+
+import download_attachments
+import download_failures
+import download_media_recordings
+import download_queue
+import export_student_artifacts
+import file_lock
+import json_artifacts
+import make_html
+import package_exports
+import path_consts
+import retry_download_errors
+import script_logging
+import search_index
+import stage_profiler
+
+#################### Constants ####################
+
+# Stages of the pipeline, in order.
+STAGE_RETRIEVE = 'retrieve'
+STAGE_EXPORT = 'export'
+STAGE_DOWNLOAD = 'download'
+STAGE_HTML = 'html'
+
+DONE = None     # Put on a stage's queue after the last course.
+
+#################### Module Variables ####################
+
+state = {}      # Saved fingerprints of each course's stage inputs, by course ID & stage.
+state_lock = threading.Lock()   # Serializes state updates from the stage threads.
+changed_courses = set()     # Names of course folders whose export, downloads or pages changed in this run.
+thumbnail_jobs = []         # Local thumbnails left to make after the stage threads are done.
+
+#################### Helper Functions ####################
+
+def add_file_digest(md5, file_name):
+    """Add a file's contents to an md5 hash, or a marker if the file is missing."""
+    if not os.path.isfile(file_name):
+        md5.update('missing:%s\n' % file_name)
+        return
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            md5.update(chunk)
+
+def get_export_fingerprint(course):
+    """Return fingerprint of the JSON data a course's export is made from & the export version."""
+    course_id = course['id']
+    md5 = hashlib.md5('%s:%s' % (json.dumps(course, sort_keys=True), export_student_artifacts.EXPORT_VERSION))
+    for file_name_template in (json_artifacts.STUDENTS_FILE_NAME, json_artifacts.USERS_FILE_NAME,
+            json_artifacts.ASSIGNMENTS_FILE_NAME):
+        add_file_digest(md5, file_name_template % course_id)
+    for assignment in json_artifacts.load_assignments_json(course_id):
+        add_file_digest(md5, json_artifacts.SUBMISSIONS_FILE_NAME % assignment['id'])
+    return md5.hexdigest()
+
+def get_download_fingerprint(course):
+    """Return fingerprint of a course's download queue file."""
+    md5 = hashlib.md5()
+    add_file_digest(md5, download_queue.get_queue_file_name(course['id']))
+    return md5.hexdigest()
+
+def get_html_fingerprint(course):
+    return hashlib.md5('%s:%s' % (get_export_fingerprint(course), make_html.GENERATOR_VERSION)).hexdigest()
+
+def is_export_complete(course):
+    """Test if the files written by a course's export are all there."""
+    return (os.path.isfile(download_queue.get_queue_file_name(course['id']))
+        and os.path.isfile(search_index.get_shard_file_name(course['id']))
+        and os.path.isdir(os.path.join(path_consts.EXPORTS_FOLDER, course['name'])))
+
+def has_failed_downloads(course):
+    """Test if the download failure store has failed downloads for a course that haven't used up their retries."""
+    return any(entry.get('course_id') == course['id'] for entry in download_failures.get_pending(download_failures.load_failures()))
+
+#################### State Storage ####################
+
+def load_state():
+    """Return the pipeline state saved by a previous run, or an empty one."""
+    if not os.path.isfile(path_consts.PIPELINE_STATE_FILE_NAME):
+        return {}
+    with open(path_consts.PIPELINE_STATE_FILE_NAME, 'r') as f:
+        return json.load(f)
+
+def save_state():
+    """Write the pipeline state file through a temporary file. Call with state_lock held."""
+    file_name = path_consts.PIPELINE_STATE_FILE_NAME
+    temp_file_name = '%s.%s.tmp' % (file_name, os.getpid())
+    with open(temp_file_name, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    file_lock.replace_file(temp_file_name, file_name)
+
+def get_saved_fingerprint(course, stage):
+    with state_lock:
+        return state.get(unicode(course['id']), {}).get(stage)
+
+def set_saved_fingerprint(course, stage, fingerprint):
+    """Save the fingerprint of the inputs a stage finished a course with, or None to forget it."""
+    with state_lock:
+        course_state = state.setdefault(unicode(course['id']), {})
+        if fingerprint is None:
+            course_state.pop(stage, None)
+        else:
+            course_state[stage] = fingerprint
+        save_state()
+
+def remove_stale_courses(courses):
+    """Remove the download queue files, search index shards & saved state
+    of courses that are no longer exported, so they don't leave work behind.
+    """
+    course_ids = set(unicode(course['id']) for course in courses)
+    for (folder_path, extension) in ((path_consts.DOWNLOAD_QUEUE_FOLDER, download_queue.QUEUE_FILE_EXTENSION),
+            (path_consts.SEARCH_INDEX_FOLDER, search_index.SHARD_FILE_EXTENSION)):
+        if not os.path.isdir(folder_path):
+            continue
+        for file_name in os.listdir(folder_path):
+            if file_name == search_index.COURSE_LIST_FILE_NAME:
+                continue
+            if file_name.endswith(extension) and (file_name[:-len(extension)] not in course_ids):
+                script_logging.log_status('Removing %s of course no longer exported' % os.path.join(folder_path, file_name))
+                os.remove(os.path.join(folder_path, file_name))
+    with state_lock:
+        for course_id in state.keys():
+            if course_id not in course_ids:
+                del state[course_id]
+        save_state()
+
+#################### Stage Functions ####################
+
+def retrieve_course(course):
+    json_artifacts.dump_course_json(course)
+    return True
+
+def export_course(course, force):
+    """Export a course, unless its JSON data hasn't changed. Returns True if it was exported."""
+    fingerprint = get_export_fingerprint(course)
+    if (not force) and is_export_complete(course) and (get_saved_fingerprint(course, STAGE_EXPORT) == fingerprint):
+        return False
+    export_student_artifacts.export_course(course)
+    set_saved_fingerprint(course, STAGE_EXPORT, fingerprint)
+    return True
+
+def download_course(course, force):
+    """Download a course's files, unless its download queue hasn't changed
+    & none of its downloads failed. Returns True if downloads were run.
+    """
+    fingerprint = get_download_fingerprint(course)
+    if (not force) and (get_saved_fingerprint(course, STAGE_DOWNLOAD) == fingerprint) and not has_failed_downloads(course):
+        return False
+    # Making thumbnails starts worker processes, so leave them until the stage threads are done.
+    thumbnail_jobs.extend(download_attachments.download_all_attachments(course_ids=[course['id']], defer_thumbnails=True))
+    download_media_recordings.download_all_media_recordings(course_ids=[course['id']])
+
+    # Forget the fingerprint while there are failures, so the next run tries again.
+    if has_failed_downloads(course):
+        fingerprint = None
+    set_saved_fingerprint(course, STAGE_DOWNLOAD, fingerprint)
+    return True
+
+def make_course_html(course, force):
+    """Make a course's HTML pages, unless its export hasn't changed. Returns True if pages were made."""
+    fingerprint = get_html_fingerprint(course)
+    if (not force) and (get_saved_fingerprint(course, STAGE_HTML) == fingerprint):
+        return False
+    make_html.make_course_pages(course['name'], force)
+    set_saved_fingerprint(course, STAGE_HTML, fingerprint)
+    return True
+
+def run_course_stage(stage, function, course, *args):
+    """Run a stage for a course, logging an event with its duration & whether it was skipped.
+    Returns True if the stage finished the course, False if it failed.
+    """
+    try:
+        with script_logging.timed('pipeline_stage', stage=stage, course_id=course['id']) as fields:
+            ran = function(course, *args)
+            fields['skipped'] = not ran
+    except Exception as e:
+        script_logging.log_error('Pipeline stage %s failed for course %s: %s' % (stage, course['id'], e))
+        return False
+    if ran:
+        script_logging.log_status('Pipeline stage %s finished course %s' % (stage, course['name']))
+        if stage != STAGE_RETRIEVE:
+            changed_courses.add(course['name'])
+    else:
+        script_logging.log_status('Pipeline stage %s skipped unchanged course %s' % (stage, course['name']))
+    return True
+
+def run_stage_thread(stage, function, in_queue, out_queues, *args):
+    """Stage thread. Run a stage for each course from in_queue, & pass
+    the courses it finishes on to out_queues, until DONE comes through.
+    """
+    while True:
+        course = in_queue.get()
+        if course is DONE:
+            break
+        if run_course_stage(stage, function, course, *args):
+            for out_queue in out_queues:
+                out_queue.put(course)
+    for out_queue in out_queues:
+        out_queue.put(DONE)
+
+def start_stage(stage, function, in_queue, out_queues, *args):
+    thread = threading.Thread(target=run_stage_thread, args=(stage, function, in_queue, out_queues) + args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+#################### Pipeline ####################
+
+def load_course_list(course_ids, retrieve):
+    """Return list of courses to run, retrieving the list from Canvas if retrieve is True.
+    course_ids -- List of Canvas course IDs to run, or None for all courses.
+    """
+    if not retrieve:
+        courses = json_artifacts.load_courses_json()
+        if course_ids:
+            courses = [course for course in courses if course['id'] in course_ids]
+        return courses
+
+    if not os.path.exists(json_artifacts.JSON_FOLDER):
+        os.makedirs(json_artifacts.JSON_FOLDER)
+    json_artifacts.make_time_stamp_file()
+    return json_artifacts.dump_courses_json(course_ids)
+
+def run_pipeline(course_ids=None, retrieve=True, force=False, retry=False, package=False):
+    """Run the pipeline stages for each course, skipping unchanged work unless force is True.
+    course_ids -- List of Canvas course IDs to run, or None for all courses.
+    retrieve -- Retrieve JSON data from Canvas, instead of using what's already in the JSON folder.
+    retry -- Retry failed downloads after the courses are done.
+    package -- Package changed course folders into zip archives after the courses are done.
+    """
+    global state
+    state = load_state()
+    changed_courses.clear()
+    del thumbnail_jobs[:]
+
+    courses = load_course_list(course_ids, retrieve)
+    export_student_artifacts.begin_export()
+    if not os.path.isdir(path_consts.SEARCH_INDEX_FOLDER):
+        os.makedirs(path_consts.SEARCH_INDEX_FOLDER)
+    search_index.write_search_page()
+    if not course_ids:
+        remove_stale_courses(courses)
+
+    # Connect the stage threads with queues.
+    export_queue = Queue.Queue()
+    course_download_queue = Queue.Queue()
+    html_queue = Queue.Queue()
+    threads = [
+        start_stage(STAGE_EXPORT, export_course, export_queue, [course_download_queue, html_queue], force),
+        start_stage(STAGE_DOWNLOAD, download_course, course_download_queue, [], force),
+        start_stage(STAGE_HTML, make_course_html, html_queue, [], force) ]
+
+    # Retrieve each course in this thread, handing it on as soon as it's stored.
+    for course in courses:
+        if (not retrieve) or run_course_stage(STAGE_RETRIEVE, retrieve_course, course):
+            export_queue.put(course)
+    export_queue.put(DONE)
+    for thread in threads:
+        thread.join()
+
+    search_index.write_course_list([(course['id'], course['name']) for course in courses])
+    make_html.make_exports_html()
+    script_logging.log_status('Pipeline finished %s courses, %s changed' % (len(courses), len(changed_courses)))
+
+    # The stage threads are done, so it's safe to start worker processes.
+    if thumbnail_jobs:
+        download_attachments.make_local_thumbnails(thumbnail_jobs)
+    if retry:
+        retry_download_errors.retry_downloads()
+    if package and changed_courses:
+        package_exports.package_exports(sorted(changed_courses))
+
+
+######### Stand-Alone Execution #########
+
+if __name__ == "__main__":
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
+    script_logging.clear_logs()
+    args = sys.argv[1:]
+    stage_profiler.run_stage('pipeline', run_pipeline,
+        course_ids=[int(arg) for arg in args if not arg.startswith('--')] or None,
+        retrieve=('--no-retrieve' not in args),
+        force=('--force' in args),
+        retry=('--retry' in args),
+        package=('--package' in args))
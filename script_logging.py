@@ -18,53 +18,299 @@ make the error logs harder to read.
 11.22.2016 tps Added clear_status_log() & clear_err_log().
 11.23.2016 tps Added clear_all_logs().
 12.15.2017 tps Changed output stream to handle unicode, for unicode data errors.
+10.19.2026 tps Hand messages to a writer thread through a queue, instead of opening the
+               log file for every message. The writer keeps the log files open & writes
+               what has piled up in one go, every FLUSH_INTERVAL seconds.
+               Added message levels & a quiet console mode.
+10.19.2026 tps Write structured events, like stage & download timings, to a JSON lines
+               file, for summarize_events.py to break down where a run's time went.
+10.19.2026 tps Keep pending lines when writing them fails, & try again at the next flush.
+10.19.2026 tps Added parse_logging_args(), so scripts accept --quiet & --debug options.
+10.19.2026 tps Take the run ID from the CANVAS_RUN_ID environment variable when it's set, & set
+               it for child processes, so shard processes started by a script share its run ID.
+
+Logging functions only time stamp a message & put it on the queue, so they're
+cheap to call & safe to call from any thread. The writer thread writes each
+batch of lines to a file in a single write, so lines from download worker
+threads never interleave, & neither do lines from processes sharing a log file.
+
+A process started by fork, like a multiprocessing worker on Linux, gets its own
+queue & writer thread the 1st time it logs something. Queued messages are
+written out when the process exits, including multiprocessing worker processes,
+which skip the usual exit handlers. Call flush() to write them out sooner.
+
+log_event() writes an event to events.jsonl as a line of JSON, e.g.:
+
+    {"time": "2026-10-19T02:14:07.250113", "run": "20261019021002-4242", "pid": 4250,
+     "event": "download", "course_id": 101, "assignment_id": 2020, "bytes": 48213, "duration": 0.84}
+
+Every event has the time it was logged, the ID of the run it belongs to & the
+ID of the process that logged it. The run ID is passed to child processes in
+the CANVAS_RUN_ID environment variable, so worker processes & shard processes
+started by a script share its run ID. To group shard processes started by hand
+into one run, give them all the same CANVAS_RUN_ID.
+The other fields depend on the event. Durations are in seconds. Use timed() to
+time a block of code & log an event with its duration.
 """
 
+import atexit
+import contextlib
 import datetime
 import io
+import json
+import multiprocessing.util
 import os
+import Queue
+import sys
+import threading
+import time
 
 ########### Constants ###########
 
 LOG_FILE_NAME = 'log.txt'
 ERR_FILE_NAME = 'err.txt'
+EVENTS_FILE_NAME = 'events.jsonl'
+RUN_ID_ENV_VAR = 'CANVAS_RUN_ID'    # Environment variable that passes the run ID to child processes
+
+# Message levels
+DEBUG = 10
+INFO = 20
+ERROR = 40
+
+LOG_LEVEL = INFO        # Lowest level of message written to the status log file
+CONSOLE_LEVEL = INFO    # Lowest level of message echoed to standard output
+QUIET = False           # Echo only errors to standard output. See set_quiet().
+
+# Command line options read by parse_logging_args()
+QUIET_ARG = '--quiet'   # Echo only errors to standard output.
+DEBUG_ARG = '--debug'   # Write debugging detail to the status log file.
+
+FLUSH_INTERVAL = 1.0    # Most seconds a message waits in the queue before it's written
+MAX_PENDING_LINES = 100000  # Most lines kept for a status or events file that can't be written. Errors are all kept.
+
+# Instructions for the writer thread, queued along with the messages.
+FLUSH = 'flush'     # Write out pending messages.
+CLOSE = 'close'     # Write out pending messages & close the log files.
+
+########### Module Variables ###########
+
+message_queue = None    # Queue of (file names, console text, line) tuples & instructions for the writer thread.
+writer_pid = None       # ID of the process the queue & writer thread belong to.
+start_lock = threading.Lock()   # Keeps threads from starting 2 writers at once.
+
+# Identifies the events logged by this run of the scripts. Processes we start inherit it.
+run_id = os.environ.get(RUN_ID_ENV_VAR) or '%s-%s' % (datetime.datetime.now().strftime('%Y%m%d%H%M%S'), os.getpid())
+os.environ[RUN_ID_ENV_VAR] = run_id
 
 ########### Helper Functions ###########
 
-def write_string_to_file(message, file_name):
-    """Write string to a log file."""
+def to_unicode(message):
+    """Return a message as a unicode string."""
+    if isinstance(message, str):
+        return message.decode('utf-8', 'replace')
+    return unicode(message)
+
+def get_queue():
+    """Return the queue for this process, starting its writer thread if needed."""
+    global message_queue, writer_pid
+    if writer_pid != os.getpid():
+        with start_lock:
+            if writer_pid != os.getpid():
+                # Anything left in a queue inherited from a parent process is
+                # the parent's to write, so start afresh.
+                message_queue = Queue.Queue()
+                writer = threading.Thread(target=write_messages, args=(message_queue,))
+                writer.daemon = True
+                writer.start()
+                multiprocessing.util.Finalize(None, flush, exitpriority=0)
+                writer_pid = os.getpid()
+    return message_queue
 
-    # Record a time stamp for each message
-    str = datetime.datetime.now().strftime('%m-%d-%Y %H:%M:%S..') + message
+def echo(text):
+    """Write a message to standard output, replacing characters it can't show."""
+    try:
+        sys.stdout.write(text.encode(sys.stdout.encoding or 'utf-8', 'replace') + '\n')
+    except IOError:
+        pass    # Console has gone away. The log files still have the message.
 
-    # with open(file_name, 'a') as log_file:
-    with io.open(file_name, 'a', encoding='utf') as log_file:
-        log_file.write(unicode(str) + '\n')
+def write_lines(log_files, pending_lines):
+    """Write each file's pending lines in a single write & clear them."""
+    for (file_name, lines) in pending_lines.iteritems():
+        if not lines:
+            continue
+        if file_name not in log_files:
+            log_files[file_name] = io.open(file_name, 'ab', buffering=0)
+        log_files[file_name].write(u''.join(lines).encode('utf-8'))
+        del lines[:]
+
+def drop_excess_lines(pending_lines):
+    """Limit the lines kept for files that can't be written, so they don't fill
+    up memory. The oldest are dropped. Lines for the error file are all kept,
+    since its existence is how the scripts' callers detect errors.
+    """
+    for (file_name, lines) in pending_lines.iteritems():
+        if (file_name != ERR_FILE_NAME) and (len(lines) > MAX_PENDING_LINES):
+            del lines[:-MAX_PENDING_LINES]
+
+def write_messages(queue):
+    """Writer thread. Write queued messages to the log files & console."""
+    log_files = {}      # Open log files, by name
+    pending_lines = {}  # Lines waiting to be written, by file name
+    flush_time = None   # Time by which pending lines should be written
+    while True:
+        try:
+            timeout = None if flush_time is None else max(flush_time - time.time(), 0)
+            item = queue.get(True, timeout)
+        except Queue.Empty:
+            item = (FLUSH, None)
+        try:
+            if item[0] in (FLUSH, CLOSE):
+                (instruction, done_event) = item
+                write_lines(log_files, pending_lines)
+                flush_time = None
+                if instruction == CLOSE:
+                    for log_file in log_files.values():
+                        log_file.close()
+                    log_files.clear()
+                if done_event is not None:
+                    done_event.set()
+                continue
+
+            (file_names, console_text, line) = item
+            for file_name in file_names:
+                pending_lines.setdefault(file_name, []).append(line)
+            if console_text is not None:
+                echo(console_text)
+            if flush_time is None:
+                flush_time = time.time() + FLUSH_INTERVAL
+            elif time.time() >= flush_time:
+                write_lines(log_files, pending_lines)
+                flush_time = None
+        except Exception as e:
+            # Keep the writer alive, or nothing else would get logged. Keep the
+            # lines that weren't written, & reopen the files to try them again
+            # at the next flush, in case the error was passing.
+            sys.stderr.write('script_logging writer error: %s\n' % e)
+            for log_file in log_files.values():
+                try:
+                    log_file.close()
+                except Exception:
+                    pass
+            log_files.clear()
+            drop_excess_lines(pending_lines)
+            flush_time = time.time() + FLUSH_INTERVAL
+            if (item[0] in (FLUSH, CLOSE)) and (item[1] is not None):
+                item[1].set()   # Don't keep the caller waiting.
+
+def send_instruction(instruction):
+    """Queue an instruction for this process's writer thread & wait for it to be carried out."""
+    if writer_pid != os.getpid():
+        return  # Nothing logged in this process yet.
+    done_event = threading.Event()
+    get_queue().put((instruction, done_event))
+    done_event.wait(10)
+
+def log_message(message, level, file_names):
+    """Time stamp a message & queue it for the log files & console."""
+    text = to_unicode(message)
+    line = datetime.datetime.now().strftime('%m-%d-%Y %H:%M:%S..').decode('ascii') + text + u'\n'
+    console_level = ERROR if QUIET else CONSOLE_LEVEL
+    console_text = text if level >= console_level else None
+    get_queue().put((file_names, console_text, line))
 
 
 ########### Logging Functions ###########
 
+def log_debug(message):
+    """Write string to the status log file, if LOG_LEVEL includes debugging detail."""
+    if DEBUG >= LOG_LEVEL:
+        log_message(message, DEBUG, (LOG_FILE_NAME,))
+
 def log_status(message):
     """Write string to a status log file."""
-    write_string_to_file(message, LOG_FILE_NAME)
-    print(message)  # Echo to standard output.
+    if INFO >= LOG_LEVEL:
+        log_message(message, INFO, (LOG_FILE_NAME,))
 
 def log_error(message):
     """Write string to error file."""
-    write_string_to_file(message, ERR_FILE_NAME)
-    log_status(message)     # Error should be recorded to status log for audit as well.
+    # Error should be recorded to status log for audit as well.
+    log_message(message, ERROR, (ERR_FILE_NAME, LOG_FILE_NAME))
+
+def log_event(event, **fields):
+    """Write a structured event to the events file.
+    event -- Name of the event, e.g. 'download'.
+    fields -- Values describing the event, which can be written as JSON.
+    """
+    record = {
+        'time': datetime.datetime.now().isoformat(),
+        'run': run_id,
+        'pid': os.getpid(),
+        'event': event }
+    record.update(fields)
+    line = json.dumps(record, default=unicode).decode('ascii') + u'\n'
+    get_queue().put(((EVENTS_FILE_NAME,), None, line))
+
+@contextlib.contextmanager
+def timed(event, **fields):
+    """Context manager that logs an event with the seconds the block took.
+    The block can add fields to the event through the dictionary it gets, e.g.:
+        with script_logging.timed('write_csv', file=file_path) as fields:
+            fields['bytes'] = ...
+    If the block raises an exception, the event records its class.
+    """
+    start_time = time.time()
+    try:
+        yield fields
+    except Exception as e:
+        fields['error'] = e.__class__.__name__
+        raise
+    finally:
+        log_event(event, duration=time.time() - start_time, **fields)
+
+def set_quiet(quiet=True):
+    """Turn quiet console mode on or off. In quiet mode, only errors are echoed to standard output."""
+    global QUIET
+    QUIET = quiet
+
+def parse_logging_args():
+    """Apply the logging options on the command line, & take them out of sys.argv,
+    so scripts that read their arguments from it don't trip over them.
+    Call before anything else reads sys.argv, like stage_profiler.parse_profile_arg().
+    """
+    global LOG_LEVEL
+    if QUIET_ARG in sys.argv[1:]:
+        sys.argv.remove(QUIET_ARG)
+        set_quiet()
+    if DEBUG_ARG in sys.argv[1:]:
+        sys.argv.remove(DEBUG_ARG)
+        LOG_LEVEL = DEBUG
+
+def flush():
+    """Write out messages queued by this process."""
+    send_instruction(FLUSH)
 
 def clear_status_log():
     """Delete status log file."""
+    send_instruction(CLOSE)
     if os.path.isfile(LOG_FILE_NAME):
         os.remove(LOG_FILE_NAME)
 
 def clear_error_log():
     """Delete error file. Existence of error file can be used to test for errors."""
+    send_instruction(CLOSE)
     if os.path.isfile(ERR_FILE_NAME):
         os.remove(ERR_FILE_NAME)
 
+def clear_event_log():
+    """Delete events file."""
+    send_instruction(CLOSE)
+    if os.path.isfile(EVENTS_FILE_NAME):
+        os.remove(EVENTS_FILE_NAME)
+
 def clear_logs():
     """Delete all log files."""
     clear_status_log()
-    clear_error_log()
\ No newline at end of file
+    clear_error_log()
+    clear_event_log()
+
+atexit.register(flush)
@@ -0,0 +1,317 @@
+"""Full-text search index over exported submission text, submission comments
+& rubric assessment comments, so staff can find which students' work mentions
+a phrase without grepping thousands of csv files.
+
+export_student_artifacts.py builds the index as it exports each course.
+The index is split into a shard for each course, kept in a hidden folder in
+the exports folder & named after the Canvas course ID. A shard is an inverted
+index that maps each word to the documents containing it & the word's
+positions in them, so phrases can be matched without rescanning any text:
+
+    {"course": "CalStateTEACH Term 1",
+     "docs": [["grios", "Lesson Plan 1", "comment", "mentor", "Nice work on the ..."], ...],
+     "terms": {"work": [[0, 2], [7, 15, 40]], ...}}
+
+Each document is a list of [student folder, assignment name, kind, author,
+snippet of the text]. Each term maps to a list of [document number, positions...].
+
+Shards are written as JSON wrapped in a line of script, so the search page
+in the exports folder can load them from a file share, where browsers won't
+fetch() JSON files. The folder also has a script listing the course shards.
+
+Search from the command line with:
+    python search_index.py "some phrase" [--course <course ID>]
+
+10.19.2026 tps Created.
+10.19.2026 tps Split writing the search page out of clear_index(), for the pipeline runner.
+10.19.2026 tps Replace index files & the search page with file_lock.replace_file().
+"""
+
+import HTMLParser
+import json
+import os
+import re
+import shutil
+import sys
+
+import file_lock
+import path_consts
+import script_logging
+
+#################### Constants ####################
+
+# Kinds of documents
+KIND_SUBMISSION = 'submission'
+KIND_COMMENT    = 'comment'
+KIND_RUBRIC     = 'rubric'
+
+SNIPPET_LENGTH = 200    # Characters of a document's text to keep for displaying search results
+SHARD_FILE_EXTENSION = '.js'
+COURSE_LIST_FILE_NAME = 'courses.js'
+
+# Lines wrapped around the JSON data in shard & course list files.
+SHARD_PREFIX = 'window.searchShards = window.searchShards || {};\nwindow.searchShards[%s] =\n'
+COURSE_LIST_PREFIX = 'window.searchCourses =\n'
+SCRIPT_SUFFIX = ';\n'
+
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+TAG_PATTERN = re.compile(r'<[^>]*>')
+
+# Static search page for the exports folder. It loads the course list & then
+# every shard the 1st time someone searches, & matches phrases the same way search() does.
+SEARCH_PAGE_HTML = u'''<!doctype html>
+<html lang="en">
+<head>
+    <meta charset="utf-8">
+    <title>Search Artifact Exports</title>
+</head>
+<body>
+<A HREF="index.html">Artifact Exports</A>
+<H1>Search Artifact Exports</H1>
+<P>Find submissions, comments &amp; rubric comments containing a word or phrase.</P>
+<FORM ID="search"><INPUT ID="query" TYPE="search" SIZE="60"> <INPUT TYPE="submit" VALUE="Search"></FORM>
+<P ID="status"></P>
+<DIV ID="results"></DIV>
+<SCRIPT>
+(function () {
+    var MAX_RESULTS = 500;
+    var WORD_PATTERN = /[\\p{L}\\p{N}_]+/gu;
+    var form = document.getElementById('search');
+    var status = document.getElementById('status');
+    var results = document.getElementById('results');
+
+    function loadScript(src, callback) {
+        var script = document.createElement('script');
+        script.src = src;
+        script.onload = callback;
+        document.head.appendChild(script);
+    }
+
+    function loadShards(callback) {
+        if (window.searchCourses && Object.keys(window.searchShards || {}).length === window.searchCourses.length) {
+            callback();
+            return;
+        }
+        status.textContent = 'Loading search index...';
+        loadScript('%(folder)s/%(course_list)s', function () {
+            var remaining = window.searchCourses.length;
+            if (remaining === 0) {
+                callback();
+            }
+            window.searchCourses.forEach(function (course) {
+                loadScript('%(folder)s/' + course[0] + '%(extension)s', function () {
+                    remaining -= 1;
+                    if (remaining === 0) {
+                        callback();
+                    }
+                });
+            });
+        });
+    }
+
+    function escapeHtml(text) {
+        return text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+    }
+
+    function searchShard(shard, words) {
+        var matches = [];
+        var firstPostings = shard.terms[words[0]] || [];
+        var otherPositions = words.slice(1).map(function (word) {
+            var positions = {};
+            (shard.terms[word] || []).forEach(function (posting) {
+                positions[posting[0]] = posting.slice(1);
+            });
+            return positions;
+        });
+        firstPostings.forEach(function (posting) {
+            var doc = posting[0];
+            var found = posting.slice(1).some(function (start) {
+                return otherPositions.every(function (positions, i) {
+                    return (positions[doc] || []).indexOf(start + i + 1) >= 0;
+                });
+            });
+            if (found) {
+                matches.push(shard.docs[doc]);
+            }
+        });
+        return matches;
+    }
+
+    function showResults() {
+        var words = document.getElementById('query').value.toLowerCase().match(WORD_PATTERN) || [];
+        var items = [];
+        var count = 0;
+        if (words.length > 0) {
+            window.searchCourses.forEach(function (course) {
+                var shard = window.searchShards[course[0]];
+                searchShard(shard, words).forEach(function (doc) {
+                    count += 1;
+                    if (items.length < MAX_RESULTS) {
+                        items.push('<LI><A HREF="' + encodeURIComponent(shard.course) + '/' + encodeURIComponent(doc[0])
+                            + '/index.html">' + escapeHtml(doc[0]) + '</A> (' + escapeHtml(shard.course) + '), '
+                            + escapeHtml(doc[1]) + ', ' + doc[2] + ' by ' + escapeHtml(doc[3])
+                            + '<BR><SMALL>' + escapeHtml(doc[4]) + '</SMALL></LI>');
+                    }
+                });
+            });
+        }
+        status.textContent = count + ' matches';
+        results.innerHTML = items.length ? '<UL>' + items.join('') + '</UL>' : '';
+    }
+
+    form.addEventListener('submit', function (event) {
+        event.preventDefault();
+        loadShards(showResults);
+    });
+})();
+</SCRIPT>
+</body>
+</html>
+''' % {
+    'folder': os.path.basename(path_consts.SEARCH_INDEX_FOLDER),
+    'course_list': COURSE_LIST_FILE_NAME,
+    'extension': SHARD_FILE_EXTENSION }
+
+#################### Module Variables ####################
+
+html_parser = HTMLParser.HTMLParser()   # For unescaping HTML entities in submission text.
+
+#################### Helper Functions ####################
+
+def get_shard_file_name(course_id):
+    return os.path.join(path_consts.SEARCH_INDEX_FOLDER, '%s%s' % (course_id, SHARD_FILE_EXTENSION))
+
+def get_text(html):
+    """Return the text of an HTML fragment, without tags & with entities unescaped."""
+    return html_parser.unescape(TAG_PATTERN.sub(u' ', html))
+
+def tokenize(text):
+    """Return list of the lowercase words in a string."""
+    return WORD_PATTERN.findall(text.lower())
+
+def make_document(student, assignment_name, kind, author, text):
+    """Return dictionary describing a document to index. All the values are unicode strings."""
+    return {
+        'student': student,
+        'assignment': assignment_name,
+        'kind': kind,
+        'author': author,
+        'text': text }
+
+def write_script(file_name, prefix, data):
+    """Write data as JSON wrapped in a script, through a temporary file.
+    The JSON goes on a line of its own, so read_script() can find it.
+    """
+    temp_file_name = '%s.%s.tmp' % (file_name, os.getpid())
+    with open(temp_file_name, 'wb') as f:
+        f.write(prefix)
+        json.dump(data, f, separators=(',', ':'))
+        f.write('\n' + SCRIPT_SUFFIX)
+    file_lock.replace_file(temp_file_name, file_name)
+
+def read_script(file_name):
+    """Return the JSON data in a script written by write_script()."""
+    with open(file_name, 'rb') as f:
+        lines = f.readlines()
+    return json.loads(lines[-2])
+
+#################### Index Building Functions ####################
+
+def clear_index():
+    """Remove the search index from an earlier export, & write the search page."""
+    if os.path.isdir(path_consts.SEARCH_INDEX_FOLDER):
+        shutil.rmtree(path_consts.SEARCH_INDEX_FOLDER)
+    os.mkdir(path_consts.SEARCH_INDEX_FOLDER)
+    write_search_page()
+
+def write_search_page():
+    """Write the search page to the exports folder."""
+    temp_file_name = path_consts.SEARCH_PAGE_FILE_NAME + '.tmp'
+    with open(temp_file_name, 'wb') as f:
+        f.write(SEARCH_PAGE_HTML.encode('utf-8'))
+    file_lock.replace_file(temp_file_name, path_consts.SEARCH_PAGE_FILE_NAME)
+
+def write_course_index(course_id, course_name, documents):
+    """Build the search index shard for a course from a list of documents made by make_document()."""
+    docs = []
+    terms = {}
+    for document in documents:
+        text = get_text(document['text'])
+        words = tokenize(text)
+        if not words:
+            continue
+        doc_number = len(docs)
+        docs.append([document['student'], document['assignment'], document['kind'], document['author'],
+            u' '.join(text.split())[:SNIPPET_LENGTH]])
+
+        # Gather each word's positions in the document.
+        word_positions = {}
+        for (position, word) in enumerate(words):
+            word_positions.setdefault(word, []).append(position)
+        for (word, positions) in word_positions.iteritems():
+            terms.setdefault(word, []).append([doc_number] + positions)
+
+    script_logging.log_status('Indexed %s documents & %s words for course %s' % (len(docs), len(terms), course_id))
+    write_script(get_shard_file_name(course_id), SHARD_PREFIX % json.dumps(unicode(course_id)),
+        { 'course': course_name, 'docs': docs, 'terms': terms })
+
+def write_course_list(courses):
+    """Write the list of course shards for the search page.
+    courses -- List of (course ID, course name) tuples.
+    """
+    write_script(os.path.join(path_consts.SEARCH_INDEX_FOLDER, COURSE_LIST_FILE_NAME), COURSE_LIST_PREFIX,
+        [[unicode(course_id), course_name] for (course_id, course_name) in courses])
+
+#################### Search Functions ####################
+
+def search_shard(shard, words):
+    """Return list of documents in a shard that contain the words as a phrase."""
+    terms = shard['terms']
+    if not words or words[0] not in terms:
+        return []
+
+    # Positions of the rest of the phrase's words, by document.
+    other_positions = []
+    for word in words[1:]:
+        other_positions.append(dict((posting[0], set(posting[1:])) for posting in terms.get(word, [])))
+
+    matches = []
+    for posting in terms[words[0]]:
+        doc_number = posting[0]
+        for start in posting[1:]:
+            if all((start + i + 1) in positions.get(doc_number, ()) for (i, positions) in enumerate(other_positions)):
+                matches.append(shard['docs'][doc_number])
+                break
+    return matches
+
+def search(phrase, course_ids=None):
+    """Return list of (course name, document) tuples for documents containing a phrase.
+    course_ids -- List of IDs of the courses to search, or None to search them all.
+    """
+    words = tokenize(phrase)
+    if course_ids is None:
+        course_list = read_script(os.path.join(path_consts.SEARCH_INDEX_FOLDER, COURSE_LIST_FILE_NAME))
+        course_ids = [course_id for (course_id, course_name) in course_list]
+
+    results = []
+    for course_id in course_ids:
+        shard = read_script(get_shard_file_name(course_id))
+        results += [(shard['course'], doc) for doc in search_shard(shard, words)]
+    return results
+
+
+######### Stand-Alone Execution #########
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    course_ids = None
+    if '--course' in args:
+        i = args.index('--course')
+        course_ids = [args[i + 1]]
+        del args[i:i + 2]
+    phrase = ' '.join(args).decode(sys.stdin.encoding or 'utf-8')
+
+    results = search(phrase, course_ids)
+    for (course_name, (student, assignment_name, kind, author, snippet)) in results:
+        print((u'%s / %s / %s: %s by %s\n    %s' % (course_name, student, assignment_name, kind, author, snippet)).encode('utf-8'))
+    print('%s matches' % len(results))
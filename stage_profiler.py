@@ -0,0 +1,192 @@
+"""Optional CPU & memory profiling of the pipeline stages, so a slow nightly
+run can be diagnosed from its own output instead of re-running stages by hand
+under cProfile.
+
+run_all.py & each stage script accept a --profile command line option.
+Call parse_profile_arg() before anything else reads sys.argv, since
+json_artifacts.py takes every command line argument for a course ID.
+Then run each stage with run_stage(), which always logs a stage event with
+the stage's duration. With profiling on, it also:
+- Runs the stage under cProfile & saves the stats to profiles/<stage>.pstats,
+  for loading with the pstats module or a viewer like snakeviz, along with
+  profiles/<stage>.txt listing the functions with the most cumulative time.
+- Measures peak memory during the stage. Uses tracemalloc where the Python
+  version has it. Otherwise uses the process's peak resident set size, which
+  is reset at the start of each stage where Linux allows it, & otherwise
+  covers the life of the process so far.
+- Adds the stage to a summary table, profiles/profile_summary.txt, with
+  wall clock & CPU seconds & peak memory. Stages profiled by separate
+  scripts are merged into the same table.
+
+cProfile only sees the thread that runs the stage. Time spent by download
+worker threads & HTML worker processes shows up as waiting in the stage's
+thread, though worker processes' CPU time is counted in the summary table.
+
+10.19.2026 tps Created.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+
+import script_logging
+
+try:
+    import resource     # Not available on Windows.
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc  # Python 3.4 or later.
+except ImportError:
+    tracemalloc = None
+
+#################### Constants ####################
+
+PROFILE_ARG = '--profile'
+PROFILE_FOLDER = os.path.join(os.path.dirname(script_logging.LOG_FILE_NAME), 'profiles')   # Next to log.txt.
+SUMMARY_DATA_FILE_NAME = os.path.join(PROFILE_FOLDER, 'profile_summary.json')
+SUMMARY_FILE_NAME = os.path.join(PROFILE_FOLDER, 'profile_summary.txt')
+TOP_FUNCTION_COUNT = 40     # Number of functions to list in each stage's text report
+
+#################### Module Variables ####################
+
+enabled = False     # Set by parse_profile_arg().
+
+#################### Memory Functions ####################
+
+def read_peak_rss():
+    """Return peak resident set size of this process in bytes from /proc, or None if it's not available."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+    return None
+
+def reset_peak_rss():
+    """Try to reset the peak resident set size, so it covers just the next stage.
+    Returns True if it was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except IOError:
+        return False
+
+def get_max_rss():
+    """Return peak resident set size over the life of this process in bytes, or None if it's not available."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss      # Already in bytes.
+    return max_rss * 1024
+
+def start_memory_tracking():
+    """Start measuring peak memory. Returns description of how it's measured."""
+    if tracemalloc is not None:
+        tracemalloc.start()
+        return 'tracemalloc'
+    if (read_peak_rss() is not None) and reset_peak_rss():
+        return 'peak RSS'
+    return 'peak RSS (process lifetime)'
+
+def stop_memory_tracking():
+    """Stop measuring peak memory. Returns peak bytes, or None if it couldn't be measured."""
+    if tracemalloc is not None:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak_bytes
+    peak_bytes = read_peak_rss()
+    if peak_bytes is None:
+        peak_bytes = get_max_rss()
+    return peak_bytes
+
+#################### Summary Functions ####################
+
+def format_megabytes(byte_count):
+    if byte_count is None:
+        return 'unknown'
+    return '%.1f' % (byte_count / (1024.0 * 1024.0))
+
+def update_summary(stage, result):
+    """Add a stage's measurements to the summary table, replacing any earlier ones for the stage."""
+    summary = {}
+    if os.path.isfile(SUMMARY_DATA_FILE_NAME):
+        with open(SUMMARY_DATA_FILE_NAME, 'r') as f:
+            summary = json.load(f)
+    summary[stage] = result
+    with open(SUMMARY_DATA_FILE_NAME, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    lines = ['%-28s %-20s %10s %10s %12s %10s  %s'
+        % ('stage', 'started', 'wall s', 'cpu s', 'child cpu s', 'peak MB', 'memory measured by')]
+    for (name, result) in sorted(summary.items(), key=lambda item: item[1]['started_at']):
+        started = time.strftime('%m-%d-%Y %H:%M:%S', time.localtime(result['started_at']))
+        lines.append('%-28s %-20s %10.1f %10.1f %12.1f %10s  %s' % (name, started, result['wall_seconds'], result['cpu_seconds'],
+            result['child_cpu_seconds'], format_megabytes(result['peak_bytes']), result['memory_source']))
+    with open(SUMMARY_FILE_NAME, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def write_stats(stage, profiler):
+    """Save a stage's profile stats & a text report of its most expensive functions."""
+    stats_file_name = os.path.join(PROFILE_FOLDER, stage + '.pstats')
+    profiler.dump_stats(stats_file_name)
+    with open(os.path.join(PROFILE_FOLDER, stage + '.txt'), 'w') as f:
+        stats = pstats.Stats(stats_file_name, stream=f)
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTION_COUNT)
+    return stats_file_name
+
+#################### Stage Functions ####################
+
+def parse_profile_arg():
+    """Turn profiling on if the command line has the profiling option, & take the option
+    out of sys.argv, so scripts that read their arguments from it don't trip over it.
+    Returns True if profiling is on.
+    """
+    global enabled
+    if PROFILE_ARG in sys.argv[1:]:
+        sys.argv.remove(PROFILE_ARG)
+        enabled = True
+    return enabled
+
+def run_stage(stage, function, *args, **kwargs):
+    """Run a pipeline stage by calling function with the given arguments,
+    profiling it if profiling is on. Returns what the function returns.
+    """
+    if not enabled:
+        with script_logging.timed('stage', stage=stage):
+            return function(*args, **kwargs)
+
+    if not os.path.isdir(PROFILE_FOLDER):
+        os.makedirs(PROFILE_FOLDER)
+    profiler = cProfile.Profile()
+    memory_source = start_memory_tracking()
+    start_times = os.times()
+    start_time = time.time()
+    try:
+        with script_logging.timed('stage', stage=stage):
+            return profiler.runcall(function, *args, **kwargs)
+    finally:
+        wall_seconds = time.time() - start_time
+        end_times = os.times()
+        peak_bytes = stop_memory_tracking()
+        result = {
+            'started_at': start_time,
+            'wall_seconds': wall_seconds,
+            'cpu_seconds': (end_times[0] + end_times[1]) - (start_times[0] + start_times[1]),
+            'child_cpu_seconds': (end_times[2] + end_times[3]) - (start_times[2] + start_times[3]),
+            'peak_bytes': peak_bytes,
+            'memory_source': memory_source }
+        stats_file_name = write_stats(stage, profiler)
+        update_summary(stage, result)
+        script_logging.log_event('profile', stage=stage, **result)
+        script_logging.log_status('Profiled stage %s: %.1f seconds, %.1f CPU seconds, %sMB %s. Stats in %s'
+            % (stage, wall_seconds, result['cpu_seconds'], format_megabytes(peak_bytes), memory_source, stats_file_name))
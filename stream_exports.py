@@ -0,0 +1,202 @@
+"""Export student folders, download their files & make their HTML pages all
+at once, handing each student folder on as soon as it's written, instead of
+waiting for each step to finish every course before the next step starts.
+
+export_student_artifacts.write_student_folders() publishes each student
+folder to 2 bounded queues, one read by a pool of download worker threads
+& one by HTML worker threads. So the 1st students' pages appear as soon as
+their folders are written, & the run takes about as long as its slowest
+step, instead of as long as all the steps added together. When a queue
+fills up, the export waits for its workers to catch up, so student data
+piles up in memory for at most STREAM_QUEUE_SIZE students.
+
+The HTML workers make each published student's page from the student data
+in memory, skipping pages whose inputs haven't changed, like make_html.py.
+After the export, pages are made for student & course folders left over
+from earlier exports, & then the course pages & the top-level page.
+
+The download workers share one download ledger & failure store, like the
+worker threads of download_planner.run_downloads(). Since downloads start
+before the export knows how much there is to download, there's no disk space
+check or ordering for throughput, & thumbnails are downloaded from Canvas.
+The download queue files are still written, so the download scripts &
+retry_download_errors.py work the same as after a normal export.
+
+Run the export, downloads & HTML pages with:
+    python stream_exports.py [--download-workers N] [--html-workers N] [--profile]
+
+or run_all.py --stream to retrieve the JSON data first & retry failed downloads after.
+
+10.19.2026 tps Created.
+10.19.2026 tps Choose download options by task kind, with the defaults of the download scripts.
+"""
+
+import os
+import Queue
+import sys
+import threading
+import time
+
+import download_attachments
+import download_failures
+import download_ledger
+import download_media_recordings
+import download_metrics
+import download_planner
+import download_queue
+import export_student_artifacts
+import make_html
+import path_consts
+import script_logging
+import stage_profiler
+
+#################### Constants ####################
+
+STREAM_QUEUE_SIZE = 32      # Most student folders waiting in each queue
+STREAM_DOWNLOAD_WORKERS = download_planner.DOWNLOAD_WORKERS  # Number of download worker threads
+STREAM_HTML_WORKERS = 1     # Number of HTML worker threads
+
+DONE = None     # Put on a queue for each of its workers after the last student folder.
+
+#################### Worker Functions ####################
+
+def get_student_folder_path(student_folder):
+    return os.path.join(path_consts.EXPORTS_FOLDER,
+        student_folder[export_student_artifacts.STREAM_KEY_COURSE_FOLDER],
+        student_folder[export_student_artifacts.STREAM_KEY_STUDENT_FOLDERS][student_folder[export_student_artifacts.STREAM_KEY_PAGE_INDEX]])
+
+def run_stream_task(ledger, failures, task, segmented, use_blob_store):
+    """Download one task, with the options for its kind, like retry_download_errors.retry_task().
+    Only media recordings are segmented, & only attachments & thumbnails use the blob store.
+    """
+    if task['kind'] == download_queue.KIND_MEDIA:
+        return download_queue.run_task(ledger, failures, task, segmented=segmented)
+    else:
+        return download_queue.run_task(ledger, failures, task, use_blob_store=use_blob_store)
+
+def download_student_folders(student_queue, ledger, failures, segmented, use_blob_store):
+    """Download worker thread. Download the files of each student folder from the queue until DONE comes through."""
+    while True:
+        student_folder = student_queue.get()
+        if student_folder is DONE:
+            break
+        tasks = student_folder[export_student_artifacts.STREAM_KEY_DOWNLOADS]
+        if not tasks:
+            continue
+        try:
+            with script_logging.timed('stream_download',
+                    course_id=student_folder[export_student_artifacts.STREAM_KEY_COURSE_ID],
+                    student_folder=get_student_folder_path(student_folder),
+                    files=len(tasks)):
+                for task in tasks:
+                    # run_task() records failed downloads, so one bad file doesn't stop the rest.
+                    run_stream_task(ledger, failures, task, segmented, use_blob_store)
+        except Exception as e:
+            # Keep going, so the export never waits on a worker that's gone.
+            script_logging.log_error('Error downloading files for %s: %s' % (get_student_folder_path(student_folder), e))
+
+def render_student_folders(student_queue, made_pages, made_pages_lock, force):
+    """HTML worker thread. Make the page of each student folder from the queue until DONE comes through.
+    made_pages -- Dictionary to add the names of the student folders whose pages are
+        up to date to, in sets keyed by course folder name.
+    """
+    while True:
+        student_folder = student_queue.get()
+        if student_folder is DONE:
+            break
+        course_folder = student_folder[export_student_artifacts.STREAM_KEY_COURSE_FOLDER]
+        student_folders_list = student_folder[export_student_artifacts.STREAM_KEY_STUDENT_FOLDERS]
+        page_index = student_folder[export_student_artifacts.STREAM_KEY_PAGE_INDEX]
+        try:
+            with script_logging.timed('stream_html',
+                    course=make_html.to_unicode(course_folder),
+                    student_folder=get_student_folder_path(student_folder)) as fields:
+                fields['made'] = make_html.make_student_page_if_changed(
+                    os.path.join(path_consts.EXPORTS_FOLDER, course_folder),
+                    page_index,
+                    student_folders_list,
+                    student_folder[export_student_artifacts.STREAM_KEY_CSV_LISTS],
+                    force)
+        except Exception as e:
+            # Keep going, so the export never waits on a worker that's gone.
+            # The page is made again from the csv files after the export.
+            script_logging.log_error('Error making page for %s: %s' % (get_student_folder_path(student_folder), e))
+            continue
+        with made_pages_lock:
+            made_pages.setdefault(make_html.to_unicode(course_folder), set()).add(
+                make_html.to_unicode(student_folders_list[page_index]))
+
+def start_workers(worker_count, target, *args):
+    """Start worker threads. Returns list of the threads."""
+    threads = []
+    for i in range(worker_count):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    return threads
+
+#################### Streaming Functions ####################
+
+def stream_student_folders(download_workers=STREAM_DOWNLOAD_WORKERS, html_workers=STREAM_HTML_WORKERS,
+        segmented=download_media_recordings.SEGMENTED_DOWNLOADS, use_blob_store=download_attachments.USE_BLOB_STORE,
+        force=False):
+    """Export student folders, & download their files & make their HTML pages as they're exported.
+    segmented -- Download media recordings in segments, like download_media_recordings.py.
+    use_blob_store -- Keep attachments & thumbnails in the blob store, like download_attachments.py.
+    force -- Make every HTML page, even ones whose inputs haven't changed.
+    """
+    start_time = time.time()
+    download_student_queue = Queue.Queue(STREAM_QUEUE_SIZE)
+    html_student_queue = Queue.Queue(STREAM_QUEUE_SIZE)
+    made_pages = {}
+    made_pages_lock = threading.Lock()
+
+    ledger = download_ledger.load_ledger()
+    failures = download_failures.load_failures()
+    try:
+        download_threads = start_workers(download_workers, download_student_folders,
+            download_student_queue, ledger, failures, segmented, use_blob_store)
+        html_threads = start_workers(html_workers, render_student_folders,
+            html_student_queue, made_pages, made_pages_lock, force)
+        try:
+            export_student_artifacts.write_student_folders(student_queues=[download_student_queue, html_student_queue])
+            script_logging.log_status('Exported student folders in %.1f seconds, waiting for downloads & pages to finish'
+                % (time.time() - start_time))
+        finally:
+            # Stop the workers even if the export failed, once they've finished what was published.
+            for thread in download_threads:
+                download_student_queue.put(DONE)
+            for thread in html_threads:
+                html_student_queue.put(DONE)
+            for thread in html_threads + download_threads:
+                thread.join()
+    finally:
+        download_ledger.save_ledger(ledger)
+        download_failures.save_failures(failures)
+        download_metrics.write_report()
+
+    # Make pages for the folders that weren't published, & the course & top-level pages.
+    made_count = 0
+    for course_folder in make_html.get_subdirs(path_consts.EXPORTS_FOLDER):
+        made_count += make_html.make_course_pages(course_folder, force,
+            student_folders_done=made_pages.get(make_html.to_unicode(course_folder)))[0]
+    make_html.make_exports_html(force)
+    script_logging.log_status('Streamed %s student folders in %.1f seconds, & made %s pages for other student folders'
+        % (sum(len(students) for students in made_pages.values()), time.time() - start_time, made_count))
+
+
+######### Stand-Alone Execution #########
+
+if __name__ == "__main__":
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
+    script_logging.clear_logs()
+    args = sys.argv[1:]
+    download_workers = STREAM_DOWNLOAD_WORKERS
+    if '--download-workers' in args:
+        download_workers = int(args[args.index('--download-workers') + 1])
+    html_workers = STREAM_HTML_WORKERS
+    if '--html-workers' in args:
+        html_workers = int(args[args.index('--html-workers') + 1])
+    stage_profiler.run_stage('stream_exports', stream_student_folders, download_workers, html_workers)
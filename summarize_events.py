@@ -0,0 +1,124 @@
+"""Summarize the timings in the events file written by script_logging.log_event(),
+to see where a run's time went without digging through log.txt.
+
+For each run, prints:
+- The duration of each stage run by run_all.py.
+- For each kind of event, how many there were, the seconds they took in all
+  & on average, the megabytes they moved & how many failed.
+- The courses that took the longest, for each kind of event logged per course.
+
+Events nest, e.g. an assignment's fetch_assignment event includes its
+api_request events, so totals for different kinds of events overlap.
+Events logged by parallel workers overlap in time, so their totals can
+add up to more than the run took.
+
+Usage:
+    python summarize_events.py [--run <run ID> | --all] [--top N] [--file <events file>]
+
+By default, only the latest run in the events file is summarized.
+
+10.19.2026 tps Created.
+"""
+
+import json
+import sys
+
+import script_logging
+
+#################### Constants ####################
+
+TOP_COURSE_COUNT = 5    # Number of slowest courses to list for each kind of event
+
+#################### Helper Functions ####################
+
+def load_events(file_name):
+    """Return list of the events in an events file, in the order they were logged."""
+    events = []
+    with open(file_name, 'r') as f:
+        for line in f:
+            if line.strip():
+                events.append(json.loads(line))
+    return events
+
+def group_by_run(events):
+    """Return list of (run ID, list of events) tuples, in the order the runs started."""
+    runs = {}
+    for event in events:
+        runs.setdefault(event['run'], []).append(event)
+    return sorted(runs.items(), key=lambda run: min(event['time'] for event in run[1]))
+
+def get_course(event):
+    """Return the course an event belongs to, or None."""
+    if event.get('course_id') is not None:
+        return event['course_id']
+    return event.get('course')
+
+#################### Summary Functions ####################
+
+def summarize_run(run_id, events, top_count=TOP_COURSE_COUNT):
+    """Return list of lines summarizing the events from a run."""
+    lines = []
+    times = sorted(event['time'] for event in events)
+    lines.append('Run %s, %s to %s, %s events' % (run_id, times[0], times[-1], len(events)))
+
+    stages = [event for event in events if event['event'] == 'stage']
+    if stages:
+        lines.append('')
+        lines.append('%-28s %10s %8s' % ('stage', 'seconds', 'error'))
+        for event in stages:
+            lines.append('%-28s %10.1f %8s' % (event['stage'], event['duration'], event.get('error') or ''))
+
+    # Totals for each kind of event.
+    totals = {}
+    for event in events:
+        if event['event'] == 'stage':
+            continue
+        total = totals.setdefault(event['event'], {'count': 0, 'seconds': 0.0, 'bytes': 0, 'errors': 0})
+        total['count'] += 1
+        total['seconds'] += event.get('duration') or 0.0
+        total['bytes'] += event.get('bytes') or 0
+        if event.get('error'):
+            total['errors'] += 1
+    lines.append('')
+    lines.append('%-20s %8s %10s %10s %10s %8s' % ('event', 'count', 'seconds', 'mean', 'MB', 'errors'))
+    for (name, total) in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        lines.append('%-20s %8s %10.1f %10.3f %10.1f %8s' % (name, total['count'], total['seconds'],
+            total['seconds'] / total['count'], total['bytes'] / (1024.0 * 1024.0), total['errors']))
+
+    # Slowest courses for each kind of event logged per course.
+    course_seconds = {}
+    for event in events:
+        course = get_course(event)
+        if (course is None) or (event['event'] == 'stage'):
+            continue
+        by_course = course_seconds.setdefault(event['event'], {})
+        by_course[course] = by_course.get(course, 0.0) + (event.get('duration') or 0.0)
+    for (name, by_course) in sorted(course_seconds.items()):
+        lines.append('')
+        lines.append('Slowest courses for %s:' % name)
+        for (course, seconds) in sorted(by_course.items(), key=lambda item: -item[1])[:top_count]:
+            lines.append('    %10.1f  %s' % (seconds, course))
+    return lines
+
+
+######### Stand-Alone Execution #########
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    file_name = script_logging.EVENTS_FILE_NAME
+    if '--file' in args:
+        file_name = args[args.index('--file') + 1]
+    top_count = TOP_COURSE_COUNT
+    if '--top' in args:
+        top_count = int(args[args.index('--top') + 1])
+
+    runs = group_by_run(load_events(file_name))
+    if '--run' in args:
+        run_id = args[args.index('--run') + 1]
+        runs = [run for run in runs if run[0] == run_id]
+    elif '--all' not in args:
+        runs = runs[-1:]
+
+    for (run_id, events) in runs:
+        print(u'\n'.join(summarize_run(run_id, events, top_count)).encode('utf-8'))
+        print('')
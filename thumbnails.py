@@ -0,0 +1,160 @@
+"""Make thumbnail images for image attachments from the downloaded attachment
+files, instead of downloading the thumbnail Canvas renders for each one.
+Fetching Canvas thumbnails costs a 2nd request for every attachment, which
+roughly doubles the request count for courses full of photos & screenshots.
+
+Thumbnails are made with the Python Imaging Library (Pillow), in a pool of
+worker processes, since resizing images keeps a CPU core busy. Each one is
+saved as a PNG file under the thumbnail file name in the attachments csv
+file, so the HTML pages don't care where a thumbnail came from.
+
+Canvas thumbnails are still downloaded for attachments we can't render,
+like documents & videos, for images that fail to open, & for everything
+if Pillow isn't installed.
+
+Thumbnails are recorded in the download ledger, like downloaded files,
+so they're only made again when their attachment changes. A thumbnail is
+only made from an attachment the ledger shows is the current version.
+
+10.19.2026 tps Created.
+10.19.2026 tps Only make thumbnails from attachments the download ledger shows are current.
+10.19.2026 tps Replace thumbnails with file_lock.replace_file().
+"""
+
+import hashlib
+import multiprocessing
+import os
+
+import download_failures
+import download_ledger
+import download_queue
+import file_lock
+import script_logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+#################### Constants ####################
+
+THUMBNAIL_SIZE = (128, 128)     # Largest width & height of a thumbnail, in pixels. Same as Canvas thumbnails.
+THUMBNAIL_WORKERS = None        # Number of worker processes. None uses one for each CPU core.
+
+# Attachment content types we make thumbnails for.
+RENDERABLE_CONTENT_TYPES = set([
+    'image/bmp',
+    'image/gif',
+    'image/jpeg',
+    'image/pjpeg',
+    'image/png',
+    'image/tiff',
+    'image/x-ms-bmp' ])
+
+#################### Helper Functions ####################
+
+def can_render(content_type):
+    """Test if we can make a thumbnail for an attachment with the given content type."""
+    return (Image is not None) and (content_type in RENDERABLE_CONTENT_TYPES)
+
+def split_thumbnail_tasks(tasks):
+    """Split a list of attachment & thumbnail download tasks into the tasks to download
+    & a list of (attachment task, thumbnail task) tuples for thumbnails we can make locally.
+    """
+    attachment_tasks = {}
+    for task in tasks:
+        if task['kind'] == download_queue.KIND_ATTACHMENT:
+            attachment_tasks[(os.path.dirname(task['target']), task['key'])] = task
+
+    download_tasks = []
+    thumbnail_jobs = []
+    for task in tasks:
+        if task['kind'] == download_queue.KIND_THUMBNAIL:
+            # Thumbnail keys are the attachment key with a prefix. See export_student_artifacts.py.
+            attachment_key = task['key'][len('thumbnail_'):]
+            attachment_task = attachment_tasks.get((os.path.dirname(task['target']), attachment_key))
+            if (attachment_task is not None) and can_render(attachment_task['content_type']):
+                thumbnail_jobs.append((attachment_task, task))
+                continue
+        download_tasks.append(task)
+    return (download_tasks, thumbnail_jobs)
+
+def make_thumbnail(file_paths):
+    """Make a thumbnail image from an image file. Runs in a worker process.
+    file_paths -- Tuple of (image file path, thumbnail file path).
+    Returns tuple of (thumbnail file path, hex md5 digest of the thumbnail, error message).
+    The digest is None & the message says why if the thumbnail couldn't be made.
+    """
+    (source_file_path, target_file_path) = file_paths
+    temp_file_name = '%s.%s.tmp' % (target_file_path, os.getpid())
+    try:
+        image = Image.open(source_file_path)
+        image.thumbnail(THUMBNAIL_SIZE, Image.ANTIALIAS)
+        if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.save(temp_file_name, 'PNG')
+        with open(temp_file_name, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+
+        # The old thumbnail may be linked to a file in the blob store, so
+        # replace it instead of writing over it.
+        file_lock.replace_file(temp_file_name, target_file_path)
+        return (target_file_path, digest, None)
+    except Exception as e:
+        if os.path.isfile(temp_file_name):
+            os.remove(temp_file_name)
+        return (target_file_path, None, '%s: %s' % (e.__class__.__name__, e))
+
+#################### Thumbnail Functions ####################
+
+def make_thumbnails(thumbnail_jobs, worker_count=THUMBNAIL_WORKERS):
+    """Make thumbnails from downloaded attachments in worker processes.
+    thumbnail_jobs -- List of (attachment task, thumbnail task) tuples from split_thumbnail_tasks().
+    Thumbnails the download ledger shows are up to date are skipped. Thumbnails of
+    attachments that aren't up to date in the ledger are left to download from Canvas.
+    Returns list of thumbnail tasks that couldn't be made, to download from Canvas instead.
+    """
+    ledger = download_ledger.load_ledger()
+    failures = download_failures.load_failures()
+    try:
+        fallback_tasks = []
+        thumbnail_tasks = {}
+        made_count = 0
+        for (attachment_task, thumbnail_task) in thumbnail_jobs:
+            if download_ledger.is_unchanged(ledger, thumbnail_task['key'], thumbnail_task['updated_at'],
+                    thumbnail_task['size'], thumbnail_task['target']):
+                continue
+            if not download_ledger.is_unchanged(ledger, attachment_task['key'], attachment_task['updated_at'],
+                    attachment_task['size'], attachment_task['target']):
+                # The attachment failed to download. An older version of it may
+                # still be there, but a thumbnail made from that would be out of date.
+                fallback_tasks.append(thumbnail_task)
+                continue
+            thumbnail_tasks[thumbnail_task['target']] = (attachment_task, thumbnail_task)
+        script_logging.log_status('Making %s thumbnails, %s are up to date'
+            % (len(thumbnail_tasks), len(thumbnail_jobs) - len(thumbnail_tasks) - len(fallback_tasks)))
+
+        if thumbnail_tasks:
+            file_paths = [(attachment_task['target'], target_file_path)
+                for (target_file_path, (attachment_task, thumbnail_task)) in thumbnail_tasks.iteritems()]
+            pool = multiprocessing.Pool(worker_count)
+            try:
+                for (target_file_path, digest, error) in pool.imap_unordered(make_thumbnail, file_paths, chunksize=4):
+                    thumbnail_task = thumbnail_tasks[target_file_path][1]
+                    if error is not None:
+                        script_logging.log_status("Can't make thumbnail %s, downloading it instead: %s" % (target_file_path, error))
+                        fallback_tasks.append(thumbnail_task)
+                        continue
+                    download_ledger.record(ledger, thumbnail_task['key'], thumbnail_task['updated_at'],
+                        thumbnail_task['size'], target_file_path, digest)
+                    download_failures.record_success(failures, thumbnail_task)
+                    made_count += 1
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        download_ledger.save_ledger(ledger)
+        download_failures.save_failures(failures)
+
+    script_logging.log_status('Made %s thumbnails, %s to download from Canvas' % (made_count, len(fallback_tasks)))
+    return fallback_tasks
@@ -0,0 +1,175 @@
+"""Verify the downloaded files in the exports folder, to find files that are
+missing, empty or truncated after a long download run without having to
+download everything again.
+
+For each student folder, the files expected by the student's attachments.csv
+& the media recording columns of submissions.csv are checked against:
+- The attachment size Canvas reported.
+- The md5 digest the download ledger recorded when the file was downloaded.
+Files are hashed in parallel, using a worker process for each CPU core.
+
+Every file that fails verification is dropped from the download ledger &
+added to the download failure store, ready for retry_download_errors.py to
+download again. The failure store entry gives the reason the file failed.
+
+Run with --quick to check just file sizes, without hashing anything.
+
+10.19.2026 tps Created.
+10.19.2026 tps Accept --profile, to profile the stage. See stage_profiler.py.
+10.19.2026 tps Pass empty files that Canvas lists with a size of 0.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import sys
+
+import download_failures
+import download_ledger
+import download_queue
+import export_student_artifacts
+import make_html
+import path_consts
+import script_logging
+import stage_profiler
+
+#################### Constants ####################
+
+HASH_CHUNK_SIZE = 1024 * 1024   # Bytes to read from a file at a time when hashing it
+
+#################### Exceptions ####################
+
+class VerificationError(Exception):
+    """Downloaded file is missing or doesn't match what we expected."""
+    pass
+
+#################### Helper Functions ####################
+
+def hash_file(file_path):
+    """Return tuple of (file path, hex md5 digest of the file).
+    Runs in a worker process.
+    """
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            md5.update(chunk)
+    return (file_path, md5.hexdigest())
+
+def load_queued_tasks():
+    """Return dictionary of all download queue tasks, keyed by target path."""
+    tasks = download_queue.load_tasks(
+        (download_queue.KIND_ATTACHMENT, download_queue.KIND_THUMBNAIL, download_queue.KIND_MEDIA))
+    return dict((task['target'], task) for task in tasks)
+
+def get_expected_files(student_folder_path):
+    """Return list of download tasks for the files a student folder should contain,
+    built from the student's csv files. The csv files don't have all the Canvas IDs
+    that the download queue has for a task.
+    """
+    expected_files = []
+    canvas_ids = { 'course_id': None, 'assignment_id': None, 'user_id': None }
+
+    attachments = export_student_artifacts.load_csv_file(os.path.join(student_folder_path, path_consts.ATTACHMENTS_FILE_NAME))
+    for attachment in attachments[1:]:  # Skip header row
+        size = int(attachment.size) if attachment.size else None
+        expected_files.append(download_queue.set_target_folder(download_queue.make_task(
+            download_queue.KIND_ATTACHMENT, attachment.url, attachment.file_name,
+            attachment.attachment_id, attachment.updated_at, size, attachment.content_type,
+            file_id=attachment.attachment_id, **canvas_ids), student_folder_path))
+        if attachment.thumbnail_file:
+            expected_files.append(download_queue.set_target_folder(download_queue.make_task(
+                download_queue.KIND_THUMBNAIL, attachment.thumbnail_url, attachment.thumbnail_file,
+                'thumbnail_' + attachment.attachment_id, attachment.updated_at, None, 'image/png',
+                file_id=attachment.attachment_id, **canvas_ids), student_folder_path))
+
+    submissions = export_student_artifacts.load_csv_file(os.path.join(student_folder_path, path_consts.SUBMISSIONS_FILE_NAME))
+    for submission in submissions[1:]:  # Skip header row
+        if submission.submission_type == 'media_recording':
+            expected_files.append(download_queue.set_target_folder(download_queue.make_task(
+                download_queue.KIND_MEDIA, submission.media_url, submission.media_file,
+                'media_' + submission.media_file, submission.submitted_at, None, 'video/mp4',
+                **canvas_ids), student_folder_path))
+
+    return expected_files
+
+def check_size(task):
+    """Return reason a file fails the size checks, or None if it passes."""
+    file_path = task['target']
+    if not os.path.isfile(file_path):
+        return 'File is missing'
+    file_size = os.path.getsize(file_path)
+    if (file_size == 0) and (task['size'] != 0):
+        # Canvas lists some attachments as empty files, so only flag ones it says aren't.
+        return 'File is empty'
+    if (task['size'] is not None) and (file_size != task['size']):
+        return 'File has %s bytes instead of %s' % (file_size, task['size'])
+    return None
+
+#################### Verification Functions ####################
+
+def verify_downloads(check_digests=True):
+    """Verify the downloaded files in every student folder.
+    check_digests -- Hash files to compare with the digests in the download ledger.
+    Returns list of tasks for the files that failed verification.
+    """
+    ledger = download_ledger.load_ledger()
+    failures = download_failures.load_failures()
+    queued_tasks = load_queued_tasks()
+
+    # Gather the files that should be in each student folder.
+    expected_files = []
+    for course_folder in make_html.get_subdirs(path_consts.EXPORTS_FOLDER):
+        course_folder_path = os.path.join(path_consts.EXPORTS_FOLDER, course_folder)
+        for student_folder in make_html.get_subdirs(course_folder_path):
+            expected_files += get_expected_files(os.path.join(course_folder_path, student_folder))
+    script_logging.log_status('Verifying %s files' % len(expected_files))
+
+    # Cheap checks first. Only files that pass them are worth hashing.
+    failed_files = []
+    files_to_hash = {}
+    for task in expected_files:
+        reason = check_size(task)
+        if reason is not None:
+            failed_files.append((task, reason))
+            continue
+        entry = ledger.get(task['key'])
+        if check_digests and (entry is not None) and (task['target'] in entry['paths']):
+            files_to_hash[task['target']] = (task, entry['digest'])
+
+    # Hash files in parallel across CPU cores.
+    if files_to_hash:
+        script_logging.log_status('Hashing %s files' % len(files_to_hash))
+        pool = multiprocessing.Pool()
+        try:
+            for (file_path, digest) in pool.imap_unordered(hash_file, files_to_hash.keys(), chunksize=4):
+                (task, expected_digest) = files_to_hash[file_path]
+                if digest != expected_digest:
+                    failed_files.append((task, 'File digest %s does not match downloaded digest %s' % (digest, expected_digest)))
+        finally:
+            pool.close()
+            pool.join()
+
+    # Queue the failed files to be downloaded again. The download queue has
+    # the full details of a task, including the IDs needed to refresh its URL.
+    for (task, reason) in failed_files:
+        script_logging.log_error("Verification failed '%s': %s" % (task['target'], reason))
+        task = queued_tasks.get(task['target'], task)
+        download_ledger.forget_path(ledger, task['key'], task['target'])
+        download_failures.record_failure(failures, task, VerificationError(reason), delay=0)
+
+    download_ledger.save_ledger(ledger)
+    download_failures.save_failures(failures)
+    script_logging.log_status('Verified %s files, %s need to be downloaded again' % (len(expected_files), len(failed_files)))
+    return [task for (task, reason) in failed_files]
+
+
+######### Stand-Alone Execution #########
+
+if __name__ == "__main__":
+    script_logging.parse_logging_args()
+    stage_profiler.parse_profile_arg()
+    script_logging.clear_logs()
+    stage_profiler.run_stage('verify_downloads', verify_downloads, check_digests=('--quick' not in sys.argv[1:]))